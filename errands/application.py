@@ -4,7 +4,7 @@
 import os
 from subprocess import getoutput
 import subprocess
-from time import sleep
+from time import monotonic, sleep
 
 from gi.repository import Adw, Gio, GLib, Xdp  # type:ignore
 
@@ -134,13 +134,16 @@ class ErrandsApplication(Adw.Application):
         # Logging
         Log.init()
         Log.debug("Application: Startup")
-
-        # User database
-        UserData.init()
+        start: float = monotonic()
 
         # GSettings
         GSettings.init()
 
+        # User database. Storage is selected in settings.
+        UserData.init()
+        if State.PROFILE == "development":
+            UserData.connect_changed(UserData.check_status)
+
         # Background
         self.run_in_background()
 
@@ -156,9 +159,18 @@ class ErrandsApplication(Adw.Application):
         # Main window
         State.main_window = Window(application=State.application)
         self.add_window(State.main_window)
+        Log.info(f"Application: Startup in {(monotonic() - start) * 1000:.1f} ms")
 
         # self.check_reload()
 
+    def do_shutdown(self) -> None:
+        Log.debug("Application: Shutdown")
+
+        # Write changes that are waiting to be saved
+        UserData.close()
+
+        Adw.Application.do_shutdown(self)
+
     def do_activate(self) -> None:
         Log.debug("Application: Activate")
         if not State.main_window:
@@ -4,23 +4,97 @@
 from __future__ import annotations
 
 import datetime
+import fcntl
+import gzip
+import hashlib
 import json
 import os
 import shutil
 import sqlite3
-from copy import deepcopy
-from dataclasses import asdict, dataclass, field
-from queue import Empty, Queue
-from threading import Thread
-from typing import Any, Iterable
+import sys
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort, insort_left
+from contextlib import contextmanager, nullcontext
+from copy import copy
+from dataclasses import dataclass, fields
+from functools import wraps
+from operator import attrgetter
+from threading import Condition, Lock, RLock, Thread, current_thread, main_thread
+from typing import Any, Callable, Iterable, Iterator
+from urllib.parse import quote
 from uuid import uuid4
 
-from gi.repository import GLib  # type:ignore
+from gi.repository import Gio, GLib  # type:ignore
 
 from errands.lib.gsettings import GSettings
 from errands.lib.logging import Log
 from errands.lib.utils import random_hex_color
 
+# TaskData fields with strings repeated across many tasks
+INTERNED_FIELDS: tuple[str] = ("color", "list_uid", "parent")
+# TaskData fields with lists of strings. Stored as tuples.
+TUPLE_FIELDS: tuple[str] = ("attachments", "tags")
+# Sub-tasks of the same parent are sorted by this key
+order_key: Callable[[TaskData], float] = attrgetter("sort_order")
+
+
+def compact_value(prop: str, value: Any) -> Any:
+    """Intern repeated strings and convert lists to tuples to save memory"""
+
+    if prop in TUPLE_FIELDS:
+        # Empty tuple is shared by all tasks
+        return tuple(sys.intern(v) if isinstance(v, str) else v for v in value)
+    if prop in INTERNED_FIELDS and isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+def parse_due_date(value: str) -> float | None:
+    """Get timestamp of date or date-time string. None if it's empty or invalid."""
+
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """
+    Exclusive advisory lock on the file. It's shared with other processes and
+    threads which lock the same file.
+    """
+
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def synchronized(method: Callable) -> Callable:
+    """
+    Decorator for UserDataBase methods. Method is run while holding data lock,
+    so data is not read or changed by other threads at the same time.
+    """
+
+    @wraps(method)
+    def wrapper(self: UserDataBase, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+def format_order_key(key: float) -> str:
+    """Format order key for iCal. Whole numbers are written without fraction."""
+
+    return str(int(key)) if float(key).is_integer() else repr(float(key))
+
 
 @dataclass
 class ErrandsData:
@@ -29,12 +103,21 @@ class ErrandsData:
     tasks: list[TaskData]
 
 
-@dataclass
+@dataclass(slots=True)
 class TagsData:
     text: str
 
+    def to_dict(self) -> dict[str, Any]:
+        """Get fields as dict in the order of declaration. Values are not copied."""
 
-@dataclass
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> TagsData:
+        return cls(**data)
+
+
+@dataclass(slots=True)
 class TaskListData:
     color: str = ""
     deleted: bool = False
@@ -49,6 +132,15 @@ class TaskListData:
         if not self.color:
             self.color = random_hex_color()
 
+    def to_dict(self) -> dict[str, Any]:
+        """Get fields as dict in the order of declaration. Values are not copied."""
+
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> TaskListData:
+        return cls(**data)
+
     def to_ical(self, single_task: str = None) -> str:
         """Build VTODO iCal component from TaskData properties"""
 
@@ -99,9 +191,9 @@ class TaskListData:
         return task_list, tasks
 
 
-@dataclass
+@dataclass(slots=True)
 class TaskData:
-    attachments: list[str] = field(default_factory=lambda: [])
+    attachments: tuple[str, ...] = ()
     color: str = ""
     completed: bool = False
     changed_at: str = ""
@@ -116,9 +208,11 @@ class TaskData:
     percent_complete: int = 0
     priority: int = 0
     rrule: str = ""
+    # None only in tasks from iCal without order key
+    sort_order: float | None = 0.0
     start_date: str = ""
     synced: bool = False
-    tags: list[str] = field(default_factory=lambda: [])
+    tags: tuple[str, ...] = ()
     text: str = ""
     toolbar_shown: bool = False
     trash: bool = False
@@ -132,6 +226,31 @@ class TaskData:
             self.created_at = now
         if not self.changed_at:
             self.changed_at = now
+        self.compact()
+
+    def compact(self) -> None:
+        """Share repeated strings and empty tuples between tasks to save memory"""
+
+        for prop in INTERNED_FIELDS + TUPLE_FIELDS:
+            setattr(self, prop, compact_value(prop, getattr(self, prop)))
+
+    def to_dict(self) -> dict[str, Any]:
+        """Get fields as dict in the order of declaration. Values are not copied."""
+
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> TaskData:
+        return cls(**data)
+
+    def diff(self, other: TaskData, exclude: Iterable[str] = ()) -> list[str]:
+        """Get names of fields which values are different in other task"""
+
+        return [
+            name
+            for name in self.__slots__
+            if name not in exclude and getattr(self, name) != getattr(other, name)
+        ]
 
     def to_ical(self, as_calendar: bool = False) -> str:
         """Build VTODO iCal component from TaskData properties"""
@@ -149,6 +268,8 @@ class TaskData:
         ical += f"RELATED-TO:{self.parent}\n"
         ical += f"PERCENT-COMPLETE:{self.percent_complete}\n"
         ical += f"PRIORITY:{self.priority}\n"
+        if self.sort_order is not None:
+            ical += f"X-APPLE-SORT-ORDER:{format_order_key(self.sort_order)}\n"
         if self.start_date:
             ical += f"DTSTART{';VALUE=DATE' if 'T' not in self.due_date else ''}:{self.start_date}\n"
         ical += f"CATEGORIES:{','.join(self.tags)}\n"
@@ -165,7 +286,7 @@ class TaskData:
     @staticmethod
     def from_ical(ical: str | bytes, list_uid: str) -> TaskData:
         """Build TaskData from iCal string"""
-        task: TaskData = TaskData(list_uid=list_uid)
+        task: TaskData = TaskData(list_uid=list_uid, sort_order=None)
 
         assert ical != ""
 
@@ -197,7 +318,9 @@ class TaskData:
             elif "DESCRIPTION" in prop:
                 task.notes = value
             elif "CATEGORIES" in prop:
-                task.tags = value.split(",") if value else []
+                task.tags = value.split(",") if value else ()
+            elif "X-APPLE-SORT-ORDER" in prop:
+                task.sort_order = float(value)
             elif "X-ERRANDS-COLOR" in prop:
                 task.color = value
             elif "X-ERRANDS-EXPANDED" in prop:
@@ -205,217 +328,682 @@ class TaskData:
             elif "X-ERRANDS-TOOLBAR-SHOWN" in prop:
                 task.toolbar_shown = bool(int(value))
 
+        task.compact()
         return task
 
 
-class UserDataJSON:
+@dataclass(slots=True)
+class DataChange:
+    """
+    Change event passed to callbacks connected with UserData.connect_changes().
+    Events of the same type for the same task or list are merged into one.
+    """
+
+    list_uid: str = ""
+    uid: str = ""
+    # Names of changed fields
+    props: frozenset[str] = frozenset()
+
+    def merge(self, other: DataChange) -> None:
+        self.props = self.props | other.props
+
+
+@dataclass(slots=True)
+class TaskAdded(DataChange):
+    pass
+
+
+@dataclass(slots=True)
+class TaskChanged(DataChange):
+    pass
+
+
+@dataclass(slots=True)
+class TaskMoved(DataChange):
+    """Task's position, parent or list was changed"""
+
+    from_list_uid: str = ""
+
+
+@dataclass(slots=True)
+class TaskRemoved(DataChange):
+    pass
+
+
+@dataclass(slots=True)
+class TasksChanged(DataChange):
+    """Many tasks of the list (or of all lists if list_uid is empty) were changed"""
+
+
+@dataclass(slots=True)
+class ListAdded(DataChange):
+    pass
+
+
+@dataclass(slots=True)
+class ListChanged(DataChange):
+    pass
+
+
+@dataclass(slots=True)
+class ListRemoved(DataChange):
+    pass
+
+
+@dataclass(slots=True)
+class TagsChanged(DataChange):
+    """Tags were added, removed or renamed. Props are the names of the tags."""
+
+
+# update_props() with these props also emits TaskMoved
+MOVE_PROPS: frozenset[str] = frozenset(("list_uid", "parent", "sort_order"))
+# Changes of only these props are not added to undo history
+TASK_LOCAL_PROPS: frozenset[str] = frozenset(
+    ("expanded", "notified", "synced", "toolbar_shown")
+)
+LIST_LOCAL_PROPS: frozenset[str] = frozenset(("show_completed", "synced"))
+
+
+class UserDataBase(ABC):
+    """
+    User data kept in memory with indexes over tasks.
+    Every mutation produces a record which storage writes to disk on flush().
+    """
+
+    # Collect changes for _ ms before writing them to disk
+    FLUSH_DELAY_MS: int = 500
+    # Make backup every _ seconds
+    BACKUP_INTERVAL_S: int = 60 * 60
+
     def __init__(self) -> None:
-        self.__data_dir: str = os.path.join(GLib.get_user_data_dir(), "errands")
-        self.__data_file_path: str = os.path.join(self.__data_dir, "data.json")
+        self.data_dir: str = os.path.join(GLib.get_user_data_dir(), "errands")
+
+        # Held by public methods. Data is changed from main loop and sync thread.
+        self._lock: RLock = RLock()
+
+        # Every mutation record gets increasing sequence number
+        self._seq: int = 0
+        self.__replaying: bool = False
+
+        # Changes waiting to be written to disk by flush()
+        self.__pending_records: list[dict[str, Any]] = []
+        self.__snapshot_pending: bool = False
+        self.__flush_scheduled: bool = False
+        self.__pending_lock: Lock = Lock()
+        # Keep order of writes when flush() is called from different threads
+        self.__flush_lock: Lock = Lock()
 
         self.__tags_data: list[TagsData] = []
         self.__task_lists_data: list[TaskListData] = []
         self.__tasks_data: list[TaskData] = []
 
+        # Indexes over tasks data. Kept in sync with self.__tasks_data.
+        # (list_uid, uid) -> task
+        self.__tasks_index: dict[tuple[str, str], TaskData] = {}
+        # list_uid -> tasks of the list in the same order as in self.__tasks_data
+        self.__list_tasks_index: dict[str, list[TaskData]] = {}
+        # (list_uid, parent_uid) -> sub-tasks in the same order as in self.__tasks_data
+        self.__sub_tasks_index: dict[tuple[str, str], list[TaskData]] = {}
+        # id(task) -> number increasing along self.__tasks_data, so tasks are found
+        # in it and in lists of tasks index by bisect. None if not built.
+        self.__positions: dict[int, int] | None = None
+        self.__first_position: int = 0
+        self.__last_position: int = 0
+        # Keys of tasks index that have more than one task
+        self.__duplicate_keys: set[tuple[str, str]] = set()
+        # (due timestamp, id(task)) of tasks with due date sorted by due date
+        self.__due_index: list[tuple[float, int]] = []
+        # id(task) -> (due timestamp, task)
+        self.__due_tasks: dict[int, tuple[float, TaskData]] = {}
+        # (total, completed) counters of tasks that are not deleted or in trash.
+        # list_uid -> counter of all tasks of the list
+        self.__list_status: dict[str, list[int]] = {}
+        # (list_uid, parent_uid) -> counter of direct sub-tasks
+        self.__sub_tasks_status: dict[tuple[str, str], list[int]] = {}
+        # id(task) -> (task, list_uid, parent, total, completed) added to counters
+        self.__counted_tasks: dict[int, tuple[TaskData, str, str, int, int]] = {}
+        # tag -> id(task) -> task of tasks with the tag
+        self.__tag_tasks: dict[str, dict[int, TaskData]] = {}
+        # id(task) -> (task, tags) added to tags index
+        self.__tagged_tasks: dict[int, tuple[TaskData, tuple[str, ...]]] = {}
+        # Indexes are rebuilt on the next read if they were changed in transaction
+        self.__index_dirty: bool = False
+        # (list_uid, parent) -> first and last order keys of sub-tasks.
+        # Used instead of indexes while they are dirty, so tasks added
+        # in transaction don't rebuild indexes. None if not built.
+        self.__order_bounds: dict[tuple[str, str], tuple[float, float]] | None = None
+
+        # Transaction state
+        self.__in_transaction: bool = False
+        self.__transaction_records: list[dict[str, Any]] = []
+        # Data lists and values of changed objects before transaction for rollback
+        self.__transaction_lists: tuple[list, list, list] = ([], [], [])
+        self.__transaction_saved: dict[int, tuple[Any, dict[str, Any]]] = {}
+
+        self.__changed_callbacks: list[Callable[[], None]] = []
+
+        # Change events are collected and passed to callbacks once per main loop
+        # iteration: (type, list_uid, uid) -> event
+        self.__changes: dict[tuple[type, str, str], DataChange] = {}
+        self.__changes_lock: Lock = Lock()
+        self.__changes_callbacks: list[Callable[[list[DataChange]], None]] = []
+        # Called with changes made by another process
+        self.__external_changes_callbacks: list[Callable[[list[DataChange]], None]] = []
+
+        # Undo history. Group of inverse operations holds only changed fields of
+        # tasks and lists. Changes made in one main loop iteration are undone at once.
+        self.__undo_stack: list[list[tuple]] = []
+        self.__redo_stack: list[list[tuple]] = []
+        self.__history_group: list[tuple] = []
+        self.__history_scheduled: bool = False
+        # "undo" or "redo" while inverse operations are applied
+        self.__history_mode: str = ""
+        # Length of history group before transaction for rollback
+        self.__transaction_history: int = 0
+
+        # Completed tasks moved out of data. Read only when archive is browsed.
+        self.__archive: TasksArchive | None = None
+        self.__archiving: bool = False
+
+        # Compressed snapshots of data made in background
+        self.__backups: DataBackups | None = None
+        self.__backing_up: bool = False
+        self.__backups_timer: int = 0
+
+        # Tasks can be loaded in background after lists. Until then get_status()
+        # uses counters read from disk: list_uid -> (total, completed).
+        self.__tasks_loader: Callable[[], ErrandsData] | None = None
+        self.__load_lock: Lock = Lock()
+        self.__list_counters: dict[str, tuple[int, int]] = {}
+        self.__loaded_callbacks: list[Callable[[], None]] = []
+
     # ------ PROPERTIES ------ #
 
     @property
     def data(self) -> ErrandsData:
+        self.load_tasks()
         return ErrandsData(
             tags=self.__tags_data, lists=self.__task_lists_data, tasks=self.__tasks_data
         )
 
     @data.setter
+    @synchronized
     def data(self, new_data: ErrandsData):
+        self.load_tasks()
         self.__tags_data = new_data.tags
         self.__task_lists_data = new_data.lists
         self.__tasks_data = new_data.tasks
-        self.__write_data()
+        self.__build_index()
+        self._schedule_snapshot()
 
     @property
     def tags(self) -> list[TagsData]:
         return self.__tags_data
 
     @tags.setter
+    @synchronized
     def tags(self, new_data: list[TagsData]):
+        self.load_tasks()
         self.__tags_data = new_data
-        self.__write_data()
+        self._schedule_snapshot()
 
     @property
     def task_lists(self) -> list[TaskListData]:
         return self.__task_lists_data
 
     @task_lists.setter
+    @synchronized
     def task_lists(self, lists_data: list[TaskListData]):
+        self.load_tasks()
         self.__task_lists_data = lists_data
-        self.__write_data()
+        self._schedule_snapshot()
+
+    @property
+    def tasks_loaded(self) -> bool:
+        return self.__tasks_loader is None
 
     @property
     def tasks(self) -> list[TaskData]:
+        self.load_tasks()
         return self.__tasks_data
 
     @tasks.setter
+    @synchronized
     def tasks(self, tasks_data: list[TaskData]):
+        self.load_tasks()
         self.__tasks_data = tasks_data
-        self.__write_data()
+        self.__build_index()
+        self._schedule_snapshot()
 
     # ------ PUBLIC METHODS ------ #
 
+    @abstractmethod
+    def exists(self) -> bool:
+        """Check if storage files exist on disk"""
+
+    @abstractmethod
+    def init(self) -> None:
+        """Read data from disk. Create storage files if needed."""
+
+    @abstractmethod
+    def remove(self) -> None:
+        """Move storage files to backup after data was migrated to another storage"""
+
+    def close(self) -> None:
+        """Write all pending changes before application exits"""
+
+        self.load_tasks()
+        self.flush()
+
+    @synchronized
+    def flush(self) -> None:
+        """Write all pending changes to disk"""
+
+        with self.__flush_lock:
+            with self.__pending_lock:
+                records: list[dict[str, Any]] = self.__pending_records
+                snapshot: bool = self.__snapshot_pending
+                self.__pending_records = []
+                self.__snapshot_pending = False
+            # Snapshot includes all pending records
+            if snapshot:
+                self._write_snapshot()
+            elif records:
+                self._write_records(records)
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Batch mutations. Indexes are updated and changes are passed to the storage
+        once on commit. If exception is raised - all changes are rolled back.
+        Nested transactions are part of the outer one.
+        Other threads wait for the transaction to finish.
+        """
+
+        with self._lock:
+            if self.__in_transaction:
+                yield
+                return
+
+            self.load_tasks()
+            self.__in_transaction = True
+            self.__transaction_records = []
+            self.__transaction_lists = (
+                list(self.__task_lists_data),
+                list(self.__tags_data),
+                list(self.__tasks_data),
+            )
+            self.__transaction_saved = {}
+            self.__transaction_history = len(self.__history_group)
+            try:
+                yield
+            except BaseException:
+                Log.error("Data: Rollback transaction")
+                self.__rollback()
+                raise
+            else:
+                self.__commit()
+            finally:
+                self.__in_transaction = False
+                self.__transaction_records = []
+                self.__transaction_lists = ([], [], [])
+                self.__transaction_saved = {}
+            # Close undo group of the transaction in main loop
+            self.__push_history()
+
+    def connect_changed(self, callback: Callable[[], None]) -> None:
+        """Call callback after data is changed. Called once for transaction."""
+
+        self.__changed_callbacks.append(callback)
+
+    @synchronized
+    def undo(self) -> list[DataChange] | None:
+        """
+        Revert the last change. Returns change events of reverted data
+        or None if there is nothing to undo.
+        """
+
+        return self.__replay_history(self.__undo_stack, "undo")
+
+    @synchronized
+    def redo(self) -> list[DataChange] | None:
+        """
+        Repeat the last undone change. Returns change events of repeated data
+        or None if there is nothing to redo.
+        """
+
+        return self.__replay_history(self.__redo_stack, "redo")
+
+    @synchronized
+    def clear_history(self) -> None:
+        self.__undo_stack.clear()
+        self.__redo_stack.clear()
+        self.__history_group = []
+
+    def connect_changes(self, callback: Callable[[list[DataChange]], None]) -> None:
+        """
+        Call callback in main loop with change events collected since the last call.
+        Events made in the same main loop iteration are passed together.
+        """
+
+        self.__changes_callbacks.append(callback)
+
+    def connect_external_changes(
+        self, callback: Callable[[list[DataChange]], None]
+    ) -> None:
+        """
+        Call callback in main loop with change events of data changed on disk
+        by another process or restored from backup.
+        They are also passed to connect_changes() callbacks.
+        """
+
+        self.__external_changes_callbacks.append(callback)
+
+    def connect_loaded(self, callback: Callable[[], None]) -> None:
+        """
+        Call callback in main loop after tasks are loaded.
+        If they are already loaded - call it right away.
+        """
+
+        if self.tasks_loaded:
+            callback()
+        else:
+            self.__loaded_callbacks.append(callback)
+
+    def load_tasks(self) -> None:
+        """Block until tasks are loaded if they are still loading in background"""
+
+        if self.tasks_loaded:
+            return
+
+        with self.__load_lock:
+            if self.tasks_loaded:
+                return
+            start: float = time.monotonic()
+            data: ErrandsData = self.__tasks_loader()
+            # Keep objects that are already shown in UI if nothing changed
+            if [lst.to_dict() for lst in data.lists] != [
+                lst.to_dict() for lst in self.__task_lists_data
+            ] or [t.to_dict() for t in data.tags] != [
+                t.to_dict() for t in self.__tags_data
+            ]:
+                Log.error("Data: Lists read on startup are out of date")
+                self.__task_lists_data = data.lists
+                self.__tags_data = data.tags
+            self.__tasks_data = data.tasks
+            self.__build_index()
+            self.__tasks_loader = None
+
+        Log.info(
+            f"Data: Load {len(self.__tasks_data)} tasks in "
+            f"{(time.monotonic() - start) * 1000:.1f} ms"
+        )
+        GLib.idle_add(self.__emit_loaded)
+
+    @synchronized
     def add_list(
         self, name: str, uuid: str = None, synced: bool = False, color: str = ""
     ) -> TaskListData:
         Log.debug(f"Data: Create list '{uuid}'")
+        self.load_tasks()
 
         new_list = TaskListData(
             deleted=False, name=name, uid=uuid, synced=synced, color=color
         )
-        data: list[TaskListData] = self.task_lists
-        data.append(new_list)
-        self.task_lists = data
+        self.__task_lists_data.append(new_list)
+        self.__record("add_list", list=new_list.to_dict())
+        self.__push_history(("delete_list", new_list))
 
         return new_list
 
+    @synchronized
     def get_list(self, list_uid: str) -> TaskListData | None:
         for list in self.task_lists:
             if list.uid == list_uid:
                 return list
         return None
 
+    @synchronized
     def add_task(self, **kwargs) -> TaskData:
-        data: list[TaskData] = self.tasks
+        self.load_tasks()
         new_task = TaskData(**kwargs)
         if not new_task.uid:
             new_task.uid = str(uuid4())
         Log.debug(f"Data: Add task '{new_task.uid}'")
-        if not GSettings.get("task-list-new-task-position-top"):
-            data.append(new_task)
-        else:
-            data.insert(0, new_task)
-        self.tasks = data
+        on_top: bool = GSettings.get("task-list-new-task-position-top")
+        if new_task.sort_order is None or "sort_order" not in kwargs:
+            new_task.sort_order = self.__new_order_key(new_task, on_top)
+        self.__insert_task(new_task, on_top)
+        self.__record("add_task", task=new_task.to_dict(), on_top=on_top)
+        self.__push_history(("update_props", new_task, ("deleted",), (True,)))
 
         return new_task
 
+    @synchronized
     def clean_deleted(self) -> None:
         Log.debug("Data: Clean deleted")
+        self.load_tasks()
 
-        data: ErrandsData = self.data
-        data.lists = [lst for lst in data.lists if not lst.deleted]
-        data.tasks = [t for t in data.tasks if not t.deleted]
-        self.data = data
+        lists: list[TaskListData] = [lst for lst in self.task_lists if not lst.deleted]
+        tasks: list[TaskData] = [t for t in self.tasks if not t.deleted]
+        if len(lists) == len(self.task_lists) and len(tasks) == len(self.tasks):
+            return
+        self.__task_lists_data = lists
+        self.__tasks_data = tasks
+        self.__invalidate_index()
+        self.__record("clean_deleted")
 
+    @synchronized
     def delete_list(self, list_uid: str) -> None:
-        lists: list[TaskListData] = self.task_lists
-        for lst in lists:
+        self.load_tasks()
+        for lst in self.task_lists:
             if lst.uid == list_uid:
+                if self.__history_enabled():
+                    self.__push_history(
+                        ("update_list_props", lst, ("deleted",), (lst.deleted,)),
+                        *(
+                            ("restore_task", t)
+                            for t in self.tasks
+                            if t.list_uid == list_uid
+                        ),
+                    )
+                self.__save(lst)
                 lst.deleted = True
                 break
-        tasks: list[TaskData] = [t for t in self.tasks if not t.list_uid == list_uid]
-        self.tasks = tasks
-        self.task_lists = lists
-
+        if self.__in_transaction:
+            self.__tasks_data = [t for t in self.tasks if not t.list_uid == list_uid]
+            self.__index_dirty = True
+        elif list_uid in self.__list_tasks_index:
+            for task in self.__list_tasks_index.pop(list_uid):
+                self.__remove_from_due_index(task)
+                self.__uncount_task(task)
+                self.__untag_task(task)
+            self.__tasks_data = [t for t in self.tasks if not t.list_uid == list_uid]
+            for key in [k for k in self.__tasks_index if k[0] == list_uid]:
+                del self.__tasks_index[key]
+            for key in [k for k in self.__sub_tasks_index if k[0] == list_uid]:
+                del self.__sub_tasks_index[key]
+        self.__record("delete_list", list_uid=list_uid)
+
+    @synchronized
     def delete_task(self, list_uid: str, uid: str) -> None:
-        tasks: list[TaskData] = self.tasks
-        for task in tasks:
-            if task.list_uid == list_uid and task.uid == uid:
-                tasks.remove(task)
-                break
-        self.tasks = tasks
-
+        self.__ensure_index()
+        task: TaskData | None = self.__tasks_index.get((list_uid, uid))
+        if not task:
+            return
+        self.__push_history(("restore_task", task))
+        self.__unindex_task(task)
+        self.__remove_task(self.__tasks_data, task)
+        if self.__positions is not None:
+            del self.__positions[id(task)]
+        self.__record("delete_task", list_uid=list_uid, uid=uid)
+
+    @synchronized
     def delete_tasks_from_trash(self) -> None:
-        tasks: list[TaskData] = self.tasks
-        for task in tasks:
+        for task in self.tasks:
             if task.trash and not task.deleted:
+                self.__push_history(("update_props", task, ("deleted",), (False,)))
+                self.__save(task)
                 task.deleted = True
                 task.synced = False
-        self.tasks = tasks
+                self.__count_task(task)
+        self.__record("delete_tasks_from_trash")
 
+    @synchronized
     def get_lists_as_dicts(self) -> list[TaskListData]:
-        return self.task_lists
+        return list(self.task_lists)
 
+    @synchronized
     def get_prop(self, list_uid: str, uid: str, prop: str) -> Any:
-        tasks: list[TaskData] = self.tasks
-        for t in tasks:
-            if t.list_uid == list_uid and t.uid == uid:
-                task = t
-                break
-
-        return getattr(task, prop)
+        self.__ensure_index()
+        return getattr(self.__tasks_index[(list_uid, uid)], prop)
 
+    @synchronized
     def get_list_prop(self, list_uid: str, prop: str) -> Any:
         property: Any = getattr(self.get_list(list_uid), prop)
         return property if property else None
 
+    @synchronized
     def update_list_prop(self, list_uid: str, prop: str, value: Any) -> None:
-        lists: list[TaskListData] = self.task_lists
-        for lst in lists:
-            if lst.uid == list_uid:
-                setattr(lst, prop, value)
-                break
-        self.task_lists = lists
+        self.update_list_props(list_uid, [prop], [value])
 
+    @synchronized
     def update_list_props(
         self, list_uid: str, props: list[str], values: list[Any]
     ) -> None:
-        lists: list[TaskListData] = self.task_lists
-        for lst in lists:
+        self.load_tasks()
+        for lst in self.task_lists:
             if lst.uid == list_uid:
+                self.__save(lst)
+                if set(props) - LIST_LOCAL_PROPS:
+                    self.__push_history(
+                        ("update_list_props", lst, *self.__get_old_values(lst, props))
+                    )
                 for i, prop in enumerate(props):
                     setattr(lst, prop, values[i])
                 break
-        self.task_lists = lists
+        self.__record(
+            "update_list_props", list_uid=list_uid, props=props, values=values
+        )
 
+    @synchronized
     def get_status(self, list_uid: str, parent_uid: str = None) -> tuple[int, int]:
         """Gets tuple (total_tasks, completed_tasks)"""
 
-        tasks: list[TaskData] = [
-            t
-            for t in self.tasks
-            if t.list_uid == list_uid and not t.deleted and not t.trash
-        ]
+        if not parent_uid and not self.tasks_loaded:
+            counters: tuple[int, int] | None = self.__list_counters.get(list_uid)
+            if counters:
+                return counters
+
+        self.__ensure_index()
         if parent_uid:
-            tasks: list[TaskData] = [t for t in tasks if t.parent == parent_uid]
-        total: int = len(tasks)
-        completed: int = len([t for t in tasks if t.completed])
+            counter: list[int] | None = self.__sub_tasks_status.get(
+                (list_uid, parent_uid)
+            )
+        else:
+            counter: list[int] | None = self.__list_status.get(list_uid)
+
+        return (counter[0], counter[1]) if counter else (0, 0)
 
-        return total, completed
+    @synchronized
+    def check_status(self) -> bool:
+        """Compare status counters with full recount of tasks. For debugging."""
 
+        self.__ensure_index()
+        lists: dict[str, list[int]] = {}
+        sub_tasks: dict[tuple[str, str], list[int]] = {}
+        for task in self.__tasks_data:
+            if task.deleted or task.trash:
+                continue
+            for counter in (
+                lists.setdefault(task.list_uid, [0, 0]),
+                sub_tasks.setdefault((task.list_uid, task.parent), [0, 0]),
+            ):
+                counter[0] += 1
+                counter[1] += int(task.completed)
+
+        ok: bool = True
+        for expected, counters in (
+            (lists, self.__list_status),
+            (sub_tasks, self.__sub_tasks_status),
+        ):
+            for key in expected.keys() | counters.keys():
+                if expected.get(key, [0, 0]) != counters.get(key, [0, 0]):
+                    Log.error(
+                        f"Data: Wrong status of '{key}': {counters.get(key)}. "
+                        f"Expected {expected.get(key)}"
+                    )
+                    ok = False
+        return ok
+
+    @synchronized
     def add_tag(self, tag: str) -> None:
-        new_tags = self.tags
-        for t in new_tags:
-            if t.text == tag:
-                return
-        new_tags.append(TagsData(text=tag))
-        self.tags = new_tags
+        if self.__add_tag(tag):
+            self.__push_history(("remove_tag", tag))
 
+    @synchronized
     def update_tags(self) -> None:
-        tasks_tags_texts: set[str] = set()
-        for task in self.tasks:
-            tasks_tags_texts.update(task.tags)
+        self.__ensure_index()
+        current_tags_texts: set[str] = {t.text for t in self.tags}
 
-        current_tags = self.tags
-        current_tags_texts = [t.text for t in current_tags]
+        # Tags found in tasks are not added to undo history
+        for tag in sorted(self.__tag_tasks.keys() - current_tags_texts):
+            self.__add_tag(tag)
 
-        added_tag: bool = False
-        for tag in tasks_tags_texts:
-            if tag not in current_tags_texts:
-                current_tags.append(TagsData(text=tag))
-                added_tag = True
+    @synchronized
+    def get_tag_count(self, tag: str) -> int:
+        """Number of tasks with the tag"""
 
-        if added_tag:
-            self.tags = current_tags
+        self.__ensure_index()
+        return len(self.__tag_tasks.get(tag, ()))
 
+    @synchronized
     def remove_tag(self, tag: str) -> None:
-        self.tags = [t for t in self.tags if t.text != tag]
-        changed = False
-        tasks = self.tasks
-        for task in tasks:
-            if task.tags != [] and tag in task.tags:
-                task.tags = [t for t in task.tags if t != tag]
+        self.__ensure_index()
+        with self.transaction():
+            if any(t.text == tag for t in self.tags):
+                self.__push_history(("add_tag", tag))
+            self.__tags_data = [t for t in self.tags if t.text != tag]
+            for task in list(self.__tag_tasks.get(tag, {}).values()):
+                self.__push_history(("update_props", task, ("tags",), (task.tags,)))
+                self.__save(task)
+                task.tags = tuple(t for t in task.tags if t != tag)
                 task.synced = False
-                changed = True
-        if changed:
-            self.tasks = tasks
+                self.__tag_task(task)
+            self.__record("remove_tag", tag=tag)
+
+    @synchronized
+    def rename_tag(self, tag: str, new_tag: str) -> None:
+        """Rename tag in tags and tasks. Tags are merged if new tag already exists."""
+
+        if tag == new_tag:
+            return
+        self.__ensure_index()
+        with self.transaction():
+            merge: bool = any(t.text == new_tag for t in self.tags)
+            if merge:
+                if any(t.text == tag for t in self.tags):
+                    self.__push_history(("add_tag", tag))
+                self.__tags_data = [t for t in self.tags if t.text != tag]
+            else:
+                self.__push_history(("rename_tag", new_tag, tag))
+                for t in self.tags:
+                    if t.text == tag:
+                        self.__save(t)
+                        t.text = new_tag
+            for task in list(self.__tag_tasks.get(tag, {}).values()):
+                if merge:
+                    self.__push_history(("update_props", task, ("tags",), (task.tags,)))
+                self.__save(task)
+                task.tags = compact_value(
+                    "tags",
+                    tuple(dict.fromkeys(new_tag if t == tag else t for t in task.tags)),
+                )
+                task.synced = False
+                self.__tag_task(task)
+            self.__record("rename_tag", tag=tag, new_tag=new_tag)
 
+    @synchronized
     def get_parents_uids_tree(cls, list_uid: str, task_uid: str) -> list[str]:
         parents_uids: list[str] = []
         parent: str = cls.get_prop(list_uid, task_uid, "parent")
@@ -424,196 +1012,1486 @@ class UserDataJSON:
             parent = cls.get_prop(list_uid, parent, "parent")
         return parents_uids
 
+    @synchronized
     def get_task(self, list_uid: str, uid: str) -> TaskData:
+        self.__ensure_index()
         try:
-            task: TaskData = [
-                t for t in self.tasks if t.list_uid == list_uid and t.uid == uid
-            ][0]
-            return task
+            return self.__tasks_index[(list_uid, uid)]
         except Exception as e:
             Log.error(f"Data: can't get task '{uid}'. {e}")
             return TaskData()
 
+    @synchronized
     def get_tasks_as_dicts(
         self, list_uid: str = None, parent: str = None
     ) -> list[TaskData]:
+        self.__ensure_index()
         if not list_uid:
             return self.tasks
         elif list_uid and parent is None:
-            return [t for t in self.tasks if t.list_uid == list_uid]
+            return list(self.__list_tasks_index.get(list_uid, []))
         elif list_uid and parent is not None:
-            return [
-                t for t in self.tasks if t.list_uid == list_uid and t.parent == parent
-            ]
+            return list(self.__sub_tasks_index.get((list_uid, parent), []))
 
-    def init(self) -> None:
-        Log.debug("Data: Initialize")
-        if not os.path.exists(self.__data_dir):
-            Log.debug("Data: Create data directory")
-            os.mkdir(self.__data_dir)
+    @synchronized
+    def snapshot(self) -> ErrandsData:
+        """
+        Copy of all data. It's not changed by other threads, so it can be read
+        without holding the lock, e.g. for comparing with remote data.
+        """
 
-        self.__convert_data()
+        self.load_tasks()
+        return ErrandsData(
+            tags=[copy(t) for t in self.__tags_data],
+            lists=[copy(lst) for lst in self.__task_lists_data],
+            tasks=[copy(t) for t in self.__tasks_data],
+        )
 
-        if not os.path.exists(self.__data_file_path):
-            Log.debug("Data: Create data.json file")
-            self.__write_data()
+    @synchronized
+    def get_tasks_due_before(self, timestamp: float) -> list[TaskData]:
+        """Get tasks with due date before timestamp sorted by due date"""
 
-        self.__read_data()
+        self.__ensure_index()
+        end: int = bisect_left(self.__due_index, (timestamp,))
+        return [self.__due_tasks[i][1] for _, i in self.__due_index[:end]]
 
+    @synchronized
+    def get_due_timestamp(self, task: TaskData) -> float | None:
+        """Get parsed due date of the task"""
+
+        self.__ensure_index()
+        item: tuple[float, TaskData] | None = self.__due_tasks.get(id(task))
+        if item and item[1] is task:
+            return item[0]
+        # Task is not in data
+        return parse_due_date(task.due_date)
+
+    @synchronized
     def move_task_after(
         self, list_uid: str, task_uid: str, task_after_uid: str
     ) -> None:
-        tasks: list[TaskData] = self.tasks
-
-        def __move_task(uid: str, after_uid: str):
-            task_to_move: TaskData = tasks.pop(
-                tasks.index(self.get_task(list_uid, uid))
-            )
-            index_to_insert: int = tasks.index(self.get_task(list_uid, after_uid)) + 1
-            tasks[index_to_insert:index_to_insert] = [task_to_move]
-
-        __move_task(task_uid, task_after_uid)
-
-        # Move sub-tasks
-        after_uid: str = task_uid
-        for task in self.__get_sub_tasks_tree(list_uid, task_uid):
-            __move_task(task.uid, after_uid)
-            after_uid = task.uid
-
-        self.tasks = tasks
+        self.__move_task(list_uid, task_uid, task_after_uid, 1)
 
+    @synchronized
     def move_task_before(
         self, list_uid: str, task_uid: str, task_before_uid: str
     ) -> None:
-        tasks: list[TaskData] = self.tasks
-
-        def __move_task(uid: str):
-            task_to_move: TaskData = tasks.pop(
-                tasks.index(self.get_task(list_uid, uid))
-            )
-            index_to_insert: int = tasks.index(self.get_task(list_uid, task_before_uid))
-            tasks[index_to_insert:index_to_insert] = [task_to_move]
-
-        __move_task(task_uid)
-
-        # Move sub-tasks
-        for task in self.__get_sub_tasks_tree(list_uid, task_uid):
-            __move_task(task.uid)
-
-        self.tasks = tasks
+        self.__move_task(list_uid, task_uid, task_before_uid, 0)
 
+    @synchronized
     def move_task_to_list(
         self, task_uid: str, from_list_uid: str, to_list_uid: str, new_parent: str = ""
     ) -> TaskData:
-        tasks: list[TaskData] = self.tasks
         tasks_to_delete: list[TaskData] = [self.get_task(from_list_uid, task_uid)]
 
-        base_task: TaskData = deepcopy(self.get_task(from_list_uid, task_uid))
+        base_task: TaskData = copy(self.get_task(from_list_uid, task_uid))
         base_task.list_uid = to_list_uid
         base_task.parent = new_parent
         base_task.synced = False
-        tasks.append(base_task)
+        new_tasks: list[TaskData] = [base_task]
 
         for task in self.__get_sub_tasks_tree(from_list_uid, task_uid):
-            new_sub_task: TaskData = deepcopy(task)
+            new_sub_task: TaskData = copy(task)
             new_sub_task.list_uid = to_list_uid
             new_sub_task.synced = False
-            tasks.append(new_sub_task)
+            new_tasks.append(new_sub_task)
             tasks_to_delete.append(task)
 
-        for task in tasks:
-            if task in tasks_to_delete:
-                task.deleted = True
-                task.synced = False
-
-        self.tasks = tasks
+        for task in tasks_to_delete:
+            self.__push_history(("update_props", task, ("deleted",), (task.deleted,)))
+            self.__save(task)
+            task.deleted = True
+            task.synced = False
+            self.__count_task(task)
+
+        for task in new_tasks:
+            self.__insert_task(task, False)
+            self.__push_history(("update_props", task, ("deleted",), (True,)))
+
+        self.__record(
+            "move_task_to_list",
+            uid=task_uid,
+            from_list_uid=from_list_uid,
+            to_list_uid=to_list_uid,
+            new_parent=new_parent,
+        )
 
         return base_task
 
+    @synchronized
     def update_props(
         self, list_uid: str, uid: str, props: Iterable[str], values: Iterable[Any]
     ):
-        tasks = self.tasks
-        for task in tasks:
-            if task.list_uid == list_uid and task.uid == uid:
-                for idx, prop in enumerate(props):
-                    setattr(task, prop, values[idx])
-                if "due_date" in props:
-                    setattr(task, "notified", False)
-                break
-        self.tasks = tasks
+        self.__ensure_index()
+        task: TaskData | None = self.__tasks_index.get((list_uid, uid))
+        if task:
+            self.__save(task)
+            if set(props) - TASK_LOCAL_PROPS:
+                self.__push_history(
+                    ("update_props", task, *self.__get_old_values(task, props))
+                )
+            old_list_uid, old_parent = task.list_uid, task.parent
+            for idx, prop in enumerate(props):
+                setattr(task, prop, compact_value(prop, values[idx]))
+            if "due_date" in props:
+                setattr(task, "notified", False)
+                if self.__in_transaction:
+                    self.__index_dirty = True
+                else:
+                    self.__remove_from_due_index(task)
+                    self.__add_to_due_index(task)
+            if (
+                task.list_uid != old_list_uid
+                or task.parent != old_parent
+                or "sort_order" in props
+            ):
+                self.__reindex_task(task, old_list_uid, old_parent)
+            self.__count_task(task)
+            if "tags" in props:
+                self.__tag_task(task)
+            self.__record(
+                "update_props",
+                list_uid=list_uid,
+                uid=uid,
+                props=list(props),
+                values=[compact_value(p, v) for p, v in zip(props, values)],
+            )
+
+    @synchronized
+    def mark_synced(self, task: TaskData) -> bool:
+        """
+        Set task from snapshot() as synced if it wasn't changed since the snapshot.
+        Returns False if it was changed and needs to be synced again.
+        """
+
+        self.__ensure_index()
+        current: TaskData | None = self.__tasks_index.get((task.list_uid, task.uid))
+        if not current or current.diff(task, TASK_LOCAL_PROPS):
+            return False
+        self.update_props(task.list_uid, task.uid, ["synced"], [True])
+        return True
+
+    def get_archive_cutoff(self) -> str:
+        """Oldest 'changed_at' of completed tasks kept in data or '' if disabled"""
+
+        days: int = GSettings.get("archive-days") or 0
+        if days <= 0:
+            return ""
+        cutoff: datetime.datetime = datetime.datetime.now() - datetime.timedelta(
+            days=days
+        )
+        return cutoff.strftime("%Y%m%dT%H%M%S")
+
+    def is_archivable(
+        self, task: TaskData, cutoff: str = None, sync_enabled: bool = None
+    ) -> bool:
+        """
+        Check if task was completed more than "archive-days" ago.
+        Cutoff is the oldest 'changed_at' of tasks which are kept.
+        Pass cutoff and sync_enabled when checking many tasks.
+        """
+
+        if cutoff is None:
+            cutoff = self.get_archive_cutoff()
+        if not cutoff or not task.completed or task.deleted:
+            return False
+        if sync_enabled is None:
+            sync_enabled = GSettings.get("sync-provider") != 0
+        return bool(
+            # Unsynced changes must be sent to the server first
+            (task.synced or not sync_enabled)
+            and task.changed_at < cutoff
+        )
+
+    @synchronized
+    def archive_completed(self) -> None:
+        """
+        Move tasks completed more than "archive-days" ago to archive.
+        Archive file is written in background and then tasks are removed from data.
+        Task is archived only together with all its sub-tasks.
+        """
+
+        cutoff: str = self.get_archive_cutoff()
+        if not cutoff or self.__archiving:
+            return
+
+        tasks: list[TaskData] = self.__get_archivable_tasks(cutoff)
+        if not tasks:
+            return
+
+        Log.info(f"Data: Archive {len(tasks)} tasks")
+        self.__archiving = True
+        dicts: list[dict[str, Any]] = [t.to_dict() for t in tasks]
+
+        def __write() -> None:
+            try:
+                self.__get_archive().append(dicts)
+            except Exception as e:
+                Log.error(f"Data: Can't write archive. {e}")
+                self.__archiving = False
+                return
+            GLib.idle_add(self.__finish_archive, tasks, cutoff)
+
+        Thread(name="UserDataArchiver", target=__write, daemon=True).start()
+
+    def get_archived_tasks(self) -> list[TaskData]:
+        """
+        Read archived tasks. Tasks that are back in data are skipped.
+        Archive file is read without holding data lock.
+        """
+
+        with self._lock:
+            archive: TasksArchive = self.__get_archive()
+        tasks: list[TaskData] = archive.get_tasks()
+        with self._lock:
+            self.__ensure_index()
+            return [t for t in tasks if (t.list_uid, t.uid) not in self.__tasks_index]
+
+    def search_archive(self, text: str) -> list[TaskData]:
+        text = text.lower()
+        return [
+            t
+            for t in self.get_archived_tasks()
+            if text in t.text.lower() or text in t.notes.lower()
+        ]
+
+    @synchronized
+    def restore_archived_task(self, task: TaskData) -> TaskData:
+        """Put archived task back to its list as not completed top-level task"""
+
+        restored: TaskData = self.add_task(
+            **{
+                **task.to_dict(),
+                "parent": "",
+                "sort_order": None,
+                "changed_at": "",
+                "completed": False,
+                "trash": False,
+                "synced": False,
+            }
+        )
+        Thread(
+            name="UserDataArchiver",
+            target=self.__get_archive().remove,
+            args=([(task.list_uid, task.uid)],),
+            daemon=True,
+        ).start()
+        return restored
+
+    def start_backups(self) -> None:
+        """Make backup now and then every hour"""
+
+        if self.__backups_timer:
+            return
+        self.backup()
+        self.__backups_timer = GLib.timeout_add_seconds(
+            self.BACKUP_INTERVAL_S, lambda: self.backup() or True
+        )
+
+    @synchronized
+    def backup(self) -> None:
+        """
+        Store compressed snapshot of data in background.
+        Unchanged data takes no space, old backups are rotated.
+        """
+
+        if self.__backing_up or not self.tasks_loaded:
+            return
+        self.__backing_up = True
+        data: ErrandsData = self.snapshot()
+
+        def __write() -> None:
+            try:
+                self.__get_backups().add(
+                    data,
+                    GSettings.get("backups-hourly") or 0,
+                    GSettings.get("backups-daily") or 0,
+                )
+            except Exception as e:
+                Log.error(f"Data: Can't create backup. {e}")
+            finally:
+                self.__backing_up = False
+
+        Thread(name="UserDataBackup", target=__write, daemon=True).start()
 
+    def get_backups(self) -> list[str]:
+        """
+        Names of backups, newest first.
+        Name starts with time of backup in '%Y%m%dT%H%M%S' format.
+        """
+
+        return self.__get_backups().get_backups()
+
+    def restore_backup(
+        self, name: str, callback: Callable[[bool], None] | None = None
+    ) -> None:
+        """
+        Replace data with backup by name. Backup is read in background and
+        current data is backed up after it, so restore can be undone.
+        Callback is called in main thread with True if backup was restored.
+        """
+
+        Log.info(f"Data: Restore backup '{name}'")
+        current: ErrandsData = self.snapshot()
+
+        def __finish(data: ErrandsData | None) -> None:
+            if data:
+                with self._lock:
+                    # Restored tasks must be sent to the server again
+                    old_tasks: dict[tuple[str, str], TaskData] = {
+                        (t.list_uid, t.uid): t for t in self.__tasks_data
+                    }
+                    for task in data.tasks:
+                        old_task: TaskData | None = old_tasks.get(
+                            (task.list_uid, task.uid)
+                        )
+                        if not old_task or old_task.diff(task):
+                            task.synced = False
+                    self._merge_external(data)
+                    self._schedule_snapshot()
+            if callback:
+                callback(data is not None)
+
+        def __read() -> None:
+            backups: DataBackups = self.__get_backups()
+            # Read first, so rotation can't remove the backup
+            data: ErrandsData | None = backups.read(name)
+            try:
+                backups.add(
+                    current,
+                    GSettings.get("backups-hourly") or 0,
+                    GSettings.get("backups-daily") or 0,
+                )
+            except Exception as e:
+                Log.error(f"Data: Can't create backup. {e}")
+            GLib.idle_add(__finish, data)
+
+        Thread(name="UserDataBackup", target=__read, daemon=True).start()
+
+    @synchronized
     def clean_orphans(self) -> list[TaskData]:
         orphans: list[TaskData] = []
+        changed: bool = False
         tasks: list[TaskData] = self.tasks
-        uids: list[str] = [t.uid for t in tasks]
+        uids: set[str] = {t.uid for t in tasks}
         for task in tasks:
             if task.parent not in uids:
+                if task.parent != "":
+                    changed = True
+                    self.__save(task)
                 task.parent = ""
                 orphans.append(task)
-        self.tasks = tasks
+        if changed:
+            self.__invalidate_index()
+            self.__record("clean_orphans")
         return orphans
 
     # ------ PRIVATE METHODS ------ #
 
-    def __get_sub_tasks(self, list_uid: str, task_uid: str) -> list[TaskData]:
-        return [
-            t for t in self.tasks if t.list_uid == list_uid and t.parent == task_uid
-        ]
+    def __build_index(self) -> None:
+        """Rebuild all tasks indexes from scratch"""
+
+        self.__index_dirty = False
+        self.__order_bounds = None
+        self.__positions = None
+        self.__duplicate_keys = set()
+        self.__tasks_index = {}
+        self.__list_tasks_index = {}
+        self.__sub_tasks_index = {}
+        self.__due_tasks = {}
+        self.__list_status = {}
+        self.__sub_tasks_status = {}
+        self.__counted_tasks = {}
+        self.__tag_tasks = {}
+        self.__tagged_tasks = {}
+        for task in self.__tasks_data:
+            self.__add_to_index(task)
+            due: float | None = parse_due_date(task.due_date)
+            if due is not None:
+                self.__due_tasks[id(task)] = (due, task)
+        self.__due_index = sorted(
+            (due, task_id) for task_id, (due, _) in self.__due_tasks.items()
+        )
 
-    def __get_sub_tasks_tree(self, list_uid: str, task_uid: str) -> list[TaskData]:
-        tree: list[TaskData] = []
+    def __ensure_index(self) -> None:
+        """Rebuild indexes changed in transaction before reading them"""
 
-        def __add_sub_tasks(uid: str):
-            sub_tasks: list[TaskData] = self.__get_sub_tasks(list_uid, uid)
-            if sub_tasks:
-                tree.extend(sub_tasks)
-                for sub_task in sub_tasks:
-                    __add_sub_tasks(sub_task.uid)
+        self.load_tasks()
+        if self.__index_dirty:
+            self.__build_index()
 
-        __add_sub_tasks(task_uid)
-        return tree
+    def __invalidate_index(self) -> None:
+        """Rebuild indexes now or on commit if in transaction"""
 
-    def __get_task_parents_tree(self, list_uid: str, task_uid: str) -> list[TaskData]:
-        tree: list[TaskData] = []
-        tasks = [t for t in self.tasks if t.list_uid == list_uid]
+        if self.__in_transaction:
+            self.__index_dirty = True
+            self.__order_bounds = None
+            self.__positions = None
+        else:
+            self.__build_index()
 
-        def __add_parent(task_uid: str):
-            for task in tasks:
-                if task.parent:
-                    tree.append(task)
-                    __add_parent(task.parent)
+    def __insert_task(self, task: TaskData, on_top: bool) -> None:
+        if not on_top:
+            self.__tasks_data.append(task)
+        else:
+            self.__tasks_data.insert(0, task)
+        if self.__positions is not None:
+            if on_top:
+                self.__first_position -= 1
+                self.__positions[id(task)] = self.__first_position
+            else:
+                self.__last_position += 1
+                self.__positions[id(task)] = self.__last_position
+        self.__index_task(task, on_top)
+        if self.__order_bounds is not None:
+            self.__add_order_bounds(task)
+
+    def __index_task(self, task: TaskData, on_top: bool = False) -> None:
+        """Add task to the end (or to the start if on_top is True) of indexes"""
+
+        if self.__in_transaction:
+            self.__index_dirty = True
+            return
+        self.__add_to_index(task, on_top)
+        self.__add_to_due_index(task)
+
+    def __add_to_index(self, task: TaskData, on_top: bool = False) -> None:
+        key: tuple[str, str] = (task.list_uid, task.uid)
+        # Prefer tasks that are not deleted if there are duplicates
+        # left by move_task_to_list
+        indexed: TaskData | None = self.__tasks_index.get(key)
+        if indexed and indexed is not task:
+            self.__duplicate_keys.add(key)
+        if not indexed or (indexed.deleted and not task.deleted):
+            self.__tasks_index[key] = task
+
+        list_tasks: list[TaskData] = self.__list_tasks_index.setdefault(
+            task.list_uid, []
+        )
+        if on_top:
+            list_tasks.insert(0, task)
+        else:
+            list_tasks.append(task)
+        # Task is the first or the last task of the list,
+        # so it goes before or after sub-tasks with equal order key
+        (insort_left if on_top else insort)(
+            self.__sub_tasks_index.setdefault((task.list_uid, task.parent), []),
+            task,
+            key=order_key,
+        )
 
-        __add_parent(task_uid)
-        return tree
+        self.__count_task(task)
+        self.__tag_task(task)
 
-    def __backup_data(self) -> None:
-        Log.info("Data: Backup")
-        shutil.copyfile(self.__data_file_path, self.__data_file_path + ".old")
+    def __insert_sub_task(self, task: TaskData) -> None:
+        """Insert task into sub-tasks of its parent sorted by order key"""
 
-    def __convert_data(self):
-        old_db_path: str = os.path.join(self.__data_dir, "data.db")
-        if not os.path.exists(old_db_path):
+        group: list[TaskData] = self.__sub_tasks_index.setdefault(
+            (task.list_uid, task.parent), []
+        )
+        lo: int = bisect_left(group, task.sort_order, key=order_key)
+        hi: int = bisect_right(group, task.sort_order, key=order_key)
+        if lo < hi:
+            # Tasks with equal keys are kept in the same order as tasks of the list
+            equal: set[int] = {id(t) for t in group[lo:hi]}
+            for t in self.__list_tasks_index[task.list_uid]:
+                if t is task:
+                    break
+                if id(t) in equal:
+                    lo += 1
+        group.insert(lo, task)
+
+        self.__count_task(task)
+
+    def __add_to_due_index(self, task: TaskData) -> None:
+        due: float | None = parse_due_date(task.due_date)
+        if due is None:
             return
+        self.__due_tasks[id(task)] = (due, task)
+        insort(self.__due_index, (due, id(task)))
 
-        Log.info("Data: Convert old data format to a new one")
+    def __remove_from_due_index(self, task: TaskData) -> None:
+        item: tuple[float, TaskData] | None = self.__due_tasks.get(id(task))
+        if not item or item[1] is not task:
+            return
+        del self.__due_tasks[id(task)]
+        idx: int = bisect_left(self.__due_index, (item[0], id(task)))
+        del self.__due_index[idx]
+
+    def __count_task(self, task: TaskData) -> None:
+        """Add task to status counters or update it there after task was changed"""
+
+        self.__uncount_task(task)
+        total: int = int(not task.deleted and not task.trash)
+        completed: int = int(bool(total and task.completed))
+        # Task is kept in the dict, so its id can't be reused by another object
+        self.__counted_tasks[id(task)] = (
+            task,
+            task.list_uid,
+            task.parent,
+            total,
+            completed,
+        )
+        if not total:
+            return
+        for counter in (
+            self.__list_status.setdefault(task.list_uid, [0, 0]),
+            self.__sub_tasks_status.setdefault((task.list_uid, task.parent), [0, 0]),
+        ):
+            counter[0] += 1
+            counter[1] += completed
+
+    def __uncount_task(self, task: TaskData) -> None:
+        item: tuple[TaskData, str, str, int, int] | None = self.__counted_tasks.pop(
+            id(task), None
+        )
+        if not item or not item[3]:
+            return
+        _, list_uid, parent, _, completed = item
+        for counter in (
+            self.__list_status[list_uid],
+            self.__sub_tasks_status[(list_uid, parent)],
+        ):
+            counter[0] -= 1
+            counter[1] -= completed
+
+    def __tag_task(self, task: TaskData) -> None:
+        """Add task to tags index or update it there after task's tags were changed"""
+
+        self.__untag_task(task)
+        if not task.tags:
+            return
+        # Task is kept in the dict, so its id can't be reused by another object
+        self.__tagged_tasks[id(task)] = (task, task.tags)
+        for tag in task.tags:
+            self.__tag_tasks.setdefault(tag, {})[id(task)] = task
+
+    def __untag_task(self, task: TaskData) -> None:
+        item: tuple[TaskData, tuple[str, ...]] | None = self.__tagged_tasks.pop(
+            id(task), None
+        )
+        if not item:
+            return
+        for tag in item[1]:
+            tasks: dict[int, TaskData] = self.__tag_tasks[tag]
+            tasks.pop(id(task), None)
+            if not tasks:
+                del self.__tag_tasks[tag]
+
+    def __unindex_task(
+        self, task: TaskData, list_uid: str = None, parent: str = None
+    ) -> None:
+        """
+        Remove task from indexes.
+        Pass list_uid and parent if they were changed after task was indexed.
+        """
 
-        connection = sqlite3.connect(old_db_path)
-        cur = connection.cursor()
+        if self.__in_transaction:
+            self.__index_dirty = True
+            return
 
-        # Convert lists
-        cur.execute("SELECT * FROM lists")
-        lists_data: tuple[tuple] = cur.fetchall()
-        for item in lists_data:
-            self.__task_lists_data.append(
-                TaskListData(deleted=item[0], synced=item[2], name=item[1], uid=item[3])
+        list_uid = task.list_uid if list_uid is None else list_uid
+        parent = task.parent if parent is None else parent
+
+        list_tasks: list[TaskData] = self.__list_tasks_index.get(list_uid, [])
+        self.__remove_task(list_tasks, task)
+        self.__remove_from_due_index(task)
+        self.__uncount_task(task)
+        self.__untag_task(task)
+        self.__remove_sub_task(self.__sub_tasks_index.get((list_uid, parent), []), task)
+
+        key: tuple[str, str] = (list_uid, task.uid)
+        if self.__tasks_index.get(key) is task:
+            del self.__tasks_index[key]
+            if key in self.__duplicate_keys:
+                # Fall back to duplicate with the same uid if there is one
+                for t in list_tasks:
+                    if t.uid == task.uid:
+                        self.__tasks_index[key] = t
+                        break
+                else:
+                    self.__duplicate_keys.discard(key)
+
+    def __reindex_task(self, task: TaskData, old_list_uid: str, old_parent: str):
+        """Update indexes after task's list, parent or order key was changed"""
+
+        if self.__in_transaction:
+            self.__index_dirty = True
+            self.__order_bounds = None
+            return
+
+        if task.list_uid == old_list_uid:
+            self.__remove_item(
+                self.__sub_tasks_index.get((old_list_uid, old_parent), []), task
+            )
+        else:
+            self.__unindex_task(task, old_list_uid, old_parent)
+            self.__index_task(task)
+            # Keep tasks of the new list in the same order as all tasks
+            list_tasks: list[TaskData] = self.__list_tasks_index[task.list_uid]
+            list_tasks.pop()
+            insort(list_tasks, task, key=self.__get_position)
+            self.__remove_item(
+                self.__sub_tasks_index[(task.list_uid, task.parent)], task
+            )
+        self.__insert_sub_task(task)
+
+    def __get_position(self, task: TaskData) -> int:
+        if self.__positions is None:
+            self.__positions = {id(t): idx for idx, t in enumerate(self.__tasks_data)}
+            self.__first_position = 0
+            self.__last_position = len(self.__tasks_data) - 1
+        return self.__positions[id(task)]
+
+    def __remove_task(self, tasks: list[TaskData], task: TaskData) -> None:
+        """Remove task from list in the same order as self.__tasks_data"""
+
+        idx: int = bisect_left(
+            tasks, self.__get_position(task), key=self.__get_position
+        )
+        if idx < len(tasks) and tasks[idx] is task:
+            del tasks[idx]
+        else:
+            self.__remove_item(tasks, task)
+
+    def __remove_sub_task(self, group: list[TaskData], task: TaskData) -> None:
+        """Remove task from sub-tasks sorted by order key"""
+
+        lo: int = bisect_left(group, task.sort_order, key=order_key)
+        hi: int = bisect_right(group, task.sort_order, key=order_key)
+        for idx in range(lo, hi):
+            if group[idx] is task:
+                del group[idx]
+                return
+        # Order key was changed after task was indexed
+        self.__remove_item(group, task)
+
+    def __remove_item(self, items: list[TaskData], item: TaskData) -> None:
+        """Remove item from list by identity, not by dataclass equality"""
+
+        for idx, i in enumerate(items):
+            if i is item:
+                del items[idx]
+                return
+
+    def __move_task(
+        self, list_uid: str, task_uid: str, target_uid: str, offset: int
+    ) -> None:
+        """
+        Move task before (offset = 0) or after (offset = 1) the target task
+        by changing its order key. Sub-tasks are moved together with it.
+        If target is not a sibling - task is moved next to the sibling
+        which has target among its sub-tasks. Moving after the parent
+        makes task the first sub-task.
+        """
+
+        self.__ensure_index()
+        task: TaskData | None = self.__tasks_index.get((list_uid, task_uid))
+        if not task:
+            Log.error(f"Data: Can't move task '{task_uid}'")
+            return
+        siblings: list[TaskData] = [
+            t
+            for t in self.__sub_tasks_index.get((list_uid, task.parent), [])
+            if t is not task
+        ]
+        siblings_uids: list[str] = [t.uid for t in siblings]
+
+        # Find sibling that target belongs to
+        idx: int = len(siblings) if offset else 0
+        for _ in range(len(self.__list_tasks_index.get(list_uid, []))):
+            if target_uid == task_uid:
+                return
+            if target_uid in siblings_uids:
+                idx = siblings_uids.index(target_uid) + offset
+                break
+            if target_uid == task.parent:
+                idx = 0
+                break
+            target: TaskData | None = self.__tasks_index.get((list_uid, target_uid))
+            if not target or not target.parent:
+                break
+            target_uid = target.parent
+
+        before: float | None = siblings[idx - 1].sort_order if idx > 0 else None
+        after: float | None = siblings[idx].sort_order if idx < len(siblings) else None
+        key: float | None = self.__order_key_between(before, after)
+        if key is not None:
+            if key != task.sort_order:
+                self.update_props(
+                    list_uid, task_uid, ["sort_order", "synced"], [key, False]
+                )
+            return
+
+        # No room between keys. Renumber siblings.
+        Log.debug(f"Data: Renumber sub-tasks of '{task.parent}' in '{list_uid}'")
+        with self.transaction():
+            siblings.insert(idx, task)
+            for key, t in enumerate(siblings, 1):
+                if t.sort_order != key:
+                    self.update_props(
+                        list_uid, t.uid, ["sort_order", "synced"], [float(key), False]
+                    )
+
+    def __order_key_between(
+        self, before: float | None, after: float | None
+    ) -> float | None:
+        """Get order key between two keys. None if there is no room between them."""
+
+        if before is None and after is None:
+            return 1.0
+        if before is None:
+            return after - 1
+        if after is None:
+            return before + 1
+        key: float = (before + after) / 2
+        return key if before < key < after else None
+
+    def __new_order_key(self, task: TaskData, on_top: bool) -> float:
+        """Get order key to add task to the start or to the end of its siblings"""
+
+        self.load_tasks()
+        group: tuple[str, str] = (task.list_uid, task.parent)
+        bounds: tuple[float, float] | None = None
+        if self.__index_dirty:
+            # Indexes are rebuilt on commit
+            if self.__order_bounds is None:
+                self.__order_bounds = {}
+                for t in self.__tasks_data:
+                    self.__add_order_bounds(t)
+            bounds = self.__order_bounds.get(group)
+        elif siblings := self.__sub_tasks_index.get(group):
+            bounds = (siblings[0].sort_order, siblings[-1].sort_order)
+
+        if not bounds:
+            return 1.0
+        if on_top:
+            return bounds[0] - 1
+        return bounds[1] + 1
+
+    def __add_order_bounds(self, task: TaskData) -> None:
+        group: tuple[str, str] = (task.list_uid, task.parent)
+        bounds: tuple[float, float] | None = self.__order_bounds.get(group)
+        if not bounds:
+            self.__order_bounds[group] = (task.sort_order, task.sort_order)
+        elif not bounds[0] <= task.sort_order <= bounds[1]:
+            self.__order_bounds[group] = (
+                min(bounds[0], task.sort_order),
+                max(bounds[1], task.sort_order),
+            )
+
+    def __get_sub_tasks(self, list_uid: str, task_uid: str) -> list[TaskData]:
+        self.__ensure_index()
+        return self.__sub_tasks_index.get((list_uid, task_uid), [])
+
+    def __get_sub_tasks_tree(self, list_uid: str, task_uid: str) -> list[TaskData]:
+        tree: list[TaskData] = []
+
+        def __add_sub_tasks(uid: str):
+            sub_tasks: list[TaskData] = self.__get_sub_tasks(list_uid, uid)
+            if sub_tasks:
+                tree.extend(sub_tasks)
+                for sub_task in sub_tasks:
+                    __add_sub_tasks(sub_task.uid)
+
+        __add_sub_tasks(task_uid)
+        return tree
+
+    def __get_task_parents_tree(self, list_uid: str, task_uid: str) -> list[TaskData]:
+        tree: list[TaskData] = []
+        tasks = [t for t in self.tasks if t.list_uid == list_uid]
+
+        def __add_parent(task_uid: str):
+            for task in tasks:
+                if task.parent:
+                    tree.append(task)
+                    __add_parent(task.parent)
+
+        __add_parent(task_uid)
+        return tree
+
+    # ------ STORAGE ------ #
+
+    def _load(
+        self, lists: list[TaskListData], tags: list[TagsData], tasks: list[TaskData]
+    ) -> None:
+        """Set data read from disk without writing it back"""
+
+        self.__task_lists_data = lists
+        self.__tags_data = tags
+        self.__tasks_data = tasks
+        self.__build_index()
+
+    def _load_lazy(
+        self,
+        lists: list[TaskListData],
+        tags: list[TagsData],
+        counters: dict[str, tuple[int, int]],
+        loader: Callable[[], ErrandsData],
+    ) -> None:
+        """
+        Set lists and tags read from disk and load tasks with loader in background.
+        Counters of tasks in lists are used until tasks are loaded.
+        """
+
+        self._load(lists, tags, [])
+        self.__list_counters = counters
+        self.__tasks_loader = loader
+        Thread(name="UserDataLoader", target=self.load_tasks, daemon=True).start()
+
+    def _merge_external(self, data: ErrandsData) -> None:
+        """
+        Apply data changed on disk by another process or restored from backup.
+        Changed lists and tasks are updated in place, so widgets keep their objects.
+        Nothing is written back.
+        """
+
+        records: list[dict[str, Any]] = []
+
+        # Lists
+        old_lists: dict[str, TaskListData] = {
+            lst.uid: lst for lst in self.__task_lists_data
+        }
+        lists: list[TaskListData] = []
+        for lst in data.lists:
+            old_list: TaskListData | None = old_lists.pop(lst.uid, None)
+            if not old_list:
+                lists.append(lst)
+                records.append({"op": "add_list", "list": lst.to_dict()})
+                continue
+            props: list[str] = [
+                f.name
+                for f in fields(lst)
+                if getattr(old_list, f.name) != getattr(lst, f.name)
+            ]
+            for prop in props:
+                setattr(old_list, prop, getattr(lst, prop))
+            if props:
+                records.append(
+                    {
+                        "op": "update_list_props",
+                        "list_uid": lst.uid,
+                        "props": props,
+                        "values": [getattr(lst, p) for p in props],
+                    }
+                )
+            lists.append(old_list)
+        for uid in old_lists:
+            records.append({"op": "delete_list", "list_uid": uid})
+        self.__task_lists_data = lists
+
+        # Tags
+        old_tags: set[str] = {t.text for t in self.__tags_data}
+        new_tags: set[str] = {t.text for t in data.tags}
+        for tag in sorted(new_tags - old_tags):
+            records.append({"op": "add_tag", "tag": tag})
+        for tag in sorted(old_tags - new_tags):
+            records.append({"op": "remove_tag", "tag": tag})
+        self.__tags_data = data.tags
+
+        # Tasks. Duplicates left by move_task_to_list are matched in order.
+        old_tasks: dict[tuple[str, str], list[TaskData]] = {}
+        for task in self.__tasks_data:
+            old_tasks.setdefault((task.list_uid, task.uid), []).append(task)
+        tasks: list[TaskData] = []
+        for task in data.tasks:
+            same: list[TaskData] | None = old_tasks.get((task.list_uid, task.uid))
+            old_task: TaskData | None = same.pop(0) if same else None
+            if not old_task:
+                tasks.append(task)
+                records.append(
+                    {"op": "add_task", "task": task.to_dict(), "on_top": False}
+                )
+                continue
+            props: list[str] = old_task.diff(task)
+            for prop in props:
+                setattr(old_task, prop, getattr(task, prop))
+            if props:
+                records.append(
+                    {
+                        "op": "update_props",
+                        "list_uid": task.list_uid,
+                        "uid": task.uid,
+                        "props": props,
+                        "values": [getattr(task, p) for p in props],
+                    }
+                )
+            tasks.append(old_task)
+        for (list_uid, uid), same in old_tasks.items():
+            for _ in same:
+                records.append({"op": "delete_task", "list_uid": list_uid, "uid": uid})
+        self.__tasks_data = tasks
+        self.__build_index()
+
+        if not records:
+            return
+
+        Log.info(f"Data: Apply {len(records)} external changes")
+        # Undo history can't be applied over changes made elsewhere
+        self.clear_history()
+        self.__emit_changed()
+        self.__queue_changes(records)
+        if self.__external_changes_callbacks:
+            changes: list[DataChange] = [
+                change for record in records for change in self.__get_changes(record)
+            ]
+            GLib.idle_add(self.__emit_external_changes, changes)
+
+    @abstractmethod
+    def _write_records(self, records: list[dict[str, Any]]) -> None:
+        """Write mutation records to disk"""
+
+    @abstractmethod
+    def _write_snapshot(self) -> None:
+        """Write all data to disk"""
+
+    def _schedule_snapshot(self) -> None:
+        """Write snapshot of all data on the next flush"""
+
+        with self.__pending_lock:
+            self.__snapshot_pending = True
+        self.__schedule_flush()
+
+    def __record(self, op: str, **args) -> None:
+        """Pass mutation record to the storage on the next flush"""
+
+        if self.__replaying:
+            return
+
+        self._seq += 1
+        record: dict[str, Any] = {"seq": self._seq, "op": op, **args}
+        if self.__in_transaction:
+            self.__transaction_records.append(record)
+            return
+        with self.__pending_lock:
+            self.__pending_records.append(record)
+        self.__schedule_flush()
+        self.__emit_changed()
+        self.__queue_changes([record])
+
+    def __emit_loaded(self) -> bool:
+        callbacks: list[Callable[[], None]] = self.__loaded_callbacks
+        self.__loaded_callbacks = []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                Log.error(f"Data: Load callback failed. {e}")
+        return False
+
+    def __emit_changed(self) -> None:
+        for callback in self.__changed_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                Log.error(f"Data: Change callback failed. {e}")
+
+    def __queue_changes(self, records: list[dict[str, Any]]) -> None:
+        """Add change events of the records to events emitted in main loop"""
+
+        if not self.__changes_callbacks:
+            return
+
+        with self.__changes_lock:
+            schedule: bool = not self.__changes
+            for record in records:
+                for change in self.__get_changes(record):
+                    key: tuple[type, str, str] = (
+                        type(change),
+                        change.list_uid,
+                        change.uid,
+                    )
+                    if key in self.__changes:
+                        self.__changes[key].merge(change)
+                    else:
+                        self.__changes[key] = change
+            schedule = schedule and bool(self.__changes)
+        if schedule:
+            GLib.idle_add(self.__emit_changes)
+
+    def __emit_external_changes(self, changes: list[DataChange]) -> bool:
+        for callback in self.__external_changes_callbacks:
+            try:
+                callback(changes)
+            except Exception as e:
+                Log.error(f"Data: External changes callback failed. {e}")
+        return False
+
+    def __emit_changes(self) -> bool:
+        with self.__changes_lock:
+            changes: list[DataChange] = list(self.__changes.values())
+            self.__changes = {}
+        for callback in self.__changes_callbacks:
+            try:
+                callback(changes)
+            except Exception as e:
+                Log.error(f"Data: Changes callback failed. {e}")
+        return False
+
+    def __get_changes(self, record: dict[str, Any]) -> list[DataChange]:
+        match record["op"]:
+            case "add_list":
+                return [ListAdded(record["list"]["uid"])]
+            case "update_list_props":
+                return [
+                    ListChanged(record["list_uid"], props=frozenset(record["props"]))
+                ]
+            case "delete_list":
+                return [ListRemoved(record["list_uid"])]
+            case "add_task":
+                return [TaskAdded(record["task"]["list_uid"], record["task"]["uid"])]
+            case "update_props":
+                props: frozenset[str] = frozenset(record["props"])
+                changes: list[DataChange] = [
+                    TaskChanged(record["list_uid"], record["uid"], props)
+                ]
+                if props & MOVE_PROPS:
+                    changes.append(
+                        TaskMoved(record["list_uid"], record["uid"], props & MOVE_PROPS)
+                    )
+                return changes
+            case "delete_task":
+                return [TaskRemoved(record["list_uid"], record["uid"])]
+            case "move_task_to_list":
+                return [
+                    TaskMoved(
+                        record["to_list_uid"],
+                        record["uid"],
+                        frozenset(("list_uid", "parent")),
+                        from_list_uid=record["from_list_uid"],
+                    ),
+                    TasksChanged(record["from_list_uid"]),
+                ]
+            case "add_tag" | "remove_tag":
+                return [TagsChanged(props=frozenset((record["tag"],)))]
+            case "rename_tag":
+                return [
+                    TagsChanged(props=frozenset((record["tag"], record["new_tag"])))
+                ]
+            case _:
+                return [TasksChanged()]
+
+    def __get_archive(self) -> TasksArchive:
+        if not self.__archive:
+            self.__archive = TasksArchive(os.path.join(self.data_dir, "archive.jsonl"))
+        return self.__archive
+
+    def __get_backups(self) -> DataBackups:
+        if not self.__backups:
+            self.__backups = DataBackups(os.path.join(self.data_dir, "backups"))
+        return self.__backups
+
+    def __get_archivable_tasks(self, cutoff: str) -> list[TaskData]:
+        """Archivable tasks which have only archivable sub-tasks"""
+
+        self.__ensure_index()
+        sync_enabled: bool = GSettings.get("sync-provider") != 0
+        # Parents of tasks which are kept are kept too
+        kept: set[tuple[str, str]] = set()
+        for task in self.__tasks_data:
+            if self.is_archivable(task, cutoff, sync_enabled):
+                continue
+            parent: str = task.parent
+            while parent and (task.list_uid, parent) not in kept:
+                kept.add((task.list_uid, parent))
+                parent_task: TaskData | None = self.__tasks_index.get(
+                    (task.list_uid, parent)
+                )
+                parent = parent_task.parent if parent_task else ""
+        return [
+            t
+            for t in self.__tasks_data
+            if (t.list_uid, t.uid) not in kept
+            and self.__tasks_index.get((t.list_uid, t.uid)) is t
+            and self.is_archivable(t, cutoff, sync_enabled)
+        ]
+
+    @synchronized
+    def __finish_archive(self, tasks: list[TaskData], cutoff: str) -> bool:
+        """Remove tasks written to archive if they weren't changed since then"""
+
+        self.__archiving = False
+        archivable: set[int] = {id(t) for t in self.__get_archivable_tasks(cutoff)}
+        archived: list[TaskData] = [t for t in tasks if id(t) in archivable]
+        if not archived:
+            return False
+
+        archived_ids: set[int] = {id(t) for t in archived}
+        with self.transaction():
+            self.__tasks_data = [
+                t for t in self.__tasks_data if id(t) not in archived_ids
+            ]
+            self.__invalidate_index()
+            for task in archived:
+                self.__record("delete_task", list_uid=task.list_uid, uid=task.uid)
+        Log.info(f"Data: Moved {len(archived)} tasks to archive")
+        return False
+
+    def __add_tag(self, tag: str) -> bool:
+        self.load_tasks()
+        for t in self.tags:
+            if t.text == tag:
+                return False
+        self.__tags_data.append(TagsData(text=tag))
+        self.__record("add_tag", tag=tag)
+        return True
+
+    def __history_enabled(self) -> bool:
+        """Only changes made by user in main thread are added to undo history"""
+
+        return not self.__replaying and current_thread() is main_thread()
+
+    def __get_old_values(
+        self, item: TaskData | TaskListData, props: Iterable[str]
+    ) -> tuple[tuple[str, ...], tuple[Any, ...]]:
+        """Changed props (except 'synced') and their values before the change"""
+
+        props = tuple(p for p in props if p != "synced")
+        return props, tuple(getattr(item, p) for p in props)
+
+    def __push_history(self, *ops: tuple) -> None:
+        """Add inverse operations of the change to the current undo group"""
+
+        if not self.__history_enabled():
+            return
+        self.__history_group.extend(ops)
+        if (
+            self.__history_group
+            and not self.__in_transaction
+            and not self.__history_mode
+            and not self.__history_scheduled
+        ):
+            self.__history_scheduled = True
+            GLib.idle_add(self.__close_history_group)
+
+    def __close_history_group(self, keep_empty: bool = False) -> bool:
+        self.__history_scheduled = False
+        if not self.__history_group and not keep_empty:
+            return False
+        match self.__history_mode:
+            case "undo":
+                self.__redo_stack.append(self.__history_group)
+            case "redo":
+                self.__undo_stack.append(self.__history_group)
+            case _:
+                self.__undo_stack.append(self.__history_group)
+                self.__redo_stack.clear()
+        self.__history_group = []
+        depth: int = max(GSettings.get("history-depth"), 0)
+        for stack in (self.__undo_stack, self.__redo_stack):
+            del stack[: max(len(stack) - depth, 0)]
+        return False
+
+    def __replay_history(
+        self, stack: list[list[tuple]], mode: str
+    ) -> list[DataChange] | None:
+        """Apply inverse operations of the last group in the stack"""
+
+        self.__close_history_group()
+        if not stack:
+            return None
+        group: list[tuple] = stack.pop()
+        Log.info(f"Data: {mode.capitalize()} {len(group)} changes")
+        self.__history_mode = mode
+        try:
+            with self.transaction():
+                for op in reversed(group):
+                    self.__apply_inverse(op)
+                records: list[dict[str, Any]] = list(self.__transaction_records)
+            # Keep undo and redo steps paired even if nothing was changed
+            self.__close_history_group(keep_empty=True)
+        finally:
+            self.__history_mode = ""
+            self.__history_group = []
+        return [change for record in records for change in self.__get_changes(record)]
+
+    def __apply_inverse(self, op: tuple) -> None:
+        # Restored values are different from remote ones, so they need sync
+        match op:
+            case ("update_props", task, props, values):
+                self.__restore_task(task)
+                self.update_props(
+                    task.list_uid, task.uid, [*props, "synced"], [*values, False]
+                )
+            case ("restore_task", task):
+                self.__restore_task(task)
+            case ("delete_task", task):
+                self.delete_task(task.list_uid, task.uid)
+            case ("update_list_props", lst, props, values):
+                self.__restore_list(lst)
+                self.update_list_props(lst.uid, [*props, "synced"], [*values, False])
+            case ("delete_list", lst):
+                self.delete_list(lst.uid)
+            case ("add_tag", tag):
+                self.add_tag(tag)
+            case ("remove_tag", tag):
+                self.remove_tag(tag)
+            case ("rename_tag", tag, new_tag):
+                self.rename_tag(tag, new_tag)
+
+    def __restore_task(self, task: TaskData) -> None:
+        """Put task back if it was removed from data, e.g. by clean_deleted()"""
+
+        self.__ensure_index()
+        indexed: TaskData | None = self.__tasks_index.get((task.list_uid, task.uid))
+        # Task can have duplicate with the same uid left by move_task_to_list
+        if indexed is task or (
+            indexed and any(t is task for t in self.__list_tasks_index[task.list_uid])
+        ):
+            return
+        self.__insert_task(task, False)
+        self.__record("add_task", task=task.to_dict(), on_top=False)
+        self.__push_history(("delete_task", task))
+
+    def __restore_list(self, lst: TaskListData) -> None:
+        if any(t.uid == lst.uid for t in self.__task_lists_data):
+            return
+        self.__task_lists_data.append(lst)
+        self.__record("add_list", list=lst.to_dict())
+        self.__push_history(("delete_list", lst))
+
+    def __save(self, item: Any) -> None:
+        """Save values of the object before it is changed in transaction"""
+
+        if self.__in_transaction and id(item) not in self.__transaction_saved:
+            self.__transaction_saved[id(item)] = (
+                item,
+                {f.name: copy(getattr(item, f.name)) for f in fields(item)},
+            )
+
+    def __commit(self) -> None:
+        self.__ensure_index()
+        if not self.__transaction_records:
+            return
+        Log.debug(f"Data: Commit {len(self.__transaction_records)} changes")
+        with self.__pending_lock:
+            self.__pending_records.extend(self.__transaction_records)
+        self.__schedule_flush()
+        self.__emit_changed()
+        self.__queue_changes(self.__transaction_records)
+
+    def __rollback(self) -> None:
+        (
+            self.__task_lists_data,
+            self.__tags_data,
+            self.__tasks_data,
+        ) = self.__transaction_lists
+        for item, values in self.__transaction_saved.values():
+            for name, value in values.items():
+                setattr(item, name, value)
+        del self.__history_group[self.__transaction_history :]
+        self.__build_index()
+
+    def __schedule_flush(self) -> None:
+        """Flush all changes made during FLUSH_DELAY_MS at once"""
+
+        with self.__pending_lock:
+            if self.__flush_scheduled:
+                return
+            self.__flush_scheduled = True
+        GLib.timeout_add(
+            self.FLUSH_DELAY_MS, self.__on_flush_timeout, priority=GLib.PRIORITY_LOW
+        )
+
+    def __on_flush_timeout(self) -> bool:
+        with self.__pending_lock:
+            self.__flush_scheduled = False
+        self.flush()
+        return False
+
+    def _apply_record(self, record: dict[str, Any]) -> None:
+        """Apply mutation record read from disk without recording it again"""
+
+        self.__replaying = True
+        try:
+            self.__apply_record(record)
+        finally:
+            self.__replaying = False
+
+    def __apply_record(self, record: dict[str, Any]) -> None:
+        match record["op"]:
+            case "add_list":
+                self.__task_lists_data.append(TaskListData(**record["list"]))
+            case "update_list_props":
+                self.update_list_props(
+                    record["list_uid"], record["props"], record["values"]
+                )
+            case "delete_list":
+                self.delete_list(record["list_uid"])
+            case "add_task":
+                self.__insert_task(TaskData(**record["task"]), record["on_top"])
+            case "update_props":
+                self.update_props(
+                    record["list_uid"], record["uid"], record["props"], record["values"]
+                )
+            case "delete_task":
+                self.delete_task(record["list_uid"], record["uid"])
+            case "move_task_to_list":
+                self.move_task_to_list(
+                    record["uid"],
+                    record["from_list_uid"],
+                    record["to_list_uid"],
+                    record["new_parent"],
+                )
+            case "delete_tasks_from_trash":
+                self.delete_tasks_from_trash()
+            case "add_tag":
+                self.add_tag(record["tag"])
+            case "remove_tag":
+                self.remove_tag(record["tag"])
+            case "rename_tag":
+                self.rename_tag(record["tag"], record["new_tag"])
+            case "clean_deleted":
+                self.clean_deleted()
+            case "clean_orphans":
+                self.clean_orphans()
+            case _:
+                Log.error(f"Data: Unknown record '{record['op']}'")
+
+
+class UserDataJSON(UserDataBase):
+    """Stores data in data.json snapshot and journal of changes made after it"""
+
+    # Fold journal into data.json when it grows bigger than _ bytes
+    JOURNAL_COMPACT_SIZE: int = 1024 * 1024
+    # Wait for other process to finish writing for _ ms before reading changes
+    RELOAD_DELAY_MS: int = 300
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.__data_file_path: str = os.path.join(self.data_dir, "data.json")
+        self.__journal_file_path: str = os.path.join(self.data_dir, "data.journal")
+        # Lists, tags and tasks counters written on exit for fast startup.
+        # Valid until the next write, so it's removed before any change is written.
+        self.__summary_file_path: str = os.path.join(self.data_dir, "summary.json")
+        self.__old_db_path: str = os.path.join(self.data_dir, "data.db")
+        # Held by every process while it reads and writes data files
+        self.__lock_file_path: str = os.path.join(self.data_dir, "data.lock")
+
+        # data.json stores the sequence number of the last mutation included in it,
+        # so journal records older than the snapshot are skipped on replay.
+        self.__snapshot_seq: int = 0
+        self.__journal_size: int = 0
+        self.__journal_lock: Lock = Lock()
+
+        # Data files state after they were last read or written by this process.
+        # If it's different - files were changed by another process.
+        self.__disk_stamp: tuple | None = None
+        self.__monitor: Gio.FileMonitor | None = None
+        self.__reload_scheduled: bool = False
+
+    def exists(self) -> bool:
+        return os.path.exists(self.__data_file_path) or os.path.exists(
+            self.__old_db_path
+        )
+
+    def init(self) -> None:
+        Log.debug("Data: Initialize")
+        if not os.path.exists(self.data_dir):
+            Log.debug("Data: Create data directory")
+            os.mkdir(self.data_dir)
+
+        self.__convert_data()
+
+        if not os.path.exists(self.__data_file_path):
+            Log.debug("Data: Create data.json file")
+            self.__write_data(wait=True)
+
+        # Files changed after this are reloaded
+        self.__disk_stamp = self.__get_disk_stamp()
+
+        # Show lists right away and load tasks in background
+        if not self.__read_summary():
+            self.__read_data()
+            self.__replay_journal()
+
+        self.__watch()
+
+    def close(self) -> None:
+        self.__unwatch()
+        super().close()
+        FileWriter.wait()
+        self.__write_summary()
+
+    def remove(self) -> None:
+        Log.info("Data: Move data.json to backup")
+        self.__unwatch()
+        FileWriter.wait()
+        self.__remove_summary()
+        os.replace(self.__data_file_path, self.__data_file_path + ".old")
+        if os.path.exists(self.__journal_file_path):
+            os.replace(self.__journal_file_path, self.__journal_file_path + ".old")
+
+    # ------ PRIVATE METHODS ------ #
+
+    def _write_records(self, records: list[dict[str, Any]]) -> None:
+        self.__remove_summary()
+        with file_lock(self.__lock_file_path), self.__journal_lock:
+            # Records are written on top of changes made by another process
+            if self.__changed_on_disk():
+                self.__reload(records)
+
+            # Renumber records, so they are newer than records of other processes
+            lines: list[str] = []
+            for record in records:
+                self._seq += 1
+                try:
+                    lines.append(
+                        json.dumps({**record, "seq": self._seq}, ensure_ascii=False)
+                        + "\n"
+                    )
+                except Exception as e:
+                    Log.error(f"Data: Can't write to journal. {e}.")
+
+            Log.debug(f"Data: Write {len(lines)} journal records")
+            try:
+                with open(self.__journal_file_path, "a") as f:
+                    f.writelines(lines)
+            except Exception as e:
+                Log.error(f"Data: Can't write to journal. {e}.")
+                return
+            self.__disk_stamp = self.__get_disk_stamp()
+            self.__journal_size += sum(len(line) for line in lines)
+            compact: bool = self.__journal_size > self.JOURNAL_COMPACT_SIZE
+
+        if compact:
+            Log.debug("Data: Compact journal")
+            self.__write_data(compact=True)
+
+    def _write_snapshot(self) -> None:
+        self.__write_data()
+
+    def __backup_data(self) -> None:
+        Log.info("Data: Backup")
+        shutil.copyfile(self.__data_file_path, self.__data_file_path + ".old")
+        # Journal can't be applied without the snapshot it was written for
+        if os.path.exists(self.__journal_file_path):
+            os.replace(self.__journal_file_path, self.__journal_file_path + ".old")
+
+    def __convert_data(self):
+        if not os.path.exists(self.__old_db_path):
+            return
+
+        Log.info("Data: Convert old data format to a new one")
+
+        connection = sqlite3.connect(self.__old_db_path)
+        cur = connection.cursor()
+
+        # Convert lists
+        lists: list[TaskListData] = []
+        cur.execute("SELECT * FROM lists")
+        lists_data: tuple[tuple] = cur.fetchall()
+        for item in lists_data:
+            lists.append(
+                TaskListData(deleted=item[0], synced=item[2], name=item[1], uid=item[3])
             )
 
         # Convert tasks
+        tasks: list[TaskData] = []
         cur.execute("SELECT * FROM tasks")
         tasks_data: tuple[tuple] = cur.fetchall()
         for item in tasks_data:
-            self.__tasks_data.append(
+            tasks.append(
                 TaskData(
                     color=item[0],
                     completed=item[1],
@@ -634,66 +2512,1294 @@ class UserDataJSON:
                 )
             )
 
-        os.remove(old_db_path)
+        connection.close()
+        os.remove(self.__old_db_path)
 
+        self._load(lists, [], tasks)
         self.clean_orphans()
 
-        self.__write_data()
+        self.__write_data(wait=True)
 
     def __read_data(self) -> None:
         try:
             Log.debug("Data: Read data")
-            with open(self.__data_file_path, "r") as f:
-                data: dict[str, Any] = json.load(f)
-                self.__task_lists_data = [TaskListData(**lst) for lst in data["lists"]]
-                self.__tasks_data = [TaskData(**t) for t in data["tasks"]]
-                self.__tags_data = [TagsData(**t) for t in data["tags"]]
+            self.__read_data_file()
         except Exception as e:
             Log.error(
                 f"Data: Can't read data file from disk. {e}. Creating new data file"
             )
             self.__backup_data()
-            self.__write_data()
+            self.__write_data(wait=True)
+
+    def __read_data_file(self) -> None:
+        with open(self.__data_file_path, "r") as f:
+            data: dict[str, Any] = json.load(f)
+        self._load(
+            [TaskListData.from_dict(lst) for lst in data["lists"]],
+            [TagsData.from_dict(t) for t in data["tags"]],
+            [TaskData.from_dict(t) for t in data["tasks"]],
+        )
+        self._seq = self.__snapshot_seq = data.get("seq", 0)
+
+    def __write_data(self, compact: bool = False, wait: bool = False) -> None:
+        """
+        Queue snapshot of all data to data.json. Journal records that are included
+        in it are removed after it is written. Compaction is skipped if files were
+        changed by another process. If wait is True - block until it is written.
+        """
 
-    def __write_data(self) -> None:
         try:
             Log.debug("Data: Write data")
-            data: dict[str, list[TaskListData | TaskData]] = {
-                "lists": [asdict(lst) for lst in self.task_lists],
-                "tags": [asdict(t) for t in self.tags],
-                "tasks": [asdict(t) for t in self.tasks],
+            self.__remove_summary()
+            self._seq += 1
+            self.__journal_size = 0
+            data: dict[str, Any] = {
+                "seq": self._seq,
+                "lists": [lst.to_dict() for lst in self.task_lists],
+                "tags": [t.to_dict() for t in self.tags],
+                "tasks": [t.to_dict() for t in self.tasks],
             }
-            w = ThreadSafeWriter(self.__data_file_path, "w")
-            w.write(json.dumps(data, ensure_ascii=False))
-            w.close()
+
+            def __dump() -> str | None:
+                # Journal has changes of another process that are not in the snapshot
+                if compact and self.__changed_on_disk():
+                    Log.debug("Data: Data files were changed. Skip compaction.")
+                    return None
+                return json.dumps(data, ensure_ascii=False)
+
+            FileWriter.write(
+                self.__data_file_path,
+                __dump,
+                lambda: self.__on_snapshot_written(data["seq"]),
+                self.__lock_file_path,
+            )
+            if wait:
+                FileWriter.wait()
         except Exception as e:
             Log.error(f"Data: Can't write to disk. {e}.")
 
+    def __on_snapshot_written(self, seq: int) -> None:
+        self.__snapshot_seq = seq
+        self.__trim_journal(seq)
+        self.__disk_stamp = self.__get_disk_stamp()
+
+    # ------ EXTERNAL CHANGES ------ #
+
+    def __get_disk_stamp(self) -> tuple:
+        stamp: list[tuple[int, int, int] | None] = []
+        for path in (self.__data_file_path, self.__journal_file_path):
+            try:
+                stat: os.stat_result = os.stat(path)
+                stamp.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    def __changed_on_disk(self) -> bool:
+        return self.__get_disk_stamp() != self.__disk_stamp
+
+    def __watch(self) -> None:
+        """Watch data directory for data files changed by another process"""
+
+        try:
+            self.__monitor = Gio.File.new_for_path(self.data_dir).monitor_directory(
+                Gio.FileMonitorFlags.WATCH_MOVES, None
+            )
+            self.__monitor.connect("changed", self.__on_data_dir_changed)
+        except Exception as e:
+            Log.error(f"Data: Can't watch data directory. {e}")
+
+    def __unwatch(self) -> None:
+        if self.__monitor:
+            self.__monitor.cancel()
+            self.__monitor = None
+
+    def __on_data_dir_changed(
+        self,
+        _monitor: Gio.FileMonitor,
+        file: Gio.File,
+        other_file: Gio.File | None,
+        _event: Gio.FileMonitorEvent,
+    ) -> None:
+        names: tuple[str, str] = ("data.json", "data.journal")
+        if file.get_basename() not in names and not (
+            other_file and other_file.get_basename() in names
+        ):
+            return
+        if not self.__reload_scheduled:
+            self.__reload_scheduled = True
+            GLib.timeout_add(self.RELOAD_DELAY_MS, self.__on_reload_timeout)
+
+    def __on_reload_timeout(self) -> bool:
+        self.__reload_scheduled = False
+        # Changes written by this process are skipped here.
+        # Tasks that are not loaded yet will be read with all changes.
+        if not self.tasks_loaded or not self.__changed_on_disk():
+            return False
+        # Pending changes are written on top of changes from disk
+        with self._lock:
+            self.flush()
+            with file_lock(self.__lock_file_path), self.__journal_lock:
+                if self.__changed_on_disk():
+                    self.__reload([])
+        return False
+
+    def __reload(self, records: list[dict[str, Any]]) -> None:
+        """
+        Read data files changed by another process and apply the difference.
+        Records that are not written yet are applied on top of them.
+        Called while holding the data lock.
+        """
+
+        Log.info("Data: Data files were changed by another process. Reload.")
+        loader: UserDataJSON = UserDataJSON()
+        try:
+            loader.__read_data_file()
+        except Exception as e:
+            Log.error(f"Data: Can't read changed data file. {e}")
+            return
+        loader.__replay_journal()
+        for record in records:
+            loader._apply_record(record)
+        self._seq = max(self._seq, loader._seq)
+        self.__snapshot_seq = loader.__snapshot_seq
+        self.__journal_size = loader.__journal_size
+        self._merge_external(loader.data)
+        self.__disk_stamp = self.__get_disk_stamp()
+
+    # ------ SUMMARY ------ #
+
+    def __read_summary(self) -> bool:
+        """
+        Read lists, tags and counters from summary and start loading tasks
+        in background. Returns False if there is no valid summary.
+        """
+
+        if not os.path.exists(self.__summary_file_path):
+            return False
+
+        Log.debug("Data: Read summary")
+        try:
+            with open(self.__summary_file_path, "r") as f:
+                summary: dict[str, Any] = json.load(f)
+            lists: list[TaskListData] = [
+                TaskListData.from_dict(lst) for lst in summary["lists"]
+            ]
+            tags: list[TagsData] = [TagsData.from_dict(t) for t in summary["tags"]]
+            counters: dict[str, tuple[int, int]] = {
+                uid: tuple(counter) for uid, counter in summary["counters"].items()
+            }
+            seq: int = summary["seq"]
+        except Exception as e:
+            Log.error(f"Data: Can't read summary. {e}")
+            return False
+
+        self._seq = seq
+        self._load_lazy(lists, tags, counters, self.__load_tasks)
+        return True
+
+    def __load_tasks(self) -> ErrandsData:
+        """Read data.json and journal. Called in background thread."""
+
+        # Read into separate object, so lists shown in UI are not changed on replay
+        loader: UserDataJSON = UserDataJSON()
+        loader.__read_data()
+        loader.__replay_journal()
+        if loader._seq != self._seq:
+            Log.error("Data: Summary doesn't match data.json")
+        self._seq = loader._seq
+        self.__snapshot_seq = loader.__snapshot_seq
+        self.__journal_size = loader.__journal_size
+        return loader.data
+
+    def __write_summary(self) -> None:
+        Log.debug("Data: Write summary")
+        summary: dict[str, Any] = {
+            "seq": self._seq,
+            "lists": [lst.to_dict() for lst in self.task_lists],
+            "tags": [t.to_dict() for t in self.tags],
+            "counters": {lst.uid: self.get_status(lst.uid) for lst in self.task_lists},
+        }
+        try:
+            FileWriter.write_file(
+                self.__summary_file_path, json.dumps(summary, ensure_ascii=False)
+            )
+        except Exception as e:
+            Log.error(f"Data: Can't write summary. {e}.")
+
+    def __remove_summary(self) -> None:
+        if os.path.exists(self.__summary_file_path):
+            Log.debug("Data: Remove summary")
+            os.remove(self.__summary_file_path)
+
+    # ------ JOURNAL ------ #
+
+    def __trim_journal(self, seq: int) -> None:
+        """Remove journal records that are already included in snapshot"""
 
-class ThreadSafeWriter:
-    def __init__(self, path: str, mode: str) -> None:
-        self.filewriter = open(path, mode)
-        self.queue = Queue()
-        self.finished = False
-        Thread(name="ThreadSafeWriter", target=self.internal_writer).start()
+        with self.__journal_lock:
+            if not os.path.exists(self.__journal_file_path):
+                return
+            with open(self.__journal_file_path, "r") as f:
+                records: list[str] = [
+                    line for line in f if self.__record_seq(line) > seq
+                ]
+            if records:
+                FileWriter.write_file(self.__journal_file_path, "".join(records))
+            else:
+                os.remove(self.__journal_file_path)
+
+    def __record_seq(self, record: str) -> int:
+        try:
+            return json.loads(record)["seq"]
+        except Exception:
+            return 0
+
+    def __replay_journal(self) -> None:
+        """Apply journal records written after the last snapshot"""
+
+        if not os.path.exists(self.__journal_file_path):
+            return
+
+        Log.debug("Data: Replay journal")
+        try:
+            with open(self.__journal_file_path, "r") as f:
+                for line in f:
+                    try:
+                        record: dict[str, Any] = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Record was not fully written
+                        Log.error("Data: Skip broken journal record")
+                        break
+                    self.__journal_size += len(line)
+                    if record["seq"] <= self.__snapshot_seq:
+                        continue
+                    self._apply_record(record)
+                    self._seq = record["seq"]
+        except Exception as e:
+            Log.error(f"Data: Can't replay journal. {e}")
+
+
+class UserDataSQLite(UserDataBase):
+    """
+    Stores data in SQLite database.
+    Changes are written with single-row statements instead of rewriting all data.
+    """
+
+    LIST_COLUMNS: tuple[str] = tuple(f.name for f in fields(TaskListData))
+    TASK_COLUMNS: tuple[str] = tuple(f.name for f in fields(TaskData))
+    BOOL_COLUMNS: tuple[str] = tuple(
+        f.name for f in fields(TaskListData) + fields(TaskData) if f.type == "bool"
+    )
+    # Columns with lists stored as JSON arrays
+    JSON_COLUMNS: tuple[str] = ("attachments", "tags")
+
+    SCHEMA: str = """
+    CREATE TABLE IF NOT EXISTS lists (
+        id INTEGER PRIMARY KEY,
+        color TEXT NOT NULL DEFAULT '',
+        deleted INTEGER NOT NULL DEFAULT 0,
+        name TEXT NOT NULL DEFAULT '',
+        show_completed INTEGER NOT NULL DEFAULT 1,
+        synced INTEGER NOT NULL DEFAULT 0,
+        uid TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS lists_uid ON lists (uid);
+
+    CREATE TABLE IF NOT EXISTS tags (
+        id INTEGER PRIMARY KEY,
+        text TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS tasks (
+        id INTEGER PRIMARY KEY,
+        position REAL NOT NULL,
+        attachments TEXT NOT NULL DEFAULT '[]',
+        color TEXT NOT NULL DEFAULT '',
+        completed INTEGER NOT NULL DEFAULT 0,
+        changed_at TEXT NOT NULL DEFAULT '',
+        created_at TEXT NOT NULL DEFAULT '',
+        deleted INTEGER NOT NULL DEFAULT 0,
+        due_date TEXT NOT NULL DEFAULT '',
+        expanded INTEGER NOT NULL DEFAULT 0,
+        list_uid TEXT NOT NULL DEFAULT '',
+        notes TEXT NOT NULL DEFAULT '',
+        notified INTEGER NOT NULL DEFAULT 0,
+        parent TEXT NOT NULL DEFAULT '',
+        percent_complete NUMERIC NOT NULL DEFAULT 0,
+        priority INTEGER NOT NULL DEFAULT 0,
+        rrule TEXT NOT NULL DEFAULT '',
+        sort_order REAL NOT NULL DEFAULT 0,
+        start_date TEXT NOT NULL DEFAULT '',
+        synced INTEGER NOT NULL DEFAULT 0,
+        tags TEXT NOT NULL DEFAULT '[]',
+        text TEXT NOT NULL DEFAULT '',
+        toolbar_shown INTEGER NOT NULL DEFAULT 0,
+        trash INTEGER NOT NULL DEFAULT 0,
+        uid TEXT NOT NULL DEFAULT ''
+    );
+    CREATE INDEX IF NOT EXISTS tasks_uid ON tasks (list_uid, uid);
+    CREATE INDEX IF NOT EXISTS tasks_parent ON tasks (list_uid, parent);
+    CREATE INDEX IF NOT EXISTS tasks_due_date ON tasks (due_date) WHERE due_date != '';
+    CREATE INDEX IF NOT EXISTS tasks_position ON tasks (position);
+
+    CREATE TABLE IF NOT EXISTS task_tags (
+        task_id INTEGER NOT NULL REFERENCES tasks (id) ON DELETE CASCADE,
+        tag TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS task_tags_tag ON task_tags (tag);
+    CREATE INDEX IF NOT EXISTS task_tags_task_id ON task_tags (task_id);
+
+    CREATE TRIGGER IF NOT EXISTS tasks_tags_insert AFTER INSERT ON tasks BEGIN
+        INSERT INTO task_tags (task_id, tag)
+        SELECT new.id, value FROM json_each(new.tags);
+    END;
+    CREATE TRIGGER IF NOT EXISTS tasks_tags_update AFTER UPDATE OF tags ON tasks BEGIN
+        DELETE FROM task_tags WHERE task_id = old.id;
+        INSERT INTO task_tags (task_id, tag)
+        SELECT new.id, value FROM json_each(new.tags);
+    END;
+    """
+
+    # Row of the task with given list_uid and uid.
+    # Prefer tasks that are not deleted, same as in-memory index does.
+    TASK_ID: str = """(
+        SELECT id FROM tasks WHERE list_uid = ? AND uid = ?
+        ORDER BY deleted, position LIMIT 1
+    )"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.__db_path: str = os.path.join(self.data_dir, "data.sqlite")
+        self.__connection: sqlite3.Connection | None = None
+        # Writes queued to FileWriter
+        self.__writes: int = 0
+
+    def exists(self) -> bool:
+        return os.path.exists(self.__db_path)
 
-    def write(self, data):
-        self.queue.put(data)
+    def init(self) -> None:
+        Log.debug("Data: Initialize SQLite database")
+        if not os.path.exists(self.data_dir):
+            Log.debug("Data: Create data directory")
+            os.mkdir(self.data_dir)
+
+        try:
+            self.__connect()
+            self.__read_data()
+        except Exception as e:
+            Log.error(f"Data: Can't read database. {e}. Creating new database")
+            self.remove()
+            self.__connect()
+
+    def close(self) -> None:
+        super().close()
+        self.__close()
+
+    def remove(self) -> None:
+        Log.info("Data: Move data.sqlite to backup")
+        self.__close()
+        # Keep write-ahead log files next to the database they belong to
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.__db_path + suffix):
+                os.replace(self.__db_path + suffix, self.__db_path + ".old" + suffix)
 
-    def internal_writer(self):
-        while not self.finished:
+    # ------ PRIVATE METHODS ------ #
+
+    def __connect(self) -> None:
+        # Data is read in main thread and written in FileWriter thread
+        self.__connection = sqlite3.connect(self.__db_path, check_same_thread=False)
+        self.__connection.row_factory = sqlite3.Row
+        self.__connection.execute("PRAGMA journal_mode = WAL")
+        self.__connection.execute("PRAGMA synchronous = NORMAL")
+        self.__connection.execute("PRAGMA foreign_keys = ON")
+        self.__connection.executescript(self.SCHEMA)
+        self.__upgrade_schema()
+
+    def __upgrade_schema(self) -> None:
+        """Add columns of task fields that were added after database was created"""
+
+        columns: set[str] = {
+            row["name"] for row in self.__connection.execute("PRAGMA table_info(tasks)")
+        }
+        with self.__connection:
+            if "sort_order" not in columns:
+                Log.info("Data: Add sort_order column to database")
+                self.__connection.execute(
+                    "ALTER TABLE tasks ADD COLUMN sort_order REAL NOT NULL DEFAULT 0"
+                )
+
+    def __close(self) -> None:
+        # Queued writes use the connection
+        FileWriter.wait()
+        if self.__connection:
+            self.__connection.close()
+            self.__connection = None
+
+    def __read_data(self) -> None:
+        Log.debug("Data: Read data")
+        cur: sqlite3.Cursor = self.__connection.cursor()
+        lists: list[TaskListData] = [
+            self.__from_row(TaskListData, row)
+            for row in cur.execute("SELECT * FROM lists ORDER BY id")
+        ]
+        tags: list[TagsData] = [
+            TagsData(text=row["text"])
+            for row in cur.execute("SELECT text FROM tags ORDER BY id")
+        ]
+        tasks: list[TaskData] = [
+            self.__from_row(TaskData, row)
+            for row in cur.execute("SELECT * FROM tasks ORDER BY position, id")
+        ]
+        self._load(lists, tags, tasks)
+
+    def __from_row(self, cls: type, row: sqlite3.Row) -> Any:
+        values: dict[str, Any] = {}
+        for f in fields(cls):
+            value: Any = row[f.name]
+            if f.name in self.JSON_COLUMNS:
+                value = json.loads(value)
+            elif f.name in self.BOOL_COLUMNS:
+                value = bool(value)
+            values[f.name] = value
+        return cls(**values)
+
+    def __to_sql(self, column: str, value: Any) -> Any:
+        if column in self.JSON_COLUMNS:
+            return json.dumps(value, ensure_ascii=False)
+        return value
+
+    def __to_row(self, columns: tuple[str], data: dict[str, Any]) -> list[Any]:
+        return [self.__to_sql(c, data[c]) for c in columns]
+
+    def __set_clause(
+        self, columns: tuple[str], props: list[str], values: list[Any]
+    ) -> tuple[str, list[Any]]:
+        """Build SET clause of UPDATE statement for given properties"""
+
+        for prop in props:
+            if prop not in columns:
+                raise ValueError(f"Unknown property '{prop}'")
+        clause: str = ", ".join(f"{prop} = ?" for prop in props)
+        params: list[Any] = [self.__to_sql(p, v) for p, v in zip(props, values)]
+        return clause, params
+
+    def _write_snapshot(self) -> None:
+        # Rows are taken now, so changes made before the write are not mixed in
+        lists: list[list[Any]] = [
+            self.__to_row(self.LIST_COLUMNS, lst.to_dict()) for lst in self.task_lists
+        ]
+        tags: list[tuple[str]] = [(t.text,) for t in self.tags]
+        tasks: list[list[Any]] = [
+            [idx] + self.__to_row(self.TASK_COLUMNS, t.to_dict())
+            for idx, t in enumerate(self.tasks)
+        ]
+        list_cols: str = ", ".join(self.LIST_COLUMNS)
+        task_cols: str = ", ".join(self.TASK_COLUMNS)
+        list_params: str = ", ".join("?" for _ in self.LIST_COLUMNS)
+        task_params: str = ", ".join("?" for _ in self.TASK_COLUMNS)
+
+        def __write() -> None:
+            Log.debug("Data: Write data")
+            with self.__connection:
+                cur: sqlite3.Cursor = self.__connection.cursor()
+                cur.execute("DELETE FROM tasks")
+                cur.execute("DELETE FROM lists")
+                cur.execute("DELETE FROM tags")
+                cur.executemany(
+                    f"INSERT INTO lists ({list_cols}) VALUES ({list_params})", lists
+                )
+                cur.executemany("INSERT INTO tags (text) VALUES (?)", tags)
+                cur.executemany(
+                    f"INSERT INTO tasks (position, {task_cols}) VALUES (?, {task_params})",
+                    tasks,
+                )
+
+        self.__queue_write(__write)
+
+    def _write_records(self, records: list[dict[str, Any]]) -> None:
+        def __write() -> None:
+            Log.debug(f"Data: Write {len(records)} changes to database")
+            with self.__connection:
+                cur: sqlite3.Cursor = self.__connection.cursor()
+                for record in records:
+                    self.__write_record(cur, record)
+
+        self.__queue_write(__write)
+
+    def __queue_write(self, write: Callable[[], None]) -> None:
+        """
+        Write to database in FileWriter thread, so main loop doesn't wait for disk.
+        Writes are queued by different names to run one by one in order.
+        """
+
+        def __run() -> None:
             try:
-                data = self.queue.get(True, 1)
-            except Empty:
-                continue
-            self.filewriter.write(data)
-            self.queue.task_done()
+                write()
+            except Exception as e:
+                Log.error(f"Data: Can't write to database. {e}.")
+            # No file is written by FileWriter
+
+        self.__writes += 1
+        FileWriter.write(f"{self.__db_path}:{self.__writes}", __run)
+
+    def __write_record(self, cur: sqlite3.Cursor, record: dict[str, Any]) -> None:
+        match record["op"]:
+            case "add_list":
+                cur.execute(
+                    f"INSERT INTO lists ({', '.join(self.LIST_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' for _ in self.LIST_COLUMNS)})",
+                    self.__to_row(self.LIST_COLUMNS, record["list"]),
+                )
+            case "update_list_props":
+                clause, params = self.__set_clause(
+                    self.LIST_COLUMNS, record["props"], record["values"]
+                )
+                cur.execute(
+                    f"UPDATE lists SET {clause} WHERE uid = ?",
+                    params + [record["list_uid"]],
+                )
+            case "delete_list":
+                cur.execute(
+                    "UPDATE lists SET deleted = 1 WHERE uid = ?", (record["list_uid"],)
+                )
+                cur.execute(
+                    "DELETE FROM tasks WHERE list_uid = ?", (record["list_uid"],)
+                )
+            case "add_task":
+                position: str = (
+                    "SELECT IFNULL(MIN(position), 0) - 1 FROM tasks"
+                    if record["on_top"]
+                    else "SELECT IFNULL(MAX(position), 0) + 1 FROM tasks"
+                )
+                cur.execute(
+                    f"INSERT INTO tasks (position, {', '.join(self.TASK_COLUMNS)}) "
+                    f"VALUES (({position}), {', '.join('?' for _ in self.TASK_COLUMNS)})",
+                    self.__to_row(self.TASK_COLUMNS, record["task"]),
+                )
+            case "update_props":
+                props: list[str] = record["props"]
+                values: list[Any] = record["values"]
+                if "due_date" in props:
+                    props = props + ["notified"]
+                    values = values + [False]
+                clause, params = self.__set_clause(self.TASK_COLUMNS, props, values)
+                cur.execute(
+                    f"UPDATE tasks SET {clause} WHERE id = {self.TASK_ID}",
+                    params + [record["list_uid"], record["uid"]],
+                )
+            case "delete_task":
+                cur.execute(
+                    f"DELETE FROM tasks WHERE id = {self.TASK_ID}",
+                    (record["list_uid"], record["uid"]),
+                )
+            case "move_task_to_list":
+                self.__move_task_to_list(
+                    cur,
+                    record["uid"],
+                    record["from_list_uid"],
+                    record["to_list_uid"],
+                    record["new_parent"],
+                )
+            case "delete_tasks_from_trash":
+                cur.execute(
+                    "UPDATE tasks SET deleted = 1, synced = 0 "
+                    "WHERE trash = 1 AND deleted = 0"
+                )
+            case "add_tag":
+                cur.execute("INSERT INTO tags (text) VALUES (?)", (record["tag"],))
+            case "remove_tag":
+                self.__remove_tag(cur, record["tag"])
+            case "rename_tag":
+                self.__rename_tag(cur, record["tag"], record["new_tag"])
+            case "clean_deleted":
+                cur.execute("DELETE FROM lists WHERE deleted = 1")
+                cur.execute("DELETE FROM tasks WHERE deleted = 1")
+            case "clean_orphans":
+                cur.execute(
+                    "UPDATE tasks SET parent = '' "
+                    "WHERE parent != '' AND parent NOT IN (SELECT uid FROM tasks)"
+                )
+            case _:
+                Log.error(f"Data: Unknown record '{record['op']}'")
+
+    def __get_task_row(
+        self, cur: sqlite3.Cursor, list_uid: str, uid: str
+    ) -> sqlite3.Row | None:
+        return cur.execute(
+            f"SELECT id, uid, position FROM tasks WHERE id = {self.TASK_ID}",
+            (list_uid, uid),
+        ).fetchone()
+
+    def __get_sub_tasks_tree_rows(
+        self, cur: sqlite3.Cursor, list_uid: str, uid: str
+    ) -> list[sqlite3.Row]:
+        """Get rows of all sub-tasks in the same order as in-memory tree"""
+
+        sub_tasks: dict[str, list[sqlite3.Row]] = {}
+        for row in cur.execute(
+            "SELECT id, uid, parent FROM tasks "
+            "WHERE list_uid = ? ORDER BY sort_order, position, id",
+            (list_uid,),
+        ):
+            sub_tasks.setdefault(row["parent"], []).append(row)
+
+        tree: list[sqlite3.Row] = []
+
+        def __add_sub_tasks(uid: str):
+            rows: list[sqlite3.Row] = sub_tasks.get(uid, [])
+            tree.extend(rows)
+            for row in rows:
+                __add_sub_tasks(row["uid"])
+
+        __add_sub_tasks(uid)
+        return tree
 
-    def close(self):
-        self.queue.join()
-        self.finished = True
-        self.filewriter.close()
+    def __move_task_to_list(
+        self,
+        cur: sqlite3.Cursor,
+        uid: str,
+        from_list_uid: str,
+        to_list_uid: str,
+        new_parent: str,
+    ) -> None:
+        """Copy task with sub-tasks to the end of other list and mark originals deleted"""
+
+        task: sqlite3.Row | None = self.__get_task_row(cur, from_list_uid, uid)
+        if not task:
+            return
+        rows: list[sqlite3.Row] = [task] + self.__get_sub_tasks_tree_rows(
+            cur, from_list_uid, uid
+        )
+        position: float = cur.execute(
+            "SELECT IFNULL(MAX(position), 0) FROM tasks"
+        ).fetchone()[0]
+        task_cols: str = ", ".join(self.TASK_COLUMNS)
+        for idx, row in enumerate(rows):
+            cur.execute(
+                f"INSERT INTO tasks (position, {task_cols}) "
+                f"SELECT ?, {task_cols} FROM tasks WHERE id = ?",
+                (position + idx + 1, row["id"]),
+            )
+            cur.execute(
+                "UPDATE tasks SET list_uid = ?, parent = ?, synced = 0 WHERE id = ?",
+                (to_list_uid, new_parent if idx == 0 else row["parent"], cur.lastrowid),
+            )
+        ids: list[int] = [row["id"] for row in rows]
+        cur.execute(
+            "UPDATE tasks SET deleted = 1, synced = 0 "
+            f"WHERE id IN ({', '.join('?' for _ in ids)})",
+            ids,
+        )
+
+    def __remove_tag(self, cur: sqlite3.Cursor, tag: str) -> None:
+        cur.execute("DELETE FROM tags WHERE text = ?", (tag,))
+        rows: list[sqlite3.Row] = cur.execute(
+            "SELECT id, tags FROM tasks WHERE id IN "
+            "(SELECT task_id FROM task_tags WHERE tag = ?)",
+            (tag,),
+        ).fetchall()
+        cur.executemany(
+            "UPDATE tasks SET tags = ?, synced = 0 WHERE id = ?",
+            [
+                (
+                    self.__to_sql(
+                        "tags", [t for t in json.loads(row["tags"]) if t != tag]
+                    ),
+                    row["id"],
+                )
+                for row in rows
+            ],
+        )
+
+    def __rename_tag(self, cur: sqlite3.Cursor, tag: str, new_tag: str) -> None:
+        if cur.execute("SELECT 1 FROM tags WHERE text = ?", (new_tag,)).fetchone():
+            cur.execute("DELETE FROM tags WHERE text = ?", (tag,))
+        else:
+            cur.execute("UPDATE tags SET text = ? WHERE text = ?", (new_tag, tag))
+        rows: list[sqlite3.Row] = cur.execute(
+            "SELECT id, tags FROM tasks WHERE id IN "
+            "(SELECT task_id FROM task_tags WHERE tag = ?)",
+            (tag,),
+        ).fetchall()
+        cur.executemany(
+            "UPDATE tasks SET tags = ?, synced = 0 WHERE id = ?",
+            [
+                (
+                    self.__to_sql(
+                        "tags",
+                        list(
+                            dict.fromkeys(
+                                new_tag if t == tag else t
+                                for t in json.loads(row["tags"])
+                            )
+                        ),
+                    ),
+                    row["id"],
+                )
+                for row in rows
+            ],
+        )
+
+
+class UserDataSharded(UserDataBase):
+    """
+    Stores tasks of every list in its own file in "lists" directory and lists,
+    tags and tasks counters in lists.json manifest.
+    Only files of changed lists are rewritten on flush.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.__manifest_path: str = os.path.join(self.data_dir, "lists.json")
+        self.__shards_dir: str = os.path.join(self.data_dir, "lists")
+
+    def exists(self) -> bool:
+        return os.path.exists(self.__manifest_path)
+
+    def init(self) -> None:
+        Log.debug("Data: Initialize sharded storage")
+        os.makedirs(self.__shards_dir, exist_ok=True)
+
+        if not os.path.exists(self.__manifest_path):
+            Log.debug("Data: Create lists.json file")
+            self._write_snapshot()
+            FileWriter.wait()
+
+        # Show lists right away and load tasks in background
+        try:
+            self.__read_manifest()
+        except Exception as e:
+            Log.error(f"Data: Can't read lists.json. {e}. Creating new data files")
+            self.__backup_data()
+            self._write_snapshot()
+
+    def close(self) -> None:
+        super().close()
+        FileWriter.wait()
+
+    def remove(self) -> None:
+        Log.info("Data: Move lists.json and lists to backup")
+        FileWriter.wait()
+        self.__backup_data()
+        os.remove(self.__manifest_path)
+        shutil.rmtree(self.__shards_dir)
+
+    # ------ PRIVATE METHODS ------ #
+
+    def _write_records(self, records: list[dict[str, Any]]) -> None:
+        list_uids: set[str] | None = self.__get_changed_lists(records)
+        if list_uids is None:
+            self._write_snapshot()
+            return
+        Log.debug(f"Data: Write {len(list_uids)} list files")
+        for list_uid in list_uids:
+            self.__write_shard(list_uid, self.get_tasks_as_dicts(list_uid))
+        self.__write_manifest()
+
+    def _write_snapshot(self) -> None:
+        Log.debug("Data: Write all list files")
+        shards: dict[str, list[TaskData]] = {lst.uid: [] for lst in self.task_lists}
+        for task in self.tasks:
+            shards.setdefault(task.list_uid, []).append(task)
+        for list_uid, tasks in shards.items():
+            self.__write_shard(list_uid, tasks)
+        file_names: set[str] = {self.__shard_file_name(uid) for uid in shards}
+
+        def __remove_cleaned() -> None:
+            # Remove files of lists that were cleaned
+            for file_name in os.listdir(self.__shards_dir):
+                if file_name.endswith(".json") and file_name not in file_names:
+                    Log.debug(f"Data: Remove list file '{file_name}'")
+                    os.remove(os.path.join(self.__shards_dir, file_name))
+
+        self.__write_manifest(__remove_cleaned)
+
+    def __backup_data(self) -> None:
+        Log.info("Data: Backup")
+        if os.path.exists(self.__manifest_path):
+            shutil.copyfile(self.__manifest_path, self.__manifest_path + ".old")
+        if os.path.exists(self.__shards_dir + ".old"):
+            shutil.rmtree(self.__shards_dir + ".old")
+        if os.path.exists(self.__shards_dir):
+            shutil.copytree(self.__shards_dir, self.__shards_dir + ".old")
+
+    def __get_changed_lists(self, records: list[dict[str, Any]]) -> set[str] | None:
+        """Lists which tasks were changed by records or None if it's unknown"""
+
+        list_uids: set[str] = set()
+        for record in records:
+            match record["op"]:
+                case "add_list" | "update_list_props" | "add_tag":
+                    # Only manifest is changed
+                    pass
+                case "delete_list" | "delete_task":
+                    list_uids.add(record["list_uid"])
+                case "add_task":
+                    list_uids.add(record["task"]["list_uid"])
+                case "update_props":
+                    list_uids.add(record["list_uid"])
+                    if "list_uid" in record["props"]:
+                        list_uids.add(
+                            record["values"][record["props"].index("list_uid")]
+                        )
+                case "move_task_to_list":
+                    list_uids.add(record["from_list_uid"])
+                    list_uids.add(record["to_list_uid"])
+                case _:
+                    return None
+        return list_uids
+
+    def __shard_file_name(self, list_uid: str) -> str:
+        return quote(list_uid, safe="") + ".json"
+
+    def __write_shard(self, list_uid: str, tasks: list[TaskData]) -> None:
+        shard: dict[str, Any] = {
+            "list_uid": list_uid,
+            "tasks": [t.to_dict() for t in tasks],
+        }
+        FileWriter.write(
+            os.path.join(self.__shards_dir, self.__shard_file_name(list_uid)),
+            lambda: json.dumps(shard, ensure_ascii=False),
+        )
+
+    def __write_manifest(self, callback: Callable | None = None) -> None:
+        """Queue manifest after list files, so it's written the last"""
+
+        self._seq += 1
+        manifest: dict[str, Any] = {
+            "seq": self._seq,
+            "lists": [lst.to_dict() for lst in self.task_lists],
+            "tags": [t.to_dict() for t in self.tags],
+            "counters": {lst.uid: self.get_status(lst.uid) for lst in self.task_lists},
+        }
+        FileWriter.write(
+            self.__manifest_path,
+            lambda: json.dumps(manifest, ensure_ascii=False),
+            callback,
+        )
+
+    def __read_manifest(self) -> None:
+        Log.debug("Data: Read lists.json")
+        with open(self.__manifest_path, "r") as f:
+            manifest: dict[str, Any] = json.load(f)
+        lists: list[TaskListData] = [
+            TaskListData.from_dict(lst) for lst in manifest["lists"]
+        ]
+        tags: list[TagsData] = [TagsData.from_dict(t) for t in manifest["tags"]]
+        counters: dict[str, tuple[int, int]] = {
+            uid: tuple(counter) for uid, counter in manifest["counters"].items()
+        }
+        self._seq = manifest["seq"]
+
+        def __load_tasks() -> ErrandsData:
+            return ErrandsData(tags=tags, lists=lists, tasks=self.__read_shards(lists))
+
+        self._load_lazy(lists, tags, counters, __load_tasks)
+
+    def __read_shards(self, lists: list[TaskListData]) -> list[TaskData]:
+        """Read tasks of all list files. Called in background thread."""
+
+        # Files of lists in order of lists and then files of unknown lists
+        order: dict[str, int] = {
+            self.__shard_file_name(lst.uid): idx for idx, lst in enumerate(lists)
+        }
+        file_names: list[str] = sorted(
+            (f for f in os.listdir(self.__shards_dir) if f.endswith(".json")),
+            key=lambda f: (order.get(f, len(order)), f),
+        )
+        tasks: list[TaskData] = []
+        for file_name in file_names:
+            path: str = os.path.join(self.__shards_dir, file_name)
+            try:
+                with open(path, "r") as f:
+                    shard: dict[str, Any] = json.load(f)
+                tasks.extend(TaskData.from_dict(t) for t in shard["tasks"])
+            except Exception as e:
+                Log.error(f"Data: Can't read list file '{file_name}'. {e}")
+                shutil.copyfile(path, path + ".old")
+        return tasks
+
+
+class AtomicFileWriter:
+    """
+    Long-lived thread that writes files atomically.
+    Data is written to temporary file, synced to disk and renamed over the target,
+    so crash in the middle of writing never leaves truncated file.
+    If file is queued again before previous data was written - only the latest
+    data is written.
+    """
+
+    def __init__(self) -> None:
+        # path -> (data or function returning data, callback after write, lock file)
+        self.__pending: dict[
+            str, tuple[str | Callable[[], str | None], Callable | None, str | None]
+        ] = {}
+        self.__writing: bool = False
+        self.__condition: Condition = Condition()
+        self.__thread: Thread | None = None
+
+        # Counters
+        self.writes: int = 0
+        self.superseded: int = 0
+        self.errors: int = 0
+        self.last_latency_ms: float = 0
+        self.max_latency_ms: float = 0
+
+    @property
+    def queue_depth(self) -> int:
+        with self.__condition:
+            return len(self.__pending) + int(self.__writing)
+
+    def write(
+        self,
+        path: str,
+        data: str | Callable[[], str | None],
+        callback: Callable | None = None,
+        lock_path: str | None = None,
+    ) -> None:
+        """
+        Queue file write. Data can be a function which is called in writer thread.
+        If it returns None - file is not written.
+        Callback is called in writer thread after file is written.
+        If lock_path is set - data is got and written while holding file_lock().
+        """
+
+        with self.__condition:
+            if self.__pending.pop(path, None):
+                self.superseded += 1
+            self.__pending[path] = (data, callback, lock_path)
+            if not self.__thread:
+                self.__thread = Thread(
+                    name="AtomicFileWriter", target=self.__run, daemon=True
+                )
+                self.__thread.start()
+            self.__condition.notify_all()
+
+    def wait(self) -> None:
+        """Block until all queued files are written"""
+
+        with self.__condition:
+            self.__condition.wait_for(lambda: not self.__pending and not self.__writing)
+
+    @staticmethod
+    def write_file(path: str, data: str) -> None:
+        """Write file atomically in the current thread"""
+
+        tmp_path: str = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        # Make rename itself durable
+        dir_fd: int = os.open(os.path.dirname(path), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def __run(self) -> None:
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__pending)
+                path: str = next(iter(self.__pending))
+                data, callback, lock_path = self.__pending.pop(path)
+                self.__writing = True
+
+            start: float = time.monotonic()
+            try:
+                with file_lock(lock_path) if lock_path else nullcontext():
+                    content: str | None = data() if callable(data) else data
+                    if content is not None:
+                        self.write_file(path, content)
+                        self.writes += 1
+                        if callback:
+                            callback()
+            except Exception as e:
+                self.errors += 1
+                Log.error(f"Data: Can't write '{path}'. {e}.")
+            latency: float = (time.monotonic() - start) * 1000
+            self.last_latency_ms = latency
+            self.max_latency_ms = max(self.max_latency_ms, latency)
+
+            with self.__condition:
+                self.__writing = False
+                depth: int = len(self.__pending)
+                self.__condition.notify_all()
+            Log.debug(
+                f"Data: Write '{os.path.basename(path)}' in {latency:.1f} ms. "
+                f"Queue depth: {depth}"
+            )
+
+
+class TasksArchive:
+    """
+    Tasks moved out of user data. Stored as JSON lines, so new tasks are appended
+    without reading the file. Later lines replace earlier ones with the same task.
+    File is read only when archived tasks are requested.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        # (list_uid, uid) -> task
+        self.__tasks: dict[tuple[str, str], TaskData] | None = None
+        self.__lock: Lock = Lock()
+
+    def append(self, tasks: list[dict[str, Any]]) -> None:
+        with self.__lock:
+            with open(self.path, "a") as f:
+                f.write(
+                    "".join(json.dumps(t, ensure_ascii=False) + "\n" for t in tasks)
+                )
+                f.flush()
+                os.fsync(f.fileno())
+            if self.__tasks is not None:
+                for task in tasks:
+                    self.__tasks[(task["list_uid"], task["uid"])] = TaskData.from_dict(
+                        task
+                    )
+
+    def get_tasks(self) -> list[TaskData]:
+        with self.__lock:
+            self.__read()
+            return list(self.__tasks.values())
+
+    def remove(self, keys: list[tuple[str, str]]) -> None:
+        """Remove tasks and rewrite the file"""
+
+        with self.__lock:
+            self.__read()
+            for key in keys:
+                self.__tasks.pop(key, None)
+            FileWriter.write_file(
+                self.path,
+                "".join(
+                    json.dumps(t.to_dict(), ensure_ascii=False) + "\n"
+                    for t in self.__tasks.values()
+                ),
+            )
+
+    def __read(self) -> None:
+        if self.__tasks is not None:
+            return
+        self.__tasks = {}
+        if not os.path.exists(self.path):
+            return
+        start: float = time.monotonic()
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    task: TaskData = TaskData.from_dict(json.loads(line))
+                except Exception as e:
+                    # Line can be cut if app was closed while appending
+                    Log.error(f"Data: Skip broken line in archive. {e}")
+                    continue
+                self.__tasks[(task.list_uid, task.uid)] = task
+        Log.info(
+            f"Data: Read {len(self.__tasks)} archived tasks in "
+            f"{(time.monotonic() - start) * 1000:.1f} ms"
+        )
+
+
+class DataBackups:
+    """
+    Compressed snapshots of all data in "backups" directory.
+    Snapshots are stored by hash of their content, so unchanged data is stored
+    once. index.json lists backups as (name, time, hash), newest first.
+    Name is time followed by the start of the hash, so backups made in the same
+    second have different names unless their data is the same.
+    Old backups are removed, keeping the newest backup, and the newest backup
+    of the last hours and days.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self.__index_path: str = os.path.join(path, "index.json")
+        self.__lock: Lock = Lock()
+
+    def add(self, data: ErrandsData, hourly: int, daily: int) -> None:
+        """Store snapshot and remove old ones. Called in background thread."""
+
+        content: bytes = json.dumps(
+            {
+                "lists": [lst.to_dict() for lst in data.lists],
+                "tags": [t.to_dict() for t in data.tags],
+                "tasks": [t.to_dict() for t in data.tasks],
+            },
+            ensure_ascii=False,
+        ).encode()
+        content_hash: str = hashlib.sha256(content).hexdigest()
+
+        with self.__lock:
+            os.makedirs(self.path, exist_ok=True)
+            blob_path: str = self.__blob_path(content_hash)
+            if not os.path.exists(blob_path):
+                # Fixed mtime makes the same data compress to the same file
+                self.__write_bytes(blob_path, gzip.compress(content, mtime=0))
+            else:
+                Log.debug("Data: Data not changed since the last backup")
+
+            time: str = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+            name: str = f"{time}-{content_hash[:8]}"
+            index: list[dict[str, str]] = [
+                b for b in self.__read_index() if self.__name(b) != name
+            ]
+            index.insert(0, {"name": name, "time": time, "hash": content_hash})
+            index = self.__rotate(index, hourly, daily)
+            FileWriter.write_file(self.__index_path, json.dumps(index))
+
+            # Remove snapshots which are not used by any backup
+            hashes: set[str] = {b["hash"] for b in index}
+            for file_name in os.listdir(self.path):
+                if file_name.endswith(".json.gz") and (
+                    file_name.removesuffix(".json.gz") not in hashes
+                ):
+                    os.remove(os.path.join(self.path, file_name))
+
+        Log.info(f"Data: Backup created. Backups: {len(index)}")
+
+    def get_backups(self) -> list[str]:
+        """Names of backups, newest first"""
+
+        with self.__lock:
+            return [self.__name(b) for b in self.__read_index()]
+
+    def read(self, name: str) -> ErrandsData | None:
+        """Read snapshot of backup by name. Called in background thread."""
+
+        with self.__lock:
+            content_hash: str | None = next(
+                (b["hash"] for b in self.__read_index() if self.__name(b) == name),
+                None,
+            )
+        if not content_hash:
+            return None
+        try:
+            with gzip.open(self.__blob_path(content_hash), "rb") as f:
+                data: dict[str, Any] = json.load(f)
+            return ErrandsData(
+                lists=[TaskListData.from_dict(lst) for lst in data["lists"]],
+                tags=[TagsData.from_dict(t) for t in data["tags"]],
+                tasks=[TaskData.from_dict(t) for t in data["tasks"]],
+            )
+        except Exception as e:
+            Log.error(f"Data: Can't read backup '{name}'. {e}")
+            return None
+
+    def __name(self, backup: dict[str, str]) -> str:
+        # Backups made before names were added are named by time
+        return backup.get("name", backup["time"])
+
+    def __blob_path(self, content_hash: str) -> str:
+        return os.path.join(self.path, content_hash + ".json.gz")
+
+    def __read_index(self) -> list[dict[str, str]]:
+        if not os.path.exists(self.__index_path):
+            return []
+        try:
+            with open(self.__index_path, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            Log.error(f"Data: Can't read backups index. {e}")
+            return []
+
+    def __rotate(
+        self, index: list[dict[str, str]], hourly: int, daily: int
+    ) -> list[dict[str, str]]:
+        """Keep the newest backup and the newest backup of the last hours and days"""
+
+        if not index:
+            return index
+        hours: dict[str, dict[str, str]] = {}
+        days: dict[str, dict[str, str]] = {}
+        for backup in index:
+            # Index is sorted from newest to oldest, so first backup of period is kept
+            hour: str = backup["time"][:11]
+            day: str = backup["time"][:8]
+            if hour not in hours and len(hours) < hourly:
+                hours[hour] = backup
+            if day not in days and len(days) < daily:
+                days[day] = backup
+        kept: list[dict[str, str]] = [index[0], *hours.values(), *days.values()]
+        return [b for b in index if any(b is k for k in kept)]
+
+    def __write_bytes(self, path: str, data: bytes) -> None:
+        tmp_path: str = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+
+# Single writer for all data files
+FileWriter: AtomicFileWriter = AtomicFileWriter()
+
+
+class UserDataHandle:
+    """
+    Handle for UserData. For easily changing serialization methods.
+    Storage is chosen by "data-storage" setting and data is migrated
+    from another storage if selected one has no data yet.
+    """
+
+    # Storages in order of "data-storage" setting values
+    STORAGES: tuple[type[UserDataBase]] = (
+        UserDataJSON,
+        UserDataSQLite,
+        UserDataSharded,
+    )
+
+    def __init__(self) -> None:
+        self.storage: UserDataBase = UserDataJSON()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.storage, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        # Attributes set on the handle would hide ones of the storage
+        if name == "storage":
+            super().__setattr__(name, value)
+        else:
+            setattr(self.storage, name, value)
+
+    def init(self) -> None:
+        start: float = time.monotonic()
+        storage_idx: int = GSettings.get("data-storage")
+        if not 0 <= storage_idx < len(self.STORAGES):
+            Log.error(f"Data: Unknown storage '{storage_idx}'. Using JSON")
+            storage_idx = 0
+        self.storage = self.STORAGES[storage_idx]()
+
+        old_storage: UserDataBase | None = None
+        if not self.storage.exists():
+            for storage in self.STORAGES:
+                if not isinstance(self.storage, storage) and storage().exists():
+                    old_storage = storage()
+                    break
+
+        self.storage.init()
+        if old_storage:
+            self.__migrate(old_storage)
+
+        Log.info(
+            f"Data: Initialize {type(self.storage).__name__} in "
+            f"{(time.monotonic() - start) * 1000:.1f} ms"
+        )
+
+    def __migrate(self, old_storage: UserDataBase) -> None:
+        Log.info(
+            f"Data: Migrate data from {type(old_storage).__name__} "
+            f"to {type(self.storage).__name__}"
+        )
+        old_storage.init()
+        old_storage.flush()
+        self.storage.data = old_storage.data
+        self.storage.flush()
+        # New files must be on disk before old ones are removed
+        FileWriter.wait()
+        old_storage.remove()
 
 
-# Handle for UserData. For easily changing serialization methods.
-UserData = UserDataJSON()
+UserData = UserDataHandle()
@@ -24,16 +24,10 @@ class ErrandsNotificationsDaemon:
     def due_tasks(self) -> list[TaskData]:
         """Get due tasks that haven't been notified yet"""
 
-        now: datetime = datetime.now()
         tasks: list[TaskData] = [
             t
-            for t in UserData.tasks
-            if t.due_date
-            and datetime.fromisoformat(t.due_date) < now
-            and not t.deleted
-            and not t.completed
-            and not t.trash
-            and not t.notified
+            for t in UserData.get_tasks_due_before(datetime.now().timestamp())
+            if not t.deleted and not t.completed and not t.trash and not t.notified
         ]
 
         return tasks
@@ -1,23 +1,78 @@
 # Copyright 2023-2024 Vlad Krupinskii <mrvladus@yandex.ru>
 # SPDX-License-Identifier: MIT
 
-from copy import deepcopy
 import datetime
 import time
-from dataclasses import asdict, dataclass, field
-from typing import Any
-
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
+from threading import BoundedSemaphore, Lock
+from typing import Any, Callable
+from urllib.parse import quote, urlparse
+from uuid import uuid4
+
+import icalendar
+import requests
 import urllib3
 import caldav
-from caldav import Calendar, DAVClient, Principal, Todo
+from caldav import Calendar, CalendarObjectResource, DAVClient, Principal, Todo
 from caldav.elements import dav
+from caldav.elements.base import ValuedBaseElement
+from caldav.davclient import DAVResponse
+from caldav.lib import error
+from lxml import etree
+from requests.adapters import HTTPAdapter
 
-from errands.lib.data import TaskData, TaskListData, UserData
+from errands.lib.data import TaskData, TaskListData, UserData, format_order_key
 from errands.lib.gsettings import GSettings
 from errands.lib.logging import Log
+from errands.lib.sync.sync_state import SyncState, TaskSyncState, get_task_hash
 from errands.lib.utils import idle_add
 from errands.state import State
 
+# Errors of requests to the server and of reading its responses
+SYNC_ERRORS: tuple[type[Exception], ...] = (
+    error.DAVError,
+    requests.RequestException,
+    etree.LxmlError,
+    ValueError,
+)
+
+
+class GetCTag(ValuedBaseElement):
+    """Calendar CTag. Changed by server on every change in calendar."""
+
+    # Namespace of calendarserver.org is not in caldav namespaces
+    tag: str = "{http://calendarserver.org/ns/}getctag"
+
+
+@dataclass
+class RemoteChanges:
+    """Tasks changed on remote since the last sync"""
+
+    tasks: list[TaskData]
+    # Task uid -> state of all tasks on remote
+    states: dict[str, TaskSyncState]
+    token: str = ""
+    ctag: str = ""
+
+
+@dataclass
+class CalendarChanges:
+    """
+    Changes of local tasks found by sync of one calendar.
+    Applied to local data after all calendars are synced.
+    """
+
+    calendar: Calendar
+    states: dict[str, TaskSyncState]
+    token: str = ""
+    ctag: str = ""
+    tasks_to_create: list[TaskData] = field(default_factory=lambda: [])
+    tasks_to_delete: list[TaskData] = field(default_factory=lambda: [])
+    # (local task, remote task)
+    tasks_to_update: list[tuple[TaskData, TaskData]] = field(default_factory=lambda: [])
+    tasks_to_mark_synced: list[TaskData] = field(default_factory=lambda: [])
+
 
 @dataclass
 class UpdateUIArgs:
@@ -34,17 +89,80 @@ class UpdateUIArgs:
     lists_to_update_name: list[str] = field(default_factory=lambda: [])
     lists_to_purge_uids: list[str] = field(default_factory=lambda: [])
 
+    def merge(self, other: "UpdateUIArgs") -> None:
+        """Add changes made by another sync job"""
+
+        for f in fields(self):
+            value: Any = getattr(other, f.name)
+            if isinstance(value, bool):
+                setattr(self, f.name, getattr(self, f.name) or value)
+            else:
+                items: list[Any] = getattr(self, f.name)
+                items.extend(item for item in value if item not in items)
+
+
+class SerialAuthDAVClient(DAVClient):
+    """
+    DAVClient that sends requests one by one until authentication is chosen.
+    DAVClient.request sets auth type on the client after the first 401 response,
+    so requests sent at once from sync threads would change it at the same time.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.__auth_lock: Lock = Lock()
+
+    def request(self, *args, **kwargs) -> DAVResponse:
+        if self.auth:
+            return super().request(*args, **kwargs)
+        with self.__auth_lock:
+            return super().request(*args, **kwargs)
+
 
 class SyncProviderCalDAV:
     can_sync: bool = False
     calendars: list[Calendar] = None
     err: Exception = None
+    sync_state: SyncState = None
+    # Client is kept open between syncs to reuse connections to the server
+    client: DAVClient = None
+    # Diagnostics. Times connection was opened again after it failed
+    # and failed connections.
+    reconnects: int = 0
+    connection_errors: int = 0
+
+    # Calendars synced at once
+    MAX_WORKERS: int = 8
+    # Calendars of the same server synced at once
+    MAX_REQUESTS_PER_SERVER: int = 4
+    # VTODO properties written from TaskData. Other properties are kept.
+    TODO_PROPS: tuple[str] = (
+        "uid",
+        "summary",
+        "description",
+        "due",
+        "dtstart",
+        "dtstamp",
+        "last-modified",
+        "percent-complete",
+        "priority",
+        "categories",
+        "related-to",
+        "status",
+        "completed",
+        "x-errands-color",
+        "x-errands-toolbar-shown",
+        "x-errands-expanded",
+        "x-apple-sort-order",
+    )
 
     def __init__(self, testing: bool, name: str = "CalDAV") -> bool:
         Log.info(f"Sync: Initialize '{name}' sync provider")
 
         self.name: str = name
         self.testing: bool = testing  # Only for connection test
+        # Server -> requests to it that can be sent at once
+        self.__server_limits: dict[str, BoundedSemaphore] = {}
 
         if not self._check_credentials():
             return
@@ -82,52 +200,280 @@ class SyncProviderCalDAV:
 
         urllib3.disable_warnings()
 
-        with DAVClient(
+        if not self.client:
+            self.client = self.__create_client()
+
+        try:
+            self.principal: Principal = self.client.principal()
+            Log.info(f"Sync: Connected to {self.name} server at '{self.url}'")
+            self.can_sync = True
+            self.calendars = [
+                cal
+                for cal in self.principal.calendars()
+                if "VTODO" in cal.get_supported_components()
+            ]
+        except Exception as e:
+            # Open new connection on the next attempt
+            self.close()
+            self.can_sync = False
+            self.connection_errors += 1
+            time.sleep(2)
+            self.err = e
+
+            Log.error(f"Sync: Can't connect to {self.name} server at '{self.url}'. {e}")
+
+            if not self.testing:
+                State.main_window.add_toast(
+                    _("Can't connect to CalDAV server at:") + " " + self.url
+                )
+
+    def __create_client(self) -> DAVClient:
+        client: DAVClient = SerialAuthDAVClient(
             url=self.url,
             username=self.username,
             password=self.password,
             ssl_verify_cert=False,
-        ) as client:
+            timeout=(
+                GSettings.get("sync-connect-timeout"),
+                GSettings.get("sync-read-timeout"),
+            ),
+            headers={"Accept-Encoding": "gzip, deflate"},
+        )
+        # Keep-alive connections for every calendar synced at once
+        adapter: HTTPAdapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.MAX_REQUESTS_PER_SERVER
+        )
+        client.session.mount("http://", adapter)
+        client.session.mount("https://", adapter)
+        return client
+
+    def __account_changed(self) -> bool:
+        """Check if url or credentials were changed after client was created"""
+
+        return (
+            GSettings.get("sync-url") != self.url
+            or GSettings.get("sync-username") != self.username
+            or GSettings.get_secret(self.name) != self.password
+        )
+
+    def __reconnect(self) -> bool:
+        """Open new connection after server closed it or network was changed"""
+
+        self.reconnects += 1
+        Log.info(
+            f"Sync: Reconnect to {self.name} server. Reconnects: {self.reconnects}"
+        )
+        self.close()
+        self._connect()
+        return self.can_sync
+
+    def close(self) -> None:
+        """Close connections to the server"""
+
+        if self.client:
             try:
-                self.principal: Principal = client.principal()
-                Log.info(f"Sync: Connected to {self.name} server at '{self.url}'")
-                self.can_sync = True
-                self.calendars = [
-                    cal
-                    for cal in self.principal.calendars()
-                    if "VTODO" in cal.get_supported_components()
-                ]
+                self.client.close()
             except Exception as e:
-                time.sleep(2)
-                self.err = e
+                Log.debug(f"Sync: Can't close connection. {e}")
+            self.client = None
 
-                Log.error(
-                    f"Sync: Can't connect to {self.name} server at '{self.url}'. {e}"
-                )
+    def __to_task(self, todo: CalendarObjectResource, calendar: Calendar) -> TaskData:
+        task: TaskData = TaskData.from_ical(todo.data, calendar.id)
+        task.text = str(todo.icalendar_component.get("summary", ""))
+        task.notes = str(todo.icalendar_component.get("description", ""))
+        return task
 
-                if not self.testing:
-                    State.main_window.add_toast(
-                        _("Can't connect to CalDAV server at:") + " " + self.url
-                    )
+    def __to_ical_date(self, value: str) -> datetime.date | datetime.datetime:
+        if "T" in value:
+            return datetime.datetime.fromisoformat(value)
+        return datetime.date.fromisoformat(value)
 
-    def __get_tasks(self, calendar: Calendar) -> list[TaskData]:
+    def __to_ical(self, task: TaskData, base: str = "") -> str:
         """
-        Get todos from calendar and convert them to TaskData list
+        Build iCal with VTODO of task.
+        If iCal received from remote is given, only properties of VTODO
+        that Errands uses are replaced in it and the rest are kept.
         """
 
+        ical: icalendar.Calendar | None = None
+        todo: icalendar.Todo | None = None
+        if base:
+            try:
+                ical = icalendar.Calendar.from_ical(base)
+                todo = next(iter(ical.walk("VTODO")), None)
+            except ValueError as e:
+                Log.debug(f"Sync: Can't parse remote task '{task.uid}'. {e}")
+        if todo is None:
+            todo = icalendar.Todo()
+            ical = icalendar.Calendar()
+            ical.add("prodid", "-//Errands//")
+            ical.add("version", "2.0")
+            ical.add_component(todo)
+        for prop in self.TODO_PROPS:
+            todo.pop(prop, None)
+
+        todo.add("uid", task.uid)
+        todo.add("summary", task.text)
+        todo.add("description", task.notes)
+        if task.due_date:
+            todo.add("due", self.__to_ical_date(task.due_date))
+        if task.start_date:
+            todo.add("dtstart", self.__to_ical_date(task.start_date))
+        if task.created_at:
+            todo.add("dtstamp", self.__to_ical_date(task.created_at))
+        if task.changed_at:
+            todo.add("last-modified", self.__to_ical_date(task.changed_at))
+        todo.add("percent-complete", int(task.percent_complete))
+        todo.add("priority", task.priority)
+        if task.tags:
+            todo.add("categories", list(task.tags))
+        if task.parent:
+            todo.add("related-to", task.parent)
+        if task.completed:
+            todo.add("status", "COMPLETED")
+            todo.add(
+                "completed",
+                (
+                    self.__to_ical_date(task.changed_at)
+                    if "T" in task.changed_at
+                    else datetime.datetime.now()
+                ),
+            )
+        else:
+            todo.add("status", "NEEDS-ACTION")
+        todo.add("x-errands-color", task.color)
+        todo.add("x-errands-toolbar-shown", int(task.toolbar_shown))
+        todo.add("x-errands-expanded", int(task.expanded))
+        todo.add("x-apple-sort-order", format_order_key(task.sort_order))
+
+        return ical.to_ical().decode()
+
+    def __get_ctag(self, calendar: Calendar) -> str:
         try:
+            return calendar.get_property(GetCTag()) or ""
+        except SYNC_ERRORS as e:
+            Log.debug(f"Sync: Can't get CTag of list '{calendar.id}'. {e}")
+            return ""
+
+    def __get_sync_token(self, calendar: Calendar) -> str:
+        """Get current sync token or empty string if server doesn't support it"""
+
+        try:
+            token = calendar.objects_by_sync_token(load_objects=False).sync_token
+        except (error.ReportError, error.NotFoundError, IndexError) as e:
+            Log.debug(f"Sync: List '{calendar.id}' doesn't support sync tokens. {e}")
+            return ""
+        return token if isinstance(token, str) else ""
+
+    def __get_changes(
+        self, calendar: Calendar, local_tasks: list[TaskData]
+    ) -> RemoteChanges | None:
+        """
+        Get tasks changed on remote since the last sync.
+        If server supports sync tokens (RFC 6578) only changed tasks are downloaded.
+        Otherwise calendar is downloaded only if its CTag is changed.
+        Returns None if tasks can't be downloaded.
+        """
+
+        states: dict[str, TaskSyncState] = self.sync_state.get_tasks(calendar.id)
+        token: str = self.sync_state.get_token(calendar.id)
+        ctag: str = self.sync_state.get_ctag(calendar.id)
+
+        # Local tasks are lost. Download them again.
+        if states and not local_tasks:
+            token = ctag = ""
+
+        if token:
+            try:
+                return self.__get_changes_by_token(calendar, token, states)
+            except (error.ReportError, error.NotFoundError, IndexError) as e:
+                # Token is expired or not supported anymore
+                Log.debug(f"Sync: Can't sync list '{calendar.id}' by token. {e}")
+            except SYNC_ERRORS as e:
+                Log.error(f"Sync: Can't get changed tasks from remote. {e}")
+                return None
+        elif ctag:
+            # Server doesn't support sync tokens
+            new_ctag: str = self.__get_ctag(calendar)
+            if new_ctag == ctag:
+                Log.debug(f"Sync: List '{calendar.id}' is not changed")
+                return RemoteChanges(tasks=[], states=states, ctag=ctag)
+            return self.__get_all_tasks(calendar, new_ctag)
+
+        return self.__get_all_tasks(calendar)
+
+    def __get_changes_by_token(
+        self, calendar: Calendar, token: str, states: dict[str, TaskSyncState]
+    ) -> RemoteChanges:
+        """Download only tasks changed or deleted since sync token was received"""
+
+        objects = calendar.objects_by_sync_token(sync_token=token, load_objects=False)
+        uids: dict[str, str] = {state.href: uid for uid, state in states.items()}
+        tasks: list[TaskData] = []
+        for obj in objects:
+            href: str = str(obj.url.canonical())
+            uid: str | None = uids.get(href)
+            etag: str = obj.props.get(dav.GetEtag.tag, "")
+            # Task was written by this client on the last sync
+            if uid and etag and states[uid].etag == etag:
+                continue
+            try:
+                obj.load()
+            except error.NotFoundError:
+                # Deleted on remote
+                if uid:
+                    states.pop(uid, None)
+                continue
+            if "BEGIN:VTODO" not in obj.data:
+                continue
+            task: TaskData = self.__to_task(obj, calendar)
+            states[task.uid] = TaskSyncState(
+                href=href,
+                etag=obj.props.get(dav.GetEtag.tag, etag),
+                hash=get_task_hash(task),
+                ical=obj.data,
+            )
+            tasks.append(task)
+
+        Log.debug(f"Sync: Got {len(tasks)} changed tasks for list '{calendar.id}'")
+        return RemoteChanges(tasks=tasks, states=states, token=objects.sync_token or "")
+
+    def __get_all_tasks(
+        self, calendar: Calendar, ctag: str = ""
+    ) -> RemoteChanges | None:
+        """
+        Get all todos from calendar and convert them to TaskData list.
+        Sync token or CTag is received before, so changes made while tasks
+        are downloaded are downloaded again on the next sync.
+        """
+
+        token: str = ""
+        try:
+            if not ctag:
+                token = self.__get_sync_token(calendar)
+                if not token:
+                    ctag = self.__get_ctag(calendar)
+
             Log.debug(f"Sync: Getting tasks for list '{calendar.id}'")
-            todos: list[Todo] = calendar.todos(include_completed=True)
+            # ETags are not in the response unless they are requested
+            todos: list[Todo] = calendar.search(
+                todo=True, include_completed=True, props=[dav.GetEtag()]
+            )
             tasks: list[TaskData] = []
+            states: dict[str, TaskSyncState] = {}
             for todo in todos:
-                task: TaskData = TaskData.from_ical(todo.data, calendar.id)
-                task.text = str(todo.icalendar_component.get("summary", ""))
-                task.notes = str(todo.icalendar_component.get("description", ""))
+                task: TaskData = self.__to_task(todo, calendar)
+                states[task.uid] = TaskSyncState(
+                    href=str(todo.url.canonical()),
+                    etag=todo.props.get(dav.GetEtag.tag, ""),
+                    hash=get_task_hash(task),
+                    ical=todo.data,
+                )
                 tasks.append(task)
-            return tasks
-        except BaseException as e:
+            return RemoteChanges(tasks=tasks, states=states, token=token, ctag=ctag)
+        except SYNC_ERRORS as e:
             Log.error(f"Sync: Can't get tasks from remote. {e}")
-            return []
+            return None
 
     def __update_calendars(self) -> bool:
         try:
@@ -138,6 +484,7 @@ class SyncProviderCalDAV:
             ]
             return True
         except Exception as e:
+            self.connection_errors += 1
             Log.error(f"Sync: Can't get caldendars from remote. {e}")
             return False
 
@@ -208,9 +555,26 @@ class SyncProviderCalDAV:
     def sync(self) -> None:
         Log.info("Sync: Sync tasks with remote")
 
+        if self.__account_changed():
+            Log.info("Sync: Account settings changed. Connect again.")
+            self.close()
+            self.sync_state = None
+            if not self._check_credentials():
+                self.can_sync = False
+                return
+            self._check_url()
+            self._connect()
+            if not self.can_sync:
+                return
+
+        # Calendars are requested before syncing them at once,
+        # so authentication is done by one request
         if not self.__update_calendars():
-            return
+            if not self.__reconnect() or not self.__update_calendars():
+                return
 
+        if not self.sync_state:
+            self.sync_state = SyncState(self.url, self.username)
         self.update_ui_args: UpdateUIArgs = UpdateUIArgs()
         self.__sync_lists()
 
@@ -220,31 +584,70 @@ class SyncProviderCalDAV:
         self.__sync_tasks()
 
         self.__finish_sync()
+        Log.debug(
+            f"Sync: Reconnects: {self.reconnects}. "
+            f"Connection errors: {self.connection_errors}"
+        )
+
+    def __run_parallel(self, func: Callable, items: list[Any], *args) -> list[Any]:
+        """
+        Call func for every item in thread pool and return results in the order
+        of items, so result doesn't depend on which request ends first.
+        Result is None if item can't be synced.
+        Only MAX_REQUESTS_PER_SERVER items of the same server run at once.
+        """
+
+        def __run(item: Any, server: str) -> Any:
+            with self.__server_limits[server]:
+                try:
+                    return func(item, *args)
+                except SYNC_ERRORS as e:
+                    uid: str = getattr(item, "id", None) or item.uid
+                    Log.error(f"Sync: Can't sync '{uid}'. {e}")
+                    return None
+
+        servers: list[str] = []
+        for item in items:
+            server: str = urlparse(str(getattr(item, "url", self.url))).netloc
+            if server not in self.__server_limits:
+                self.__server_limits[server] = BoundedSemaphore(
+                    self.MAX_REQUESTS_PER_SERVER
+                )
+            servers.append(server)
+
+        with ThreadPoolExecutor(
+            max_workers=self.MAX_WORKERS, thread_name_prefix="Sync"
+        ) as pool:
+            return list(pool.map(__run, items, servers))
 
     # ----- SYNC LISTS FUNCTIONS ----- #
 
     def __sync_lists(self):
         self.__add_local_lists()
+        for args in self.__run_parallel(
+            self.__sync_list, UserData.get_lists_as_dicts()
+        ):
+            if args:
+                self.update_ui_args.merge(args)
 
-        remote_lists_uids = [c.id for c in self.calendars]
-
-        for list in UserData.get_lists_as_dicts():
-            for cal in self.calendars:
-                if cal.id == list.uid:
-                    if list.synced:
-                        self.__update_local_list(cal, list)
-                    else:
-                        self.__update_remote_list(cal, list)
-            if (
-                list.uid not in remote_lists_uids
-                and not list.synced
-                and not list.deleted
-            ):
-                self.__create_remote_list(list)
-            elif list.uid not in remote_lists_uids and list.synced and not list.deleted:
-                self.__delete_local_list(list)
-            elif list.uid in remote_lists_uids and list.deleted and list.synced:
-                self.__delete_remote_list(list)
+    def __sync_list(self, list: TaskListData) -> UpdateUIArgs:
+        args: UpdateUIArgs = UpdateUIArgs()
+        remote_lists_uids: list[str] = [c.id for c in self.calendars]
+
+        for cal in self.calendars:
+            if cal.id == list.uid:
+                if list.synced:
+                    self.__update_local_list(cal, list, args)
+                else:
+                    self.__update_remote_list(cal, list)
+        if list.uid not in remote_lists_uids and not list.synced and not list.deleted:
+            self.__create_remote_list(list)
+        elif list.uid not in remote_lists_uids and list.synced and not list.deleted:
+            self.__delete_local_list(list, args)
+        elif list.uid in remote_lists_uids and list.deleted and list.synced:
+            self.__delete_remote_list(list)
+
+        return args
 
     def __add_local_lists(self) -> None:
         user_lists_uids = [lst.uid for lst in UserData.get_lists_as_dicts()]
@@ -254,15 +657,16 @@ class SyncProviderCalDAV:
                 new_list: TaskListData = UserData.add_list(
                     name=calendar.name, uuid=calendar.id, synced=True
                 )
+                self.sync_state.forget(calendar.id)
                 self.update_ui_args.lists_to_add.append(new_list)
 
-    def __delete_local_list(self, list: TaskListData) -> None:
+    def __delete_local_list(self, list: TaskListData, args: UpdateUIArgs) -> None:
         Log.debug(f"Sync: Delete local list deleted on remote '{list.uid}'")
 
         UserData.delete_list(list.uid)
-        self.update_ui_args.lists_to_purge_uids.append(list.uid)
-        self.update_ui_args.update_trash = True
-        self.update_ui_args.update_tags = True
+        args.lists_to_purge_uids.append(list.uid)
+        args.update_trash = True
+        args.update_tags = True
 
     def __delete_remote_list(self, list: TaskListData) -> None:
         for cal in self.calendars:
@@ -271,7 +675,7 @@ class SyncProviderCalDAV:
                 try:
                     cal.delete()
                     UserData.delete_list(cal.id)
-                except BaseException:
+                except SYNC_ERRORS:
                     Log.debug(f"Sync: Can't delete list on remote '{cal.id}'")
                 return
 
@@ -286,14 +690,16 @@ class SyncProviderCalDAV:
             # Set color
             try:
                 cal.set_properties([caldav.elements.ical.CalendarColor(list.color)])
-            except BaseException as e:
+            except SYNC_ERRORS as e:
                 Log.error(f"Sync: Can't set calendar color for list '{list.uid}'. {e}")
 
             UserData.update_list_prop(list.uid, "synced", True)
-        except BaseException as e:
+        except SYNC_ERRORS as e:
             Log.error(f"Sync: Can't create remote list '{list.uid}'. {e}")
 
-    def __update_local_list(self, cal: Calendar, list: TaskListData):
+    def __update_local_list(
+        self, cal: Calendar, list: TaskListData, args: UpdateUIArgs
+    ) -> None:
         color: str | None = None
         color = cal.get_property(caldav.elements.ical.CalendarColor())
         if not color:
@@ -304,8 +710,8 @@ class SyncProviderCalDAV:
             UserData.update_list_props(
                 cal.id, ["name", "color", "synced"], [cal.name, color, True]
             )
-            self.update_ui_args.lists_to_update_name.append(cal.id)
-            self.update_ui_args.update_trash = True
+            args.lists_to_update_name.append(cal.id)
+            args.update_trash = True
 
     def __update_remote_list(self, cal: Calendar, list: TaskListData):
         color: str | None = None
@@ -323,53 +729,132 @@ class SyncProviderCalDAV:
                     ]
                 )
                 UserData.update_list_props(cal.id, ["synced"], [True])
-            except BaseException as e:
+            except SYNC_ERRORS as e:
                 Log.error(f"Sync: Can't update remote list '{list.uid}'. {e}")
 
     # ----- SYNC TASKS FUNCTIONS ----- #
 
     def __sync_tasks(self):
-        for calendar in self.calendars:
-            # Get tasks
-            local_tasks: list[TaskData] = UserData.get_tasks_as_dicts(calendar.id)
-            remote_tasks: list[TaskData] = self.__get_tasks(calendar)
-
-            # Create tasks
-            local_ids: list[str] = [t.uid for t in local_tasks]
-            deleted_uids: list[str] = [
-                t.uid for t in UserData.get_tasks_as_dicts() if t.deleted
-            ]
-            for task in remote_tasks:
-                if task.uid not in local_ids and task.uid not in deleted_uids:
-                    self.__create_local_task(calendar, task)
-
-            remote_ids: list[str] = [task.uid for task in remote_tasks]
-            for task in local_tasks:
-                if task.uid not in remote_ids and task.synced:
-                    self.__delete_local_task(calendar, task)
-                elif task.uid in remote_ids and task.deleted:
-                    self.__delete_remote_task(calendar, task)
-                elif task.uid not in remote_ids and not task.synced:
-                    self.__create_remote_task(calendar, task)
-                elif task.uid in remote_ids and not task.synced:
-                    self.__update_remote_task(calendar, task)
-                elif task.uid in remote_ids and task.synced:
-                    self.__update_local_task(calendar, task, remote_tasks)
+        # Compare remote tasks with copy of local ones, so UI can change data
+        # while remote tasks are downloaded
+        snapshot: list[TaskData] = UserData.snapshot().tasks
+        local_tasks: dict[str, list[TaskData]] = {}
+        for task in snapshot:
+            local_tasks.setdefault(task.list_uid, []).append(task)
+        deleted_uids: set[str] = {t.uid for t in snapshot if t.deleted}
+        # Old completed tasks are in archive
+        archive_cutoff: str = UserData.get_archive_cutoff()
+
+        results: list[CalendarChanges | None] = self.__run_parallel(
+            self.__sync_calendar,
+            self.calendars,
+            local_tasks,
+            deleted_uids,
+            archive_cutoff,
+        )
+
+        # Local data is changed at once after all requests are done,
+        # so UI doesn't wait for the server
+        with UserData.transaction():
+            for changes in results:
+                if changes:
+                    self.__apply_changes(changes)
+
+        self.sync_state.forget_missing([c.id for c in self.calendars])
+        self.sync_state.save()
+
+    def __sync_calendar(
+        self,
+        calendar: Calendar,
+        snapshot: dict[str, list[TaskData]],
+        deleted_uids: set[str],
+        archive_cutoff: str,
+    ) -> CalendarChanges | None:
+        """
+        Send local changes of one calendar to remote and return changes of local
+        tasks. Called in thread pool, so local data is not changed here.
+        """
+
+        # Get tasks
+        local_tasks: list[TaskData] = snapshot.get(calendar.id, [])
+        remote: RemoteChanges | None = self.__get_changes(calendar, local_tasks)
+        if not remote:
+            return None
+        remote_tasks: dict[str, TaskData] = {t.uid: t for t in remote.tasks}
+        states: dict[str, TaskSyncState] = remote.states
+        changes: CalendarChanges = CalendarChanges(
+            calendar=calendar, states=states, token=remote.token, ctag=remote.ctag
+        )
+
+        # Create tasks
+        local_ids: set[str] = {t.uid for t in local_tasks}
+        for task in remote.tasks:
+            if task.uid in local_ids or task.uid in deleted_uids:
+                continue
+            if archive_cutoff and task.completed and task.changed_at < archive_cutoff:
+                continue
+            changes.tasks_to_create.append(task)
+
+        # Tasks which are not changed on remote are not downloaded
+        for task in local_tasks:
+            if task.uid not in states and task.synced:
+                changes.tasks_to_delete.append(task)
+            elif task.uid in states and task.deleted:
+                if self.__delete_remote_task(calendar, task, states[task.uid]):
+                    del states[task.uid]
+            elif task.uid not in states and not task.synced:
+                if state := self.__create_remote_task(calendar, task):
+                    states[task.uid] = state
+                    changes.tasks_to_mark_synced.append(task)
+            elif task.uid in states and not task.synced:
+                if self.__update_remote_task(calendar, task, states[task.uid]):
+                    changes.tasks_to_mark_synced.append(task)
+            elif task.uid in remote_tasks and task.synced:
+                changes.tasks_to_update.append((task, remote_tasks[task.uid]))
+
+        return changes
+
+    def __apply_changes(self, changes: CalendarChanges) -> None:
+        """Change local tasks after sync of calendar. Called in transaction."""
+
+        args: UpdateUIArgs = UpdateUIArgs()
+        calendar: Calendar = changes.calendar
+        for task in changes.tasks_to_create:
+            self.__create_local_task(calendar, task, args)
+        for task in changes.tasks_to_delete:
+            self.__delete_local_task(calendar, task, args)
+        for task, remote_task in changes.tasks_to_update:
+            self.__update_local_task(calendar, task, remote_task, args)
+        for task in changes.tasks_to_mark_synced:
+            UserData.mark_synced(task)
+
+        self.sync_state.set_calendar(
+            calendar.id, changes.states, token=changes.token, ctag=changes.ctag
+        )
+        self.update_ui_args.merge(args)
 
     def __update_local_task(
-        self, calendar: Calendar, task: TaskData, remote_tasks: list[TaskData]
+        self,
+        calendar: Calendar,
+        task: TaskData,
+        remote_task: TaskData,
+        args: UpdateUIArgs,
     ):
-        remote_task: TaskData = [t for t in remote_tasks if t.uid == task.uid][0]
-        remote_task_keys = asdict(remote_task).keys()
-        exclude_keys: str = "attachments synced trash expanded toolbar_shown deleted notified created_at"
-        updated_props: list[str] = []
-        updated_values: list[Any] = []
-        for key in remote_task_keys:
-            if key not in exclude_keys and getattr(remote_task, key) != getattr(
-                task, key
-            ):
-                updated_props.append(key)
-                updated_values.append(getattr(remote_task, key))
+        exclude_keys: tuple[str] = (
+            "attachments",
+            "synced",
+            "trash",
+            "expanded",
+            "toolbar_shown",
+            "deleted",
+            "notified",
+            "created_at",
+        )
+        # Task wasn't ordered by any client yet. Keep local order.
+        if remote_task.sort_order is None:
+            exclude_keys += ("sort_order",)
+        updated_props: list[str] = remote_task.diff(task, exclude_keys)
+        updated_values: list[Any] = [getattr(remote_task, p) for p in updated_props]
 
         if not updated_props or (
             updated_props == ["changed_at"] and updated_values == [""]
@@ -377,129 +862,156 @@ class SyncProviderCalDAV:
             return
 
         Log.debug(f"Sync: Update local task '{task.uid}'. Updated: {updated_props}")
-        old_task: TaskData = deepcopy(task)
+        old_list_uid: str = task.list_uid
+        new_list_uid: str = remote_task.list_uid
         UserData.update_props(calendar.id, task.uid, updated_props, updated_values)
 
         if "tags" in updated_props:
-            self.update_ui_args.update_tags = True
+            args.update_tags = True
         if "parent" in updated_props:
             if "list_uid" in updated_props:
-                if old_task.list_uid not in self.update_ui_args.lists_to_update_tasks:
-                    self.update_ui_args.lists_to_update_tasks.append(old_task.list_uid)
-            if task.list_uid not in self.update_ui_args.lists_to_update_tasks:
-                self.update_ui_args.lists_to_update_tasks.append(task.list_uid)
+                if old_list_uid not in args.lists_to_update_tasks:
+                    args.lists_to_update_tasks.append(old_list_uid)
+            if new_list_uid not in args.lists_to_update_tasks:
+                args.lists_to_update_tasks.append(new_list_uid)
         else:
-            self.update_ui_args.tasks_to_update.append(task)
+            args.tasks_to_update.append(task)
+
+    def __update_remote_task(
+        self, calendar: Calendar, task: TaskData, state: TaskSyncState
+    ) -> bool:
+        """
+        Replace task on remote by href if it was not changed there.
+        Returns True if remote task is the same as local one.
+        """
+
+        task_hash: str = get_task_hash(task)
+        if task_hash == state.hash:
+            # Only local properties or timestamps are changed
+            return True
 
-    def __update_remote_task(self, calendar: Calendar, task: TaskData) -> None:
         Log.debug(f"Sync: Update remote task '{task.uid}'")
 
         try:
-            todo: Todo = calendar.todo_by_uid(task.uid)
-            if task.due_date:
-                todo.icalendar_component["due"] = task.due_date
-            else:
-                try:
-                    del todo.icalendar_component["due"]
-                except BaseException:
-                    pass
-            if task.start_date:
-                todo.icalendar_component["dtstart"] = task.start_date
-            else:
-                try:
-                    del todo.icalendar_component["dtstart"]
-                except BaseException:
-                    pass
-            if task.created_at:
-                todo.icalendar_component["dtstamp"] = task.created_at
-            else:
-                try:
-                    del todo.icalendar_component["dtstamp"]
-                except BaseException:
-                    pass
-            if task.changed_at:
-                todo.icalendar_component["last-modified"] = task.changed_at
-            else:
-                try:
-                    del todo.icalendar_component["last-modified"]
-                except BaseException:
-                    pass
-            todo.icalendar_component["summary"] = task.text
-            todo.icalendar_component["percent-complete"] = int(task.percent_complete)
-            todo.icalendar_component["description"] = task.notes
-            todo.icalendar_component["priority"] = task.priority
-            todo.icalendar_component["categories"] = (
-                ",".join(task.tags) if task.tags else []
-            )
-            todo.icalendar_component["related-to"] = task.parent
-            todo.icalendar_component["x-errands-color"] = task.color
-            todo.icalendar_component["x-errands-toolbar-shown"] = int(
-                task.toolbar_shown
-            )
-            todo.icalendar_component["x-errands-expanded"] = int(task.expanded)
-            todo.save()
-            todo.uncomplete()
-            if task.completed:
-                todo.complete()
-            UserData.update_props(calendar.id, task.uid, ["synced"], [True])
-        except Exception as e:
+            headers: dict[str, str] = {"Content-Type": "text/calendar; charset=utf-8"}
+            if state.etag:
+                headers["If-Match"] = state.etag
+            ical: str = self.__to_ical(task, state.ical)
+            response = calendar.client.request(state.href, "PUT", ical, headers)
+            if response.status == 412:
+                # Remote task will be downloaded and local changes sent again
+                Log.debug(f"Sync: Task '{task.uid}' was changed on remote")
+                state.etag = ""
+                return False
+            if response.status not in (200, 201, 204):
+                raise error.PutError(f"{response.status} {response.reason}")
+            state.etag = response.headers.get("ETag", "")
+            state.hash = task_hash
+            state.ical = ical
+            return True
+        except SYNC_ERRORS as e:
             Log.error(f"Sync: Can't update task on remote '{task.uid}'. {e}")
+            return False
+
+    def __create_remote_task(
+        self, calendar: Calendar, task: TaskData, href: str = ""
+    ) -> TaskSyncState | None:
+        """Create task on remote and return its state or None on error"""
 
-    def __create_remote_task(self, calendar: Calendar, task: TaskData) -> None:
         Log.debug(f"Sync: Create remote task '{task.uid}'")
 
         try:
-            new_todo = calendar.save_todo(
-                **{
-                    "categories": ",".join(task.tags) if task.tags else None,
-                    "description": task.notes,
-                    "dtstart": (
-                        datetime.datetime.fromisoformat(task.start_date)
-                        if task.start_date
-                        else None
-                    ),
-                    "due": (
-                        datetime.datetime.fromisoformat(task.due_date)
-                        if task.due_date
-                        else None
-                    ),
-                    "priority": task.priority,
-                    "percent-complete": task.percent_complete,
-                    "related-to": task.parent,
-                    "summary": task.text,
-                    "uid": task.uid,
-                    "x-errands-color": task.color,
-                    "x-errands-expanded": int(task.expanded),
-                    "x-errands-toolbar-shown": int(task.toolbar_shown),
-                }
+            # Same form as hrefs received from the server
+            if not href:
+                href = str(calendar.url.join(quote(task.uid) + ".ics").canonical())
+            ical: str = self.__to_ical(task)
+            response = calendar.client.request(
+                href,
+                "PUT",
+                ical,
+                {"Content-Type": "text/calendar; charset=utf-8", "If-None-Match": "*"},
             )
-            if task.completed:
-                new_todo.complete()
-            UserData.update_props(calendar.id, task.uid, ["synced"], [True])
-        except Exception as e:
+            if response.status == 412:
+                return self.__merge_remote_task(calendar, task, href)
+            if response.status not in (200, 201, 204):
+                raise error.PutError(f"{response.status} {response.reason}")
+            return TaskSyncState(
+                href=href,
+                etag=response.headers.get("ETag", ""),
+                hash=get_task_hash(task),
+                ical=ical,
+            )
+        except SYNC_ERRORS as e:
             Log.error(f"Sync: Can't create new task on remote: {task.uid}. {e}")
+            return None
+
+    def __merge_remote_task(
+        self, calendar: Calendar, task: TaskData, href: str
+    ) -> TaskSyncState | None:
+        """
+        Resolve conflict when task can't be created because href is taken.
+        Remote task with the same uid is downloaded and local changes are written
+        over it with its ETag. Other object at href is kept and task is created
+        by new href.
+        """
+
+        todo: Todo = Todo(url=href, parent=calendar).load()
+        if str(todo.icalendar_component.get("uid", "")) != task.uid:
+            Log.debug(f"Sync: Href of task '{task.uid}' is taken on remote")
+            new_href: str = str(
+                calendar.url.join(f"{quote(task.uid)}-{uuid4()}.ics").canonical()
+            )
+            return self.__create_remote_task(calendar, task, new_href)
+
+        Log.debug(f"Sync: Task '{task.uid}' already exists on remote")
+        state: TaskSyncState = TaskSyncState(
+            href=href,
+            etag=todo.props.get(dav.GetEtag.tag, ""),
+            hash=get_task_hash(self.__to_task(todo, calendar)),
+            ical=todo.data,
+        )
+        # Remote task was changed again or can't be updated. Merge it next time.
+        return state if self.__update_remote_task(calendar, task, state) else None
 
-    def __delete_local_task(self, calendar: Calendar, task: TaskData) -> None:
+    def __delete_local_task(
+        self, calendar: Calendar, task: TaskData, args: UpdateUIArgs
+    ) -> None:
         Log.debug(f"Sync: Delete local task '{task.uid}'")
 
         UserData.delete_task(calendar.id, task.uid)
-        self.update_ui_args.tasks_to_purge.append(task)
-        self.update_ui_args.update_trash = True
-        self.update_ui_args.update_tags = True
+        args.tasks_to_purge.append(task)
+        args.update_trash = True
+        args.update_tags = True
+
+    def __delete_remote_task(
+        self, calendar: Calendar, task: TaskData, state: TaskSyncState
+    ) -> bool:
+        """Delete task on remote by href if it was not changed there"""
 
-    def __delete_remote_task(self, calendar: Calendar, task: TaskData) -> None:
         Log.debug(f"Sync: Delete remote task '{task.uid}'")
 
         try:
-            if todo := calendar.todo_by_uid(task.uid):
-                todo.delete()
-        except Exception as e:
+            headers: dict[str, str] = {"If-Match": state.etag} if state.etag else {}
+            response = calendar.client.request(state.href, "DELETE", "", headers)
+            if response.status == 412:
+                # Deleted after remote task is downloaded on the next sync
+                Log.debug(f"Sync: Task '{task.uid}' was changed on remote")
+                state.etag = ""
+                return False
+            if response.status not in (200, 204, 404):
+                raise error.DeleteError(f"{response.status} {response.reason}")
+            return True
+        except SYNC_ERRORS as e:
             Log.error(f"Sync: Can't delete task from remote: '{task.uid}'. {e}")
+            return False
 
-    def __create_local_task(self, calendar: Calendar, task: TaskData) -> None:
+    def __create_local_task(
+        self, calendar: Calendar, task: TaskData, args: UpdateUIArgs
+    ) -> None:
         Log.debug(
             f"Sync: Copy new task from remote to list '{calendar.id}': {task.uid}"
         )
-        UserData.add_task(**asdict(task))
-        if task.list_uid not in self.update_ui_args.lists_to_update_tasks:
-            self.update_ui_args.lists_to_update_tasks.append(task.list_uid)
+        # Task is the same as on remote, so it's not sent back
+        UserData.add_task(**{**task.to_dict(), "synced": True})
+        if task.list_uid not in args.lists_to_update_tasks:
+            args.lists_to_update_tasks.append(task.list_uid)
@@ -20,6 +20,10 @@ class Sync:
     @classmethod
     def init(self, testing: bool = False) -> None:
         Log.info("Sync: Initialize sync provider")
+        # Connections of running sync are closed when it's finished
+        if self.provider and not self.syncing:
+            self.provider.close()
+        self.provider = None
         match GSettings.get("sync-provider"):
             case 0:
                 Log.info("Sync: Sync disabled")
@@ -50,6 +54,7 @@ class Sync:
             if State.view_stack.get_visible_child_name() == "errands_status_page":
                 State.view_stack.set_visible_child_name("errands_syncing_page")
             GLib.idle_add(State.sidebar.toggle_sync_indicator, True)
+            UserData.flush()
             self.provider.sync()
             UserData.clean_deleted()
             if self.sync_again:
@@ -0,0 +1,154 @@
+# Copyright 2024 Vlad Krupinskii <mrvladus@yandex.ru>
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass
+from threading import Lock
+from typing import Any
+
+from errands.lib.data import FileWriter, TaskData, UserData
+from errands.lib.logging import Log
+
+# TaskData fields which are sent to the server and compared by hash.
+# Timestamps are changed on every edit and don't make content different.
+HASHED_PROPS: tuple[str] = (
+    "color",
+    "completed",
+    "due_date",
+    "expanded",
+    "notes",
+    "parent",
+    "percent_complete",
+    "priority",
+    "sort_order",
+    "start_date",
+    "tags",
+    "text",
+    "toolbar_shown",
+)
+
+
+def get_task_hash(task: TaskData) -> str:
+    """Hash of task content sent to the server"""
+
+    content: str = json.dumps([getattr(task, p) for p in HASHED_PROPS])
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+@dataclass
+class TaskSyncState:
+    """Task on the server after the last sync"""
+
+    href: str
+    etag: str = ""
+    # get_task_hash() of the last content sent or received
+    hash: str = ""
+    # iCal of the last content sent or received. Errands' properties are written
+    # into it on update, so properties and alarms set by other apps are kept.
+    ical: str = ""
+
+
+class SyncState:
+    """
+    State of calendars on the server after the last sync, kept in "sync.json".
+    For every calendar it stores sync token, CTag and href, ETag, content hash
+    and iCal of every task. So unchanged calendars and tasks are skipped and tasks are
+    written to the server by href without looking them up.
+    State belongs to one account and is cleared when url or username change.
+    """
+
+    def __init__(self, url: str, username: str) -> None:
+        self.path: str = os.path.join(UserData.data_dir, "sync.json")
+        self.__lock: Lock = Lock()
+        self.__account: str = f"{username}@{url}"
+        self.__calendars: dict[str, dict[str, Any]] = {}
+        self.__changed: bool = False
+        self.__read()
+
+    def get_token(self, calendar_id: str) -> str:
+        with self.__lock:
+            return self.__calendars.get(calendar_id, {}).get("token", "")
+
+    def get_ctag(self, calendar_id: str) -> str:
+        with self.__lock:
+            return self.__calendars.get(calendar_id, {}).get("ctag", "")
+
+    def get_tasks(self, calendar_id: str) -> dict[str, TaskSyncState]:
+        """Task uid -> state of tasks on the server"""
+
+        with self.__lock:
+            return {
+                uid: TaskSyncState(**task)
+                for uid, task in self.__calendars.get(calendar_id, {})
+                .get("tasks", {})
+                .items()
+            }
+
+    def set_calendar(
+        self,
+        calendar_id: str,
+        tasks: dict[str, TaskSyncState],
+        token: str = "",
+        ctag: str = "",
+    ) -> None:
+        """Replace state of calendar after it was synced"""
+
+        with self.__lock:
+            self.__calendars[calendar_id] = {
+                "token": token,
+                "ctag": ctag,
+                "tasks": {uid: asdict(task) for uid, task in tasks.items()},
+            }
+            self.__changed = True
+
+    def forget(self, calendar_id: str) -> None:
+        """Download calendar fully on the next sync"""
+
+        with self.__lock:
+            if self.__calendars.pop(calendar_id, None):
+                self.__changed = True
+
+    def forget_missing(self, calendar_ids: list[str]) -> None:
+        """Remove state of calendars which are not on the server anymore"""
+
+        with self.__lock:
+            for calendar_id in list(self.__calendars):
+                if calendar_id not in calendar_ids:
+                    del self.__calendars[calendar_id]
+                    self.__changed = True
+
+    def save(self) -> None:
+        """Write state to disk if it was changed"""
+
+        with self.__lock:
+            if not self.__changed:
+                return
+            data: str = json.dumps(
+                {"account": self.__account, "calendars": self.__calendars}
+            )
+            self.__changed = False
+        try:
+            FileWriter.write_file(self.path, data)
+        except Exception as e:
+            Log.error(f"Sync: Can't save sync state. {e}")
+
+    def __read(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data: dict[str, Any] = json.load(f)
+        except Exception as e:
+            Log.error(f"Sync: Can't read sync state. {e}")
+            return
+        if data.get("account") != self.__account:
+            Log.info("Sync: Account changed. Download all tasks.")
+            return
+        # State of older version without ETags
+        if any("tasks" not in c for c in data.get("calendars", {}).values()):
+            return
+        self.__calendars = data.get("calendars", {})
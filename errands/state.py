@@ -9,6 +9,8 @@ from gi.repository import Adw  # type:ignore
 
 if TYPE_CHECKING:
     from errands.application import ErrandsApplication
+    from errands.widgets.archive.archive import Archive
+    from errands.widgets.archive.archive_sidebar_row import ArchiveSidebarRow
     from errands.lib.notifications import ErrandsNotificationsDaemon
     from errands.widgets.loading_page import ErrandsLoadingPage
     from errands.widgets.shared.task_toolbar import (
@@ -54,12 +56,14 @@ class State:
     today_page: Today | None = None
     tags_page: Tags | None = None
     trash_page: Trash | None = None
+    archive_page: Archive | None = None
 
     # Sidebar
     sidebar: Sidebar | None = None
     today_sidebar_row: TodaySidebarRow | None = None
     tags_sidebar_row: TagsSidebarRow | None = None
     trash_sidebar_row: TrashSidebarRow | None = None
+    archive_sidebar_row: ArchiveSidebarRow | None = None
 
     # Notes window
     notes_window: ErrandsNotesWindow | None = None
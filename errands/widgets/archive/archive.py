@@ -0,0 +1,160 @@
+# Copyright 2024 Vlad Krupinskii <mrvladus@yandex.ru>
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+from gi.repository import Adw, GLib, GObject, Gtk  # type:ignore
+
+from errands.lib.data import TaskData, UserData
+from errands.lib.logging import Log
+from errands.lib.sync.sync import Sync
+from errands.lib.utils import get_children, threaded
+from errands.state import State
+from errands.widgets.shared.components.boxes import ErrandsBox
+from errands.widgets.shared.components.buttons import ErrandsButton
+from errands.widgets.shared.components.header_bar import ErrandsHeaderBar
+from errands.widgets.shared.components.toolbar_view import ErrandsToolbarView
+
+
+class Archive(Adw.Bin):
+    def __init__(self):
+        super().__init__()
+        Log.debug("Archive Page: Load")
+        State.archive_page = self
+        self.__build_ui()
+
+    def __build_ui(self):
+        # Status Page
+        self.status_page = Adw.StatusPage(
+            title=_("Empty Archive"),
+            description=_("No archived tasks"),
+            icon_name="errands-folder-symbolic",
+            vexpand=True,
+            css_classes=["compact"],
+        )
+
+        # Search entry
+        self.search_entry = Gtk.SearchEntry(
+            placeholder_text=_("Search Archive"),
+            margin_top=3,
+            margin_bottom=3,
+            margin_end=12,
+            margin_start=12,
+        )
+        self.search_entry.connect("search-changed", lambda *_: self.update_ui())
+
+        # Archive List
+        self.archive_list = Gtk.ListBox(
+            selection_mode=Gtk.SelectionMode.NONE,
+            margin_bottom=32,
+            margin_end=12,
+            margin_start=12,
+            css_classes=["transparent"],
+        )
+        self.archive_list.bind_property(
+            "visible",
+            self.status_page,
+            "visible",
+            GObject.BindingFlags.SYNC_CREATE | GObject.BindingFlags.INVERT_BOOLEAN,
+        )
+
+        self.set_child(
+            ErrandsToolbarView(
+                top_bars=[
+                    ErrandsHeaderBar(title_widget=Adw.WindowTitle(title=_("Archive"))),
+                    Adw.Clamp(
+                        maximum_size=1000,
+                        tightening_threshold=300,
+                        child=self.search_entry,
+                    ),
+                ],
+                content=ErrandsBox(
+                    orientation=Gtk.Orientation.VERTICAL,
+                    children=[
+                        self.status_page,
+                        Gtk.ScrolledWindow(
+                            propagate_natural_height=True,
+                            child=Adw.Clamp(
+                                maximum_size=1000,
+                                tightening_threshold=300,
+                                child=self.archive_list,
+                            ),
+                        ),
+                    ],
+                ),
+            )
+        )
+
+    @property
+    def archive_items(self) -> list[ArchiveItem]:
+        return get_children(self.archive_list)
+
+    def update_ui(self):
+        """Read archive file in background and show tasks matching search text"""
+
+        self.__load_tasks(self.search_entry.get_text().strip())
+
+    @threaded
+    def __load_tasks(self, text: str) -> None:
+        tasks: list[TaskData] = (
+            UserData.search_archive(text) if text else UserData.get_archived_tasks()
+        )
+        tasks.sort(key=lambda t: t.changed_at, reverse=True)
+        GLib.idle_add(self.__show_tasks, text, tasks)
+
+    def __show_tasks(self, text: str, tasks: list[TaskData]) -> None:
+        # Search text was changed while tasks were loaded
+        if text != self.search_entry.get_text().strip():
+            return
+
+        for item in self.archive_items:
+            self.archive_list.remove(item)
+        for task in tasks:
+            self.archive_list.append(ArchiveItem(task))
+
+        # Show status
+        self.status_page.set_visible(len(tasks) == 0)
+
+
+class ArchiveItem(Adw.ActionRow):
+    def __init__(self, task: TaskData) -> None:
+        super().__init__()
+        self.task_dict: TaskData = task
+        self.__build_ui()
+
+    def __build_ui(self) -> None:
+        self.props.height_request = 60
+        self.set_title_selectable(True)
+        self.set_margin_top(6)
+        self.set_margin_bottom(6)
+        self.add_css_class("card")
+        self.set_title(self.task_dict.text)
+
+        # Task can be restored only to existing list
+        lists: list[str] = [
+            lst.uid for lst in UserData.get_lists_as_dicts() if not lst.deleted
+        ]
+        list_exists: bool = self.task_dict.list_uid in lists
+        if list_exists:
+            self.set_subtitle(UserData.get_list_prop(self.task_dict.list_uid, "name"))
+        self.add_suffix(
+            ErrandsButton(
+                tooltip_text=_("Restore"),
+                icon_name="errands-restore-symbolic",
+                valign=Gtk.Align.CENTER,
+                css_classes=["circular", "flat"],
+                sensitive=list_exists,
+                on_click=self.on_restore_btn_clicked,
+            )
+        )
+
+    def on_restore_btn_clicked(self, _) -> None:
+        Log.info(f"Archive: Restore task: {self.task_dict.uid}")
+
+        task: TaskData = UserData.restore_archived_task(self.task_dict)
+        State.get_task_list(task.list_uid).update_ui()
+        State.archive_page.archive_list.remove(self)
+        State.archive_page.status_page.set_visible(
+            len(State.archive_page.archive_items) == 0
+        )
+        Sync.sync()
@@ -0,0 +1,49 @@
+# Copyright 2024 Vlad Krupinskii <mrvladus@yandex.ru>
+# SPDX-License-Identifier: MIT
+
+
+from gi.repository import Gtk  # type:ignore
+
+from errands.lib.data import UserData
+from errands.lib.gsettings import GSettings
+from errands.lib.logging import Log
+from errands.state import State
+from errands.widgets.shared.components.boxes import ErrandsBox
+
+
+class ArchiveSidebarRow(Gtk.ListBoxRow):
+    def __init__(self) -> None:
+        super().__init__()
+        self.name = "errands_archive_page"
+        State.archive_sidebar_row = self
+        self.__build_ui()
+
+    def __build_ui(self) -> None:
+        self.props.height_request = 45
+        self.add_css_class("sidebar-item")
+        self.connect("activate", self._on_row_activated)
+
+        # Icon
+        self.icon = Gtk.Image(icon_name="errands-folder-symbolic")
+
+        # Title
+        self.label: Gtk.Label = Gtk.Label(
+            hexpand=True, halign=Gtk.Align.START, label=_("Archive")
+        )
+
+        self.set_child(
+            ErrandsBox(
+                spacing=12,
+                margin_start=6,
+                children=[self.icon, self.label],
+            )
+        )
+
+    def _on_row_activated(self, *args) -> None:
+        Log.debug("Sidebar: Open Archive")
+
+        State.view_stack.set_visible_child_name(self.name)
+        State.split_view.set_show_content(True)
+        GSettings.set("last-open-list", "s", self.name)
+        # Archive file is read only when archive is opened
+        UserData.connect_loaded(State.archive_page.update_ui)
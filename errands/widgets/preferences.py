@@ -1,8 +1,11 @@
 # Copyright 2023-2024 Vlad Krupinskii <mrvladus@yandex.ru>
 # SPDX-License-Identifier: MIT
 
+from datetime import datetime
+
 from gi.repository import Adw, Gtk  # type:ignore
 
+from errands.lib.data import UserData
 from errands.lib.goa import get_goa_credentials
 from errands.lib.gsettings import GSettings
 from errands.lib.sync.sync import Sync
@@ -82,6 +85,46 @@ class PreferencesWindow(Adw.PreferencesDialog):
         )
         task_list_group.add(new_task_position)
 
+        # Archive
+        archive_days = Adw.SpinRow(
+            title=_("Archive Completed Tasks"),
+            subtitle=_("Move tasks completed more than this many days ago to archive"),
+            icon_name="errands-folder-symbolic",
+            adjustment=Gtk.Adjustment(lower=0, upper=3650, step_increment=1),
+        )
+        GSettings.bind("archive-days", archive_days, "value")
+        task_list_group.add(archive_days)
+
+        # Backups group
+        backups_group = Adw.PreferencesGroup(
+            title=_("Backups"),
+            description=_("Unchanged data is stored only once"),
+        )
+        backups_hourly = Adw.SpinRow(
+            title=_("Hourly Backups"),
+            subtitle=_("Keep backups of this many last hours"),
+            icon_name="errands-clock-symbolic",
+            adjustment=Gtk.Adjustment(lower=0, upper=168, step_increment=1),
+        )
+        GSettings.bind("backups-hourly", backups_hourly, "value")
+        backups_group.add(backups_hourly)
+        backups_daily = Adw.SpinRow(
+            title=_("Daily Backups"),
+            subtitle=_("Keep backups of this many last days"),
+            icon_name="errands-calendar-symbolic",
+            adjustment=Gtk.Adjustment(lower=0, upper=365, step_increment=1),
+        )
+        GSettings.bind("backups-daily", backups_daily, "value")
+        backups_group.add(backups_daily)
+        self.backups_row = Adw.ExpanderRow(
+            title=_("Restore Backup"),
+            subtitle=_("Current data is backed up before restoring"),
+            icon_name="errands-restore-symbolic",
+        )
+        self.backups_row.connect("notify::expanded", lambda *_: self._update_backups())
+        self.backup_rows: list[Adw.ActionRow] = []
+        backups_group.add(self.backups_row)
+
         # Notifications
         notifications = Adw.SwitchRow(
             title=_("Show Notifications"),
@@ -173,6 +216,7 @@ class PreferencesWindow(Adw.PreferencesDialog):
         )
         appearance_page.add(theme_group)
         appearance_page.add(task_list_group)
+        appearance_page.add(backups_group)
         appearance_page.add(notifications_and_bg_group)
         self.add(appearance_page)
 
@@ -207,6 +251,42 @@ class PreferencesWindow(Adw.PreferencesDialog):
             if not GSettings.get_secret(acc_name):
                 self.sync_password.set_text(data["password"])
 
+    def _update_backups(self) -> None:
+        if not self.backups_row.props.expanded:
+            return
+
+        for row in self.backup_rows:
+            self.backups_row.remove(row)
+        self.backup_rows = []
+        for name in UserData.get_backups():
+            row = Adw.ActionRow(
+                title=datetime.strptime(name[:15], "%Y%m%dT%H%M%S").strftime("%x %H:%M")
+            )
+            row.add_suffix(
+                ErrandsButton(
+                    tooltip_text=_("Restore"),
+                    icon_name="errands-restore-symbolic",
+                    valign=Gtk.Align.CENTER,
+                    css_classes=["circular", "flat"],
+                    on_click=lambda _btn, name=name: self.on_restore_backup_btn_clicked(
+                        name
+                    ),
+                )
+            )
+            self.backups_row.add_row(row)
+            self.backup_rows.append(row)
+
+    def on_restore_backup_btn_clicked(self, name: str) -> None:
+        self.backups_row.set_sensitive(False)
+
+        def __on_restored(restored: bool) -> None:
+            self.backups_row.set_sensitive(True)
+            self._update_backups()
+            msg: str = _("Backup restored") if restored else _("Can't restore backup")
+            self.add_toast(Adw.Toast(title=msg, timeout=2))
+
+        UserData.restore_backup(name, __on_restored)
+
     def on_sync_pass_changed(self, _entry) -> None:
         if 0 < self.sync_providers.props.selected < 3:
             account = self.sync_providers.props.selected_item.props.string
@@ -93,7 +93,7 @@ class ErrandsAttachmentsWindow(Adw.Dialog):
 
             path: str = file.get_path()
             if path not in self.task.task_data.attachments:
-                new_attachments: list[str] = self.task.task_data.attachments
+                new_attachments: list[str] = list(self.task.task_data.attachments)
                 new_attachments.append(path)
                 self.task.update_props(["attachments"], [new_attachments])
                 self.attachments_list.append(ErrandsAttachment(path))
@@ -145,7 +145,7 @@ class ErrandsAttachment(Adw.ActionRow):
 
     def __on_delete_btn_clicked(self, _btn: ErrandsButton):
         task: Task = State.attachments_window.task
-        new_attachments: list[str] = task.task_data.attachments
+        new_attachments: list[str] = list(task.task_data.attachments)
         new_attachments.remove(self.path)
         task.update_props(["attachments"], [new_attachments])
         State.attachments_window.attachments_list.remove(self)
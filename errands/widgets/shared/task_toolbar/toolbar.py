@@ -3,7 +3,7 @@
 
 from __future__ import annotations
 
-from datetime import datetime
+from datetime import datetime, time
 from typing import TYPE_CHECKING
 
 from gi.repository import Adw, Gio, GLib, GObject, Gtk  # type:ignore
@@ -236,11 +236,9 @@ class ErrandsTaskToolbar(Gtk.FlowBox):
             self.task.task_data.due_date
         )
         self.date_time_btn.remove_css_class("error")
-        if (
-            self.task.task_data.due_date
-            and datetime.fromisoformat(self.task.task_data.due_date).date()
-            < datetime.today().date()
-        ):
+        due: float | None = UserData.get_due_timestamp(self.task.task_data)
+        today: datetime = datetime.combine(datetime.today().date(), time())
+        if due is not None and due < today.timestamp():
             self.date_time_btn.add_css_class("error")
 
         # Update notes button css
@@ -379,7 +377,7 @@ class ErrandsToolbarTagsListItem(Gtk.Box):
         if self.block_signals:
             return
 
-        tags: list[str] = self.task.task_data.tags
+        tags: list[str] = list(self.task.task_data.tags)
 
         if btn.get_active():
             if self.title not in tags:
@@ -10,6 +10,7 @@ from errands.lib.logging import Log
 from errands.lib.sync.sync import Sync
 from errands.lib.utils import get_children
 from errands.state import State
+from errands.widgets.archive.archive_sidebar_row import ArchiveSidebarRow
 from errands.widgets.shared.components.boxes import ErrandsBox, ErrandsListBox
 from errands.widgets.shared.components.buttons import ErrandsButton
 from errands.widgets.shared.components.header_bar import ErrandsHeaderBar
@@ -81,6 +82,7 @@ class Sidebar(Adw.Bin):
                 TodaySidebarRow(),
                 TagsSidebarRow(),
                 TrashSidebarRow(),
+                ArchiveSidebarRow(),
             ],
         )
         self.status_page.bind_property(
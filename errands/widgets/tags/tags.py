@@ -6,7 +6,16 @@ from __future__ import annotations
 
 from gi.repository import Adw, GObject, Gtk  # type:ignore
 
-from errands.lib.data import UserData
+from errands.lib.data import (
+    DataChange,
+    ListRemoved,
+    TagsChanged,
+    TaskAdded,
+    TaskChanged,
+    TaskRemoved,
+    TasksChanged,
+    UserData,
+)
 from errands.lib.logging import Log
 from errands.lib.sync.sync import Sync
 from errands.lib.utils import get_children
@@ -24,7 +33,8 @@ class Tags(Adw.Bin):
         # Load tags
         for tag in UserData.tags:
             self.tags_list.append(Tag(tag.text, self))
-        self.update_ui()
+        UserData.connect_loaded(self.update_ui)
+        UserData.connect_changes(self.__on_data_changes)
 
     def __build_ui(self):
         # Status Page
@@ -90,6 +100,41 @@ class Tags(Adw.Bin):
             )
         )
 
+    def __on_data_changes(self, changes: list[DataChange]) -> None:
+        """Update tags and counters if tags of any task could change"""
+
+        if not UserData.tasks_loaded:
+            return
+
+        # Tags of added tasks
+        tags: set[str] = set()
+        for change in changes:
+            match change:
+                case TaskAdded():
+                    tags.update(UserData.get_task(change.list_uid, change.uid).tags)
+                case TaskChanged(props=props) if "tags" not in props:
+                    continue
+                case (
+                    TagsChanged()
+                    | TaskChanged()
+                    | TaskRemoved()
+                    | TasksChanged()
+                    | ListRemoved()
+                ):
+                    self.update_ui()
+                    return
+
+        if not tags:
+            return
+        rows: dict[str, Tag] = {row.get_title(): row for row in self.tags}
+        # New tags are added to the list
+        if not tags <= rows.keys():
+            self.update_ui()
+            return
+        # Only counters of tags of added tasks are changed
+        for tag in tags:
+            rows[tag].update_ui()
+
     @property
     def tags(self) -> list[Tag]:
         return get_children(self.tags_list)
@@ -111,9 +156,8 @@ class Tags(Adw.Bin):
 
         # Set activatable rows
         if update_tag_rows:
-            tags_in_tasks = [t.tags for t in UserData.tasks if t.tags]
             for tag in self.tags:
-                tag.update_ui(tags_in_tasks)
+                tag.update_ui()
 
         self.tags_list.set_visible(len(self.tags) > 0)
         if State.main_window:
@@ -170,14 +214,8 @@ class Tag(Adw.ActionRow):
         self.tags.update_ui(False)
         Sync.sync()
 
-    def update_ui(self, tags_in_tasks: list[list[str]] = None):
-        if not tags_in_tasks:
-            tags_in_tasks: list[list[str]] = [t.tags for t in UserData.tasks if t.tags]
-
-        count: int = 0
-        for tags in tags_in_tasks:
-            if self.get_title() in tags:
-                count += 1
+    def update_ui(self):
+        count: int = UserData.get_tag_count(self.get_title())
 
         self.set_activatable(False)
         self.number_of_tasks.set_label(str(count) if count > 0 else "")
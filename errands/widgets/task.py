@@ -373,8 +373,8 @@ class Task(Gtk.Revealer):
     def __load_sub_tasks(self) -> None:
         tasks: list[TaskData] = (
             t
-            for t in UserData.tasks
-            if not t.deleted and t.list_uid == self.list_uid and t.parent == self.uid
+            for t in UserData.get_tasks_as_dicts(self.list_uid, self.uid)
+            if not t.deleted
         )
         for task in tasks:
             new_task = Task(task, self)
@@ -483,9 +483,6 @@ class Task(Gtk.Revealer):
         self.toggle_visibility(False)
         self.update_props(["trash"], [True])
         self.complete_btn.set_active(True)
-        State.today_page.update_ui()
-        State.trash_sidebar_row.update_ui()
-        State.tags_page.update_ui()
         self.task_list.update_title()
         if isinstance(self.parent, Task):
             self.parent.update_title()
@@ -578,7 +575,7 @@ class Task(Gtk.Revealer):
             if tag not in tags_list_text:
                 self.add_tag(tag)
 
-        self.tags_bar_rev.set_reveal_child(tags != [])
+        self.tags_bar_rev.set_reveal_child(len(tags) > 0)
 
     def update_progress_bar(self) -> None:
         # Log.debug(f"Task '{self.uid}': Update progress bar")
@@ -804,7 +801,13 @@ class Task(Gtk.Revealer):
             task_parent.update_progress_bar()
 
         # Move widget
-        task_data.completed = self.task_data.completed
+        if task_data.completed != self.task_data.completed:
+            UserData.update_props(
+                self.list_uid,
+                task_data.uid,
+                ["completed", "synced"],
+                [self.task_data.completed, False],
+            )
         new_task: Task = self.parent.add_task(task_data)
         self.get_parent().reorder_child_after(new_task, self)
         self.get_parent().reorder_child_after(self, new_task)
@@ -947,7 +950,7 @@ class Tag(Gtk.Box):
 
     def _on_delete_btn_clicked(self, _btn: Gtk.Button) -> None:
         Log.debug(f"Task '{self.task.uid}': Delete tag '{self.title}'")
-        tags: list[str] = self.task.task_data.tags
+        tags: list[str] = list(self.task.task_data.tags)
         tags.remove(self.title)
         self.task.update_props(["tags", "synced"], [tags, False])
         self.task.update_tags_bar()
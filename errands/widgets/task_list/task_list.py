@@ -8,7 +8,7 @@ from typing import TYPE_CHECKING
 from gi.repository import Adw, Gtk, GLib, GObject  # type:ignore
 
 from errands.lib.animation import scroll
-from errands.lib.data import TaskData, UserData
+from errands.lib.data import DataChange, TaskData, TaskRemoved, UserData
 from errands.lib.gsettings import GSettings
 from errands.lib.logging import Log
 from errands.lib.sync.sync import Sync
@@ -32,7 +32,11 @@ class TaskList(Adw.Bin):
         self.list_uid: str = sidebar_row.uid
         self.sidebar_row: TaskListSidebarRow = sidebar_row
         self.__build_ui()
-        self.__load_tasks()
+        # Tasks may still be loading in background on startup
+        if not UserData.tasks_loaded:
+            self.update_title()
+        UserData.connect_loaded(self.__load_tasks)
+        UserData.connect_changes(self.__on_data_changes)
 
     # ------ PRIVATE METHODS ------ #
 
@@ -170,6 +174,31 @@ class TaskList(Adw.Bin):
         )
         self.update_title()
 
+    def __on_data_changes(self, changes: list[DataChange]) -> None:
+        """Remove rows of tasks removed from data, e.g. moved to archive"""
+
+        if not UserData.tasks_loaded:
+            return
+
+        removed: set[str] = {
+            c.uid
+            for c in changes
+            if isinstance(c, TaskRemoved) and c.list_uid == self.list_uid
+        }
+        if not removed:
+            return
+
+        parents: list[TaskList | Task] = []
+        for task in self.all_tasks:
+            if task.uid in removed and task.parent not in parents:
+                parents.append(task.parent)
+        for parent in parents:
+            parent.update_tasks()
+            if isinstance(parent, Task):
+                parent.update_title()
+                parent.update_progress_bar()
+        self.update_title()
+
     # ------ PROPERTIES ------ #
 
     @property
@@ -247,6 +276,10 @@ class TaskList(Adw.Bin):
         # Update delete completed button
         self.delete_completed_btn.set_sensitive(n_completed > 0)
 
+        # Counters are known before tasks are loaded
+        if not UserData.tasks_loaded:
+            return
+
         # Update separator
         toplevel_tasks: list[TaskData] = [
             t
@@ -315,9 +348,10 @@ class TaskList(Adw.Bin):
         """Hide completed tasks and move them to trash"""
 
         Log.info(f"Task List '{self.list_uid}': Delete completed tasks")
-        for task in self.all_tasks:
-            if not task.task_data.trash and task.task_data.completed:
-                task.delete()
+        with UserData.transaction():
+            for task in self.all_tasks:
+                if not task.task_data.trash and task.task_data.completed:
+                    task.delete()
         self.update_ui()
 
     def _on_toggle_completed_btn_toggled(self, btn: Gtk.ToggleButton) -> None:
@@ -2,11 +2,20 @@
 # SPDX-License-Identifier: MIT
 
 
-from datetime import datetime
+from datetime import datetime, time, timedelta
 
 from gi.repository import Adw, GObject, Gtk  # type:ignore
 
-from errands.lib.data import TaskData, UserData
+from errands.lib.data import (
+    DataChange,
+    TagsChanged,
+    TaskAdded,
+    TaskChanged,
+    TaskData,
+    TaskMoved,
+    TaskRemoved,
+    UserData,
+)
 from errands.lib.logging import Log
 from errands.lib.utils import get_children
 from errands.state import State
@@ -21,7 +30,8 @@ class Today(Adw.Bin):
         Log.debug("Today Page: Load")
         State.today_page = self
         self.__build_ui()
-        self.update_ui()
+        UserData.connect_loaded(self.update_ui)
+        UserData.connect_changes(self.__on_data_changes)
 
     # ------ PRIVATE METHODS ------ #
 
@@ -63,6 +73,74 @@ class Today(Adw.Bin):
             )
         )
 
+    def __tomorrow(self) -> float:
+        return datetime.combine(
+            datetime.today().date() + timedelta(days=1), time()
+        ).timestamp()
+
+    def __is_today(self, task: TaskData, tomorrow: float) -> bool:
+        due: float | None = UserData.get_due_timestamp(task)
+        return (
+            due is not None
+            and due < tomorrow
+            and not task.deleted
+            and not task.completed
+            and not task.trash
+        )
+
+    def __on_data_changes(self, changes: list[DataChange]) -> None:
+        """Add, remove or update only rows of changed tasks"""
+
+        if not UserData.tasks_loaded:
+            return
+
+        changed: dict[tuple[str, str], bool] = {}
+        tags: set[str] = set()
+        for change in changes:
+            match change:
+                case TaskAdded() | TaskChanged():
+                    changed.setdefault((change.list_uid, change.uid), True)
+                case TaskMoved(from_list_uid=from_list_uid):
+                    # Row of task moved to another list is added again
+                    if from_list_uid and from_list_uid != change.list_uid:
+                        changed[(from_list_uid, change.uid)] = False
+                    changed.setdefault((change.list_uid, change.uid), True)
+                case TaskRemoved():
+                    changed[(change.list_uid, change.uid)] = False
+                case TagsChanged(props=props):
+                    tags.update(props)
+                case _:
+                    # Lists or many tasks were changed
+                    self.update_ui()
+                    return
+
+        # Tags were renamed or removed
+        if tags:
+            for row in self.tasks:
+                if tags & ({t.title for t in row.tags} | set(row.task_data.tags)):
+                    row.update_tags_bar()
+
+        if not changed:
+            return
+
+        Log.debug(f"Today Page: Update {len(changed)} tasks")
+        rows: dict[tuple[str, str], TodayTask] = {
+            (t.list_uid, t.uid): t for t in self.tasks
+        }
+        tomorrow: float = self.__tomorrow()
+        for key, exists in changed.items():
+            row: TodayTask | None = rows.get(key)
+            task: TaskData | None = UserData.get_task(*key) if exists else None
+            if task and self.__is_today(task, tomorrow):
+                if row:
+                    row.update_ui()
+                else:
+                    self.add_task(task)
+            elif row:
+                row.purge()
+
+        self.update_status()
+
     # ------ PROPERTIES ------ #
 
     @property
@@ -71,14 +149,11 @@ class Today(Adw.Bin):
 
     @property
     def tasks_data(self) -> list[TaskData]:
+        tomorrow: float = self.__tomorrow()
         return [
             t
-            for t in UserData.tasks
-            if not t.deleted
-            and not t.completed
-            and not t.trash
-            and t.due_date
-            and datetime.fromisoformat(t.due_date).date() <= datetime.today().date()
+            for t in UserData.get_tasks_due_before(tomorrow)
+            if not t.deleted and not t.completed and not t.trash
         ]
 
     # ------ PUBLIC METHODS ------ #
@@ -296,7 +296,7 @@ class TodayTask(Gtk.Revealer):
             if tag not in tags_list_text:
                 self.add_tag(tag)
 
-        self.tags_bar_rev.set_reveal_child(tags != [])
+        self.tags_bar_rev.set_reveal_child(len(tags) > 0)
 
         linked_task = State.get_task(self.task_data.list_uid, self.task_data.uid)
         if linked_task:
@@ -168,8 +168,9 @@ class Trash(Adw.Bin):
 
         Log.info("Trash: Restore")
 
-        for task in self.trash_items:
-            task.on_restore_btn_clicked(None)
+        with UserData.transaction():
+            for task in self.trash_items:
+                task.on_restore_btn_clicked(None)
 
 
 class TrashItem(Adw.ActionRow):
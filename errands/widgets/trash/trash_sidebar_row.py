@@ -6,6 +6,14 @@ from __future__ import annotations
 
 from gi.repository import Gio, Gtk, Gdk  # type:ignore
 
+from errands.lib.data import (
+    DataChange,
+    ListRemoved,
+    TaskChanged,
+    TaskRemoved,
+    TasksChanged,
+    UserData,
+)
 from errands.lib.gsettings import GSettings
 from errands.lib.logging import Log
 from errands.state import State
@@ -21,6 +29,7 @@ class TrashSidebarRow(Gtk.ListBoxRow):
         State.trash_sidebar_row = self
         self.__add_actions()
         self.__build_ui()
+        UserData.connect_changes(self.__on_data_changes)
 
     def __build_ui(self) -> None:
         self.props.height_request = 45
@@ -89,6 +98,20 @@ class TrashSidebarRow(Gtk.ListBoxRow):
         __create_action("clear", lambda *_: State.trash_page.on_trash_clear())
         __create_action("restore", lambda *_: State.trash_page.on_trash_restore())
 
+    def __on_data_changes(self, changes: list[DataChange]) -> None:
+        """Update trash if any task could be moved to or out of it"""
+
+        if not State.trash_page or not UserData.tasks_loaded:
+            return
+
+        for change in changes:
+            match change:
+                case TaskChanged(props=props) if not props & {"trash", "deleted"}:
+                    continue
+                case TaskChanged() | TaskRemoved() | TasksChanged() | ListRemoved():
+                    self.update_ui()
+                    return
+
     def update_ui(self) -> None:
         # Update trash
         State.trash_page.update_ui()
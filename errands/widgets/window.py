@@ -3,16 +3,28 @@
 
 from __future__ import annotations
 
-from dataclasses import asdict
 from uuid import uuid4
 
 from gi.repository import Adw, Gio, Gtk  # type:ignore
 
-from errands.lib.data import TaskListData, UserData
+from errands.lib.data import (
+    MOVE_PROPS,
+    DataChange,
+    ListAdded,
+    ListChanged,
+    ListRemoved,
+    TagsChanged,
+    TaskChanged,
+    TaskListData,
+    TaskMoved,
+    TasksChanged,
+    UserData,
+)
 from errands.lib.gsettings import GSettings
 from errands.lib.logging import Log
 from errands.lib.sync.sync import Sync
 from errands.state import State
+from errands.widgets.archive.archive import Archive
 from errands.widgets.loading_page import ErrandsLoadingPage
 from errands.widgets.preferences import PreferencesWindow
 from errands.widgets.shared.components.boxes import ErrandsBox
@@ -74,6 +86,9 @@ class Window(Adw.ApplicationWindow):
         self.view_stack.add_titled(
             child=Trash(), name="errands_trash_page", title=_("Trash")
         )
+        self.view_stack.add_titled(
+            child=Archive(), name="errands_archive_page", title=_("Archive")
+        )
 
         # Status Page
         self.view_stack.add_titled(
@@ -137,10 +152,83 @@ class Window(Adw.ApplicationWindow):
         State.split_view = self.split_view
         State.view_stack.set_visible_child_name("errands_status_page")
         State.sidebar.load_task_lists()
+        UserData.connect_loaded(self.__on_tasks_loaded)
+        UserData.connect_external_changes(self.__update_changed)
+
+    def __on_tasks_loaded(self) -> None:
         State.trash_sidebar_row.update_ui()
+        # Move old completed tasks to archive in background
+        UserData.archive_completed()
+        # Make backups in background
+        UserData.start_backups()
         # Sync
         Sync.sync()
 
+    def __update_changed(self, changes: list[DataChange]) -> None:
+        """
+        Update only lists and tasks changed by undo, redo, another process
+        or restored from backup
+        """
+
+        if any(isinstance(c, (ListAdded, ListChanged, ListRemoved)) for c in changes):
+            self.__update_lists()
+
+        task_lists: set[str] = set()
+        for change in changes:
+            match change:
+                case ListAdded() | ListChanged() | ListRemoved() | TagsChanged():
+                    continue
+                case TaskChanged(props=props) if not props & (
+                    MOVE_PROPS | {"completed", "deleted", "trash"}
+                ):
+                    if task := State.get_task(change.list_uid, change.uid):
+                        task.update_ui()
+                case TaskMoved():
+                    task_lists.update((change.list_uid, change.from_list_uid))
+                case TasksChanged(list_uid=""):
+                    # All lists
+                    task_lists.update(row.uid for row in State.sidebar.task_lists_rows)
+                case _:
+                    task_lists.add(change.list_uid)
+
+        # Tasks were added, removed or moved
+        for task_list in State.get_task_lists():
+            if task_list.list_uid in task_lists:
+                task_list.update_ui()
+                for task in task_list.all_tasks:
+                    task.update_ui()
+        State.sidebar.update_status()
+
+    def __update_lists(self) -> None:
+        """Add and remove sidebar rows of lists"""
+
+        lists: dict[str, TaskListData] = {
+            lst.uid: lst for lst in UserData.get_lists_as_dicts() if not lst.deleted
+        }
+        rows_uids: list[str] = []
+        for row in State.sidebar.task_lists_rows:
+            if row.uid not in lists:
+                State.sidebar.remove_task_list(row)
+            else:
+                rows_uids.append(row.uid)
+        for uid, lst in lists.items():
+            if uid not in rows_uids:
+                State.sidebar.add_task_list(lst)
+        for row in State.sidebar.task_lists_rows:
+            row.update_ui(False)
+
+    def __activate_text_action(self, name: str) -> bool:
+        """
+        Activate undo or redo of focused text field instead of undo or redo of data.
+        Returns False if no text field has focus.
+        """
+
+        focus: Gtk.Widget | None = self.get_focus()
+        if not isinstance(focus, (Gtk.Editable, Gtk.TextView)):
+            return False
+        focus.activate_action(name, None)
+        return True
+
     def add_toast(self, text: str) -> None:
         self.toast_overlay.add_toast(Adw.Toast.new(title=text))
 
@@ -179,6 +267,22 @@ class Window(Adw.ApplicationWindow):
                 return
             Sync.sync()
 
+        def _undo(*args) -> None:
+            if self.__activate_text_action("text.undo"):
+                return
+            changes: list[DataChange] | None = UserData.undo()
+            if changes is not None:
+                self.__update_changed(changes)
+                Sync.sync()
+
+        def _redo(*args) -> None:
+            if self.__activate_text_action("text.redo"):
+                return
+            changes: list[DataChange] | None = UserData.redo()
+            if changes is not None:
+                self.__update_changed(changes)
+                Sync.sync()
+
         def _import(*args) -> None:
             def _confirm(dialog: Gtk.FileDialog, res) -> None:
                 try:
@@ -206,8 +310,9 @@ class Window(Adw.ApplicationWindow):
                         name=task_list.name, uuid=task_list.uid, color=task_list.color
                     )
 
-                    for task in tasks:
-                        UserData.add_task(**asdict(task))
+                    with UserData.transaction():
+                        for task in tasks:
+                            UserData.add_task(**task.to_dict())
 
                 State.sidebar.add_task_list(new_task_list)
                 self.add_toast(_("Imported"))
@@ -227,6 +332,8 @@ class Window(Adw.ApplicationWindow):
         self._create_action("import", _import, ["<primary>i"])
         self._create_action("quit", lambda *_: State.application.quit(), ["<primary>q"])
         self._create_action("sync", _sync, ["<primary>f"])
+        self._create_action("undo", _undo, ["<primary>z"])
+        self._create_action("redo", _redo, ["<primary><shift>z"])
         self._create_action(
             "quit",
             lambda *_: self.props.application.quit(),
@@ -0,0 +1,85 @@
+# Copyright 2024 Vlad Krupinskii <mrvladus@yandex.ru>
+# SPDX-License-Identifier: MIT
+
+"""
+Memory used by tasks loaded from JSON.
+Compares TaskData with the same fields in a regular dataclass with lists
+and without shared strings, as tasks were stored before.
+Run with "python tests/benchmark_memory.py [number of tasks]".
+"""
+
+import json
+import os
+import random
+import sys
+import tracemalloc
+from dataclasses import MISSING, field, fields, make_dataclass
+from typing import Any
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from errands.lib.data import TaskData  # noqa: E402
+
+# Tasks as they were stored before: __dict__ per task and new list for tags
+PlainTaskData: type = make_dataclass(
+    "PlainTaskData",
+    [
+        (
+            f.name,
+            f.type,
+            (
+                field(default_factory=list)
+                if f.default == ()
+                else field(default=f.default if f.default is not MISSING else None)
+            ),
+        )
+        for f in fields(TaskData)
+    ],
+)
+
+
+def generate_tasks(count: int) -> str:
+    """JSON of tasks in 10 lists with repeated colors and tags"""
+
+    rng: random.Random = random.Random(1)
+    lists: list[str] = [f"list-{i:04d}-{'x' * 24}" for i in range(10)]
+    tasks: list[dict[str, Any]] = []
+    for i in range(count):
+        tasks.append(
+            {
+                "list_uid": rng.choice(lists),
+                "uid": f"task-{i:06d}-{'y' * 24}",
+                "parent": "" if i % 4 == 0 else f"task-{i // 4 * 4:06d}-{'y' * 24}",
+                "text": f"Task {i}",
+                "color": rng.choice(["", "blue", "red"]),
+                "tags": rng.choice([[], [], ["work"], ["home", "work"]]),
+                "attachments": [],
+                "changed_at": "20240101T120000",
+                "created_at": "20240101T120000",
+            }
+        )
+    return json.dumps({"tasks": tasks})
+
+
+def measure(cls: type, data: str) -> int:
+    """Bytes per task left after JSON is parsed and tasks are created"""
+
+    tracemalloc.start()
+    tasks: list[Any] = [cls(**t) for t in json.loads(data)["tasks"]]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size // len(tasks)
+
+
+def main() -> None:
+    count: int = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    data: str = generate_tasks(count)
+    before: int = measure(PlainTaskData, data)
+    after: int = measure(TaskData, data)
+    print(f"Tasks: {count}")
+    print(f"Before: {before} bytes per task")
+    print(f"After: {after} bytes per task ({(before - after) / before:.0%} less)")
+
+
+if __name__ == "__main__":
+    main()
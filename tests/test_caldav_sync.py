@@ -0,0 +1,349 @@
+# Copyright 2024 Vlad Krupinskii <mrvladus@yandex.ru>
+# SPDX-License-Identifier: MIT
+
+"""
+Requests sent by CalDAV sync provider, counted by a local stand-in server.
+Run with "python -m pytest tests".
+"""
+
+import builtins
+import re
+import threading
+from typing import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+import pytest
+
+pytest.importorskip("caldav")
+pytest.importorskip("gi")
+
+builtins.__dict__.setdefault("_", lambda s: s)
+
+from errands.lib import data  # noqa: E402
+from errands.lib.gsettings import GSettings  # noqa: E402
+from errands.lib.logging import Log  # noqa: E402
+from errands.lib.sync.providers.caldav import SyncProviderCalDAV  # noqa: E402
+
+CALENDAR: str = "/calendars/tasks/"
+
+MULTISTATUS: str = """<?xml version="1.0" encoding="utf-8"?>
+<D:multistatus xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav" \
+xmlns:CS="http://calendarserver.org/ns/">{}</D:multistatus>"""
+
+RESPONSE: str = """<D:response><D:href>{}</D:href>
+<D:propstat><D:prop>{}</D:prop><D:status>HTTP/1.1 200 OK</D:status></D:propstat>
+</D:response>"""
+
+CALENDAR_PROPS: str = """<D:resourcetype><D:collection/><C:calendar/></D:resourcetype>
+<D:displayname>Tasks</D:displayname>
+<C:supported-calendar-component-set><C:comp name="VTODO"/>\
+</C:supported-calendar-component-set>
+<CS:getctag>ctag-{}</CS:getctag>"""
+
+TODO: str = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//Test//
+BEGIN:VTODO
+UID:{uid}
+SUMMARY:{summary}
+LOCATION:Office
+BEGIN:VALARM
+ACTION:DISPLAY
+TRIGGER:-PT15M
+END:VALARM
+END:VTODO
+END:VCALENDAR
+"""
+
+
+class CalDAVServer(ThreadingHTTPServer):
+    """CalDAV server with one calendar that supports sync tokens"""
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), CalDAVHandler)
+        self.lock: threading.Lock = threading.Lock()
+        # (method, path, headers) of every request
+        self.requests: list[tuple[str, str, dict[str, str]]] = []
+        # href -> (iCal, ETag)
+        self.objects: dict[str, tuple[str, str]] = {}
+        # Hrefs changed by every change. Sync token is the number of changes.
+        self.changes: list[str] = []
+        self.url: str = f"http://127.0.0.1:{self.server_address[1]}/"
+        # Called in server thread on every request
+        self.on_request: Callable[[], None] | None = None
+
+    def put(self, href: str, ical: str) -> str:
+        etag: str = f'"{len(self.changes) + 1}"'
+        self.objects[href] = (ical, etag)
+        self.changes.append(href)
+        return etag
+
+    def count(self, method: str) -> int:
+        return len([r for r in self.requests if r[0] == method])
+
+
+class CalDAVHandler(BaseHTTPRequestHandler):
+    server: CalDAVServer
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def __reply(self, status: int, body: str = "", headers: dict = {}) -> None:
+        content: bytes = body.encode()
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if body.startswith("<?xml"):
+            self.send_header("Content-Type", "application/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def __read(self) -> str:
+        with self.server.lock:
+            self.server.requests.append((self.command, self.path, dict(self.headers)))
+        if self.server.on_request:
+            self.server.on_request()
+        return self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+
+    def do_PROPFIND(self) -> None:
+        self.__read()
+        if self.path == CALENDAR:
+            props: str = CALENDAR_PROPS.format(len(self.server.changes))
+            body: str = RESPONSE.format(CALENDAR, props)
+        elif self.path == "/calendars/":
+            body = RESPONSE.format(
+                self.path, "<D:resourcetype><D:collection/></D:resourcetype>"
+            ) + RESPONSE.format(
+                CALENDAR, CALENDAR_PROPS.format(len(self.server.changes))
+            )
+        else:
+            body = RESPONSE.format(
+                self.path,
+                "<D:current-user-principal><D:href>/principal/</D:href>"
+                "</D:current-user-principal>"
+                "<C:calendar-home-set><D:href>/calendars/</D:href>"
+                "</C:calendar-home-set>",
+            )
+        self.__reply(207, MULTISTATUS.format(body))
+
+    def do_REPORT(self) -> None:
+        request: str = self.__read()
+        with self.server.lock:
+            responses: list[str] = []
+            if "sync-collection" in request:
+                match = re.search(r"sync-token>tok-(\d+)<", request)
+                changed: list[str] = self.server.changes[
+                    int(match.group(1)) if match else 0 :
+                ]
+                for href in dict.fromkeys(changed):
+                    etag: str = escape(self.server.objects[href][1])
+                    responses.append(
+                        RESPONSE.format(href, f"<D:getetag>{etag}</D:getetag>")
+                    )
+                responses.append(
+                    f"<D:sync-token>tok-{len(self.server.changes)}</D:sync-token>"
+                )
+            else:
+                for href, (ical, etag) in self.server.objects.items():
+                    props: str = (
+                        f"<D:getetag>{escape(etag)}</D:getetag>"
+                        f"<C:calendar-data>{escape(ical)}</C:calendar-data>"
+                    )
+                    responses.append(RESPONSE.format(href, props))
+        self.__reply(207, MULTISTATUS.format("".join(responses)))
+
+    def do_GET(self) -> None:
+        self.__read()
+        if self.path not in self.server.objects:
+            self.__reply(404)
+            return
+        ical, etag = self.server.objects[self.path]
+        self.__reply(200, ical, {"ETag": etag, "Content-Type": "text/calendar"})
+
+    def do_PUT(self) -> None:
+        ical: str = self.__read()
+        with self.server.lock:
+            current: tuple[str, str] | None = self.server.objects.get(self.path)
+            if_match: str | None = self.headers.get("If-Match")
+            if (if_match and (not current or current[1] != if_match)) or (
+                self.headers.get("If-None-Match") == "*" and current
+            ):
+                self.__reply(412)
+                return
+            etag: str = self.server.put(self.path, ical)
+        self.__reply(204 if current else 201, headers={"ETag": etag})
+
+    def do_DELETE(self) -> None:
+        self.__read()
+        with self.server.lock:
+            self.server.objects.pop(self.path, None)
+            self.server.changes.append(self.path)
+        self.__reply(204)
+
+
+@pytest.fixture
+def server():
+    server: CalDAVServer = CalDAVServer()
+    thread: threading.Thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+@pytest.fixture
+def provider(server: CalDAVServer, tmp_path, monkeypatch) -> SyncProviderCalDAV:
+    settings: dict[str, object] = {
+        "sync-url": server.url,
+        "sync-username": "user",
+        "sync-connect-timeout": 5,
+        "sync-read-timeout": 5,
+        "archive-days": 0,
+        "task-list-new-task-position-top": True,
+        "history-depth": 10,
+    }
+    monkeypatch.setattr(GSettings, "get", lambda setting: settings.get(setting))
+    monkeypatch.setattr(GSettings, "get_secret", lambda account: "password")
+    monkeypatch.setattr(Log, "log_file", str(tmp_path / "log.txt"))
+
+    monkeypatch.setattr(data.GLib, "get_user_data_dir", lambda: str(tmp_path))
+    storage: data.UserDataJSON = data.UserDataJSON()
+    storage.init()
+    monkeypatch.setattr(data.UserData, "storage", storage)
+    # UI is not shown
+    monkeypatch.setattr(
+        SyncProviderCalDAV, "_SyncProviderCalDAV__finish_sync", lambda self: None
+    )
+
+    server.put(CALENDAR + "remote.ics", TODO.format(uid="remote", summary="Remote"))
+    provider: SyncProviderCalDAV = SyncProviderCalDAV(testing=True)
+    assert provider.can_sync
+    provider.sync()
+    server.requests.clear()
+    yield provider
+    provider.close()
+
+
+def test_download(server: CalDAVServer, provider: SyncProviderCalDAV) -> None:
+    assert data.UserData.get_task("tasks", "remote").text == "Remote"
+    assert data.UserData.get_task("tasks", "remote").synced
+
+    # Nothing is changed
+    provider.sync()
+    assert server.count("PUT") == 0
+    assert server.count("GET") == 0
+
+
+def test_create(server: CalDAVServer, provider: SyncProviderCalDAV) -> None:
+    for i in range(3):
+        data.UserData.add_task(list_uid="tasks", uid=f"local{i}", text=f"Local {i}")
+    provider.sync()
+
+    puts: list[str] = [r[1] for r in server.requests if r[0] == "PUT"]
+    assert sorted(puts) == [f"{CALENDAR}local{i}.ics" for i in range(3)]
+    assert server.count("GET") == 0
+    assert all(data.UserData.get_task("tasks", f"local{i}").synced for i in range(3))
+
+    # Own changes are not downloaded or sent again
+    server.requests.clear()
+    provider.sync()
+    assert server.count("PUT") == 0
+    assert server.count("GET") == 0
+
+
+def test_update(server: CalDAVServer, provider: SyncProviderCalDAV) -> None:
+    data.UserData.add_task(list_uid="tasks", uid="local", text="Local")
+    provider.sync()
+    server.requests.clear()
+
+    for uid in ("remote", "local"):
+        data.UserData.update_props("tasks", uid, ["text", "synced"], ["New", False])
+    provider.sync()
+
+    puts: list[tuple[str, str, dict[str, str]]] = [
+        r for r in server.requests if r[0] == "PUT"
+    ]
+    assert sorted(r[1] for r in puts) == [
+        CALENDAR + "local.ics",
+        CALENDAR + "remote.ics",
+    ]
+    assert all("If-Match" in r[2] for r in puts)
+    assert server.count("GET") == 0
+
+    # Properties that Errands doesn't use are kept
+    ical: str = server.objects[CALENDAR + "remote.ics"][0]
+    assert "SUMMARY:New" in ical
+    assert "LOCATION:Office" in ical
+    assert "BEGIN:VALARM" in ical
+
+    # Only local properties are changed
+    server.requests.clear()
+    data.UserData.update_props("tasks", "local", ["notified", "synced"], [True, False])
+    provider.sync()
+    assert server.count("PUT") == 0
+
+
+def test_create_existing(server: CalDAVServer, provider: SyncProviderCalDAV) -> None:
+    # Task created by another client is not in sync report yet
+    server.objects[CALENDAR + "same.ics"] = (
+        TODO.format(uid="same", summary="Remote"),
+        '"same"',
+    )
+    # Href is taken by object with another uid
+    server.put(CALENDAR + "taken.ics", TODO.format(uid="other", summary="Other"))
+    data.UserData.add_task(list_uid="tasks", uid="same", text="Local")
+    data.UserData.add_task(list_uid="tasks", uid="taken", text="Local")
+    provider.sync()
+
+    # Same task is downloaded once and updated with its ETag
+    same: list[tuple[str, str, dict[str, str]]] = [
+        r for r in server.requests if r[1] == CALENDAR + "same.ics"
+    ]
+    assert [r[0] for r in same] == ["PUT", "GET", "PUT"]
+    assert same[2][2]["If-Match"] == '"same"'
+    ical, etag = server.objects[CALENDAR + "same.ics"]
+    assert "SUMMARY:Local" in ical
+    assert "LOCATION:Office" in ical
+    assert provider.sync_state.get_tasks("tasks")["same"].etag == etag
+
+    # Other object is kept
+    assert "SUMMARY:Other" in server.objects[CALENDAR + "taken.ics"][0]
+    href: str = provider.sync_state.get_tasks("tasks")["taken"].href
+    assert href.endswith(".ics") and "taken.ics" not in href
+
+    assert data.UserData.get_task("tasks", "same").synced
+    assert data.UserData.get_task("tasks", "taken").synced
+
+
+def test_local_changes_at_once(
+    server: CalDAVServer, provider: SyncProviderCalDAV
+) -> None:
+    locked: list[bool] = []
+
+    def __on_request() -> None:
+        lock = data.UserData.storage._lock
+        acquired: bool = lock.acquire(blocking=False)
+        if acquired:
+            lock.release()
+        locked.append(not acquired)
+
+    server.on_request = __on_request
+    server.put(CALENDAR + "new.ics", TODO.format(uid="new", summary="New"))
+    for i in range(3):
+        data.UserData.add_task(list_uid="tasks", uid=f"local{i}", text=f"Local {i}")
+    data.UserData.update_props("tasks", "remote", ["text", "synced"], ["New", False])
+    commits: list[int] = []
+    data.UserData.connect_changed(lambda: commits.append(1))
+    provider.sync()
+
+    # Local data is changed at once after requests,
+    # so UI is not blocked by the server
+    assert server.count("PUT") == 4
+    assert locked and not any(locked)
+    assert len(commits) == 1
+    assert data.UserData.get_task("tasks", "new").text == "New"
+    assert all(data.UserData.get_task("tasks", f"local{i}").synced for i in range(3))
+    assert data.UserData.get_task("tasks", "remote").synced